@@ -3,34 +3,21 @@
 # For the automated RoboCTAB implementation, please cite:"Recent advances in robotic DNA extraction have improved throughput for large-scale genotyping studies (Boucher St-Amour et al., 2025)."
 # As complement, a graphical representation of the labware disposition on the deck can be found here: https://docs.google.com/presentation/d/1JAKohkoa89mKwnr0rshk1j7QGQOGtWpTiSLGF0zlCcg/edit?usp=sharing
 
-############################################################
-# Enter your values at lines 7 to 24 
-first_column_plate_1 = 1                                # The first column in plate 1 for which you have samples.
-last_column_plate_1  = 12                               # The last column in plate 1 for which you have samples.
-first_column_plate_2 = 1
-last_column_plate_2  = 12
-first_column_plate_3 = 1
-last_column_plate_3  = 12
-first_column_plate_4 = 1
-last_column_plate_4  = 12     
-
-elution_buffer_volume = 40                              # Set the volume of Elution buffer (uL) that will be used to resuspend your DNA after isolation.
-tipsbox = 'opentrons_96_tiprack_300ul'                  # Enter the API name of your tipracks labware (300 uL without filters needed). 
-samples_plate_type = '1.2ml_simport_vwr_t1102_96well'   # Enter the API name for the plate.s in which the samples were collected. This protocol is optimized for 1.2ml 96-well plates.
-final_plate_type = '1.2ml_simport_vwr_t1102_96well'     # Enter the API name for the final plate.s in which the aquous phase (DNA) will be transfered too. This protocol is optimized for 1.2ml 96-well plates.
-reservoir_type = 'agilent_1_reservoir_290ml'            # The reservoir must have a minimum capacity of 200ml.
-chloroform_buffer_mixing = 'pipette_mixing'             # String: 'pipette_mixing' or 'bubble_mixing' or 'no_mixing'. When 'pipette_mixing' is selected, the robot will mix by doing inspirations and expulsions in the liquids. Select this option if your samples have 5mg or less of WELL GROUNDED material, otherwise the pipettes could block. When selecting 'bubble_mixing' the robot will blow air in the liquids. Select this method if your samples are over 5 mg and the grinding is poor. When selecting 'no_mixing', the robot will simply add the chloroform to the wells and emulsion/mixing will have to be done by either vortexing or inversions.
-pipetteOff_isopropanol = False                          # If set to True, the robot will discard by pipetting-off the wash solution (isopropanol). If set to False the user will have to gently invert the plate to poor off and the discard the isopropanol.
-pipetteOff_ethanol = False                              # If set to True, the robot will discard by pipetting-off the wash solution (ethanol). If set to False the user will have to gently invert the plate to poor off and the discard the ethanol.
-distance_interstice_to_bottom = 14                      # To obtain this value, add 400uL of water to an empty tube of the "samples_plate_type" and measure the heigth (mm) of the liquid from the botom of the tube.
-############################################################
+# The run settings (sample columns, labware, mixing mode...) are run-time parameters chosen in the Opentrons App, see add_parameters().
 
 
 # Running the Opentrons API
 from opentrons import protocol_api
 from opentrons import types
+import csv
+import itertools
+import json
 import math
+import numbers
+import os
+import socket
 import time
+import uuid
 
 metadata = {
     'protocolName': 'RoboCTAB -- v1.1 -- Flex',
@@ -43,529 +30,1536 @@ requirements = {
     'apiLevel': '2.22'
 }
 
-def get_values(*names):
-    import json
-    _all_values = json.loads("""{}""")
-    return [_all_values[n] for n in names]
-
-# Defining the total number of columns with samples in each plates
-if first_column_plate_1 == 0 : number_of_columns_plate_1 = 0 
-else: number_of_columns_plate_1 = (last_column_plate_1-first_column_plate_1 + 1)
-if first_column_plate_2 == 0 : number_of_columns_plate_2 = 0 
-else: number_of_columns_plate_2 = (last_column_plate_2-first_column_plate_2 + 1)
-if first_column_plate_3 == 0 : number_of_columns_plate_3 = 0 
-else: number_of_columns_plate_3 = (last_column_plate_3-first_column_plate_3 + 1)
-if first_column_plate_4 == 0 : number_of_columns_plate_4 = 0 
-else: number_of_columns_plate_4 = (last_column_plate_4-first_column_plate_4 + 1)
-total_number_of_columns = number_of_columns_plate_1 + number_of_columns_plate_2 + number_of_columns_plate_3 + number_of_columns_plate_4
+# Run-time parameters: set in the Opentrons App (or on the Flex touchscreen) before each run, the protocol file is never edited.
+# The defaults are used for the initial analysis. Descriptions are limited to 100 characters by the API.
+def add_parameters(parameters):
+    for plate in range(1, 5):
+        parameters.add_int(variable_name = f'first_column_plate_{plate}', display_name = f'Plate {plate} first column', default = 1, minimum = 0, maximum = 12,
+                           description = f'The first column in plate {plate} for which you have samples (0: no plate {plate}).')
+        parameters.add_int(variable_name = f'last_column_plate_{plate}', display_name = f'Plate {plate} last column', default = 12, minimum = 1, maximum = 12,
+                           description = f'The last column in plate {plate} for which you have samples.')
+    parameters.add_bool(variable_name = 'use_sample_manifest', display_name = 'Sample manifest', default = False,
+                        description = 'Pipette the columns listed in the sample manifest file, not the column ranges.')
+    parameters.add_csv_file(variable_name = 'sample_manifest', display_name = 'Sample manifest file',
+                            description = 'CSV file with the plate and the column (or well) of every sample (see README).')
+
+    parameters.add_str(variable_name = 'pipette_mode', display_name = 'Pipette', default = '8_channel',
+                       description = '96-channel: reagents, transfers and washes done a whole plate at a time (full plates only).',
+                       choices = [{'display_name': '8-channel 1000uL', 'value': '8_channel'},
+                                  {'display_name': '96-channel 1000uL', 'value': '96_channel'}])
+    parameters.add_bool(variable_name = 'use_gripper', display_name = 'Gripper labware swaps', default = False,
+                        description = 'The gripper swaps the labware from the staging slots B4, C4 and D4 instead of the operator.')
+    parameters.add_int(variable_name = 'elution_buffer_volume', display_name = 'Elution buffer volume', unit = 'uL', default = 40, minimum = 10, maximum = 200,
+                       description = 'Volume of Elution buffer used to resuspend your DNA after isolation.')
+    parameters.add_str(variable_name = 'tipsbox', display_name = 'Tipracks', default = 'opentrons_96_tiprack_300ul',
+                       description = 'Tipracks labware (300 uL without filters needed).',
+                       choices = [{'display_name': 'Opentrons 300uL', 'value': 'opentrons_96_tiprack_300ul'},
+                                  {'display_name': 'Opentrons Flex 1000uL', 'value': 'opentrons_flex_96_tiprack_1000ul'}])
+    parameters.add_str(variable_name = 'samples_plate_type', display_name = 'Samples plates', default = '1.2ml_simport_vwr_t1102_96well',
+                       description = 'Plates in which the samples were collected (optimized for 1.2ml 96-well plates).',
+                       choices = [{'display_name': 'Simport 1.2ml 96-well', 'value': '1.2ml_simport_vwr_t1102_96well'},
+                                  {'display_name': 'NEST 2ml 96 deep well', 'value': 'nest_96_wellplate_2ml_deep'}])
+    parameters.add_str(variable_name = 'final_plate_type', display_name = 'Final plates', default = '1.2ml_simport_vwr_t1102_96well',
+                       description = 'Plates receiving the aqueous phase (DNA), optimized for 1.2ml 96-well plates.',
+                       choices = [{'display_name': 'Simport 1.2ml 96-well', 'value': '1.2ml_simport_vwr_t1102_96well'},
+                                  {'display_name': 'NEST 2ml 96 deep well', 'value': 'nest_96_wellplate_2ml_deep'}])
+    parameters.add_str(variable_name = 'reservoir_type', display_name = 'Reservoirs', default = 'agilent_1_reservoir_290ml',
+                       description = 'The reservoirs must have a minimum capacity of 200ml.',
+                       choices = [{'display_name': 'Agilent 1 well 290mL', 'value': 'agilent_1_reservoir_290ml'},
+                                  {'display_name': 'NEST 1 well 290mL', 'value': 'nest_1_reservoir_290ml'}])
+    parameters.add_str(variable_name = 'chloroform_buffer_mixing', display_name = 'Chloroform mixing', default = 'pipette_mixing',
+                       description = 'Pipette: 5mg or less of WELL GROUNDED material. Bubble: over 5mg or poor grinding.',
+                       choices = [{'display_name': 'Pipette mixing', 'value': 'pipette_mixing'},
+                                  {'display_name': 'Bubble mixing', 'value': 'bubble_mixing'},
+                                  {'display_name': 'No mixing (vortex)', 'value': 'no_mixing'},
+                                  {'display_name': 'Heater-Shaker', 'value': 'heater_shaker'}])
+    parameters.add_bool(variable_name = 'pipetteOff_isopropanol', display_name = 'Pipette off isopropanol', default = False,
+                        description = 'On: the robot pipettes off the isopropanol. Off: invert the plates to pour it off.')
+    parameters.add_bool(variable_name = 'pipetteOff_ethanol', display_name = 'Pipette off ethanol', default = False,
+                        description = 'On: the robot pipettes off the ethanol. Off: invert the plates to pour it off.')
+    parameters.add_float(variable_name = 'distance_interstice_to_bottom', display_name = 'Interstice height', unit = 'mm', default = 0.0, minimum = 0.0, maximum = 30.0,
+                         description = 'Height (from the bottom) of 400uL of water in a samples tube (0: calibrated, else 14 mm).')
+    parameters.add_str(variable_name = 'supernatant_transfer_mode', display_name = 'Supernatant transfer', default = 'optimised',
+                       description = 'Optimised: same volumes and heights with shorter tip moves. Standard: original transfer.',
+                       choices = [{'display_name': 'Optimised', 'value': 'optimised'},
+                                  {'display_name': 'Standard', 'value': 'standard'}])
+    parameters.add_bool(variable_name = 'optimise_gantry_paths', display_name = 'Optimise gantry paths', default = True,
+                        description = 'Aspirate in front of the destination columns and cross the plates in serpentine.')
+    parameters.add_bool(variable_name = 'stagger_plates', display_name = 'Staggered plates', default = False,
+                        description = 'Each plate goes to incubation and centrifugation once done (more operator stops).')
+
+# Calibration constants of the timing model (TimedPipette) used for the time estimates
+timing_calibration = {
+    'xy_speed': 300,                # mm/s, maximum gantry speed in X/Y
+    'z_speed': 100,                 # mm/s, maximum speed of the pipette mount (Z axis)
+    'arc_clearance': 10,            # mm, height above the labware cleared when moving between wells
+    'command_overhead': 0.3,        # s, acceleration and communication time added to every command
+    'blow_out': 1.0,                # s
+    'pick_up_tip': 3.0,             # s, pressing the tips on and lifting them out of the rack
+    'drop_tip': 2.0,                # s
+    'home_plunger': 1.5,            # s, done after drop_tip() unless home_after = False
+    'unknown_move': 4.0,            # s, moves to locations without known coordinates (labware still off deck, trash bin)
+}
+
+# Deck slots available to the labware in order of preference, with the position (mm) of their front left corner (the trash is on slot A3)
+deck_slots = {'D1': (0, 0),   'D2': (164, 0),   'D3': (328, 0),
+              'C1': (0, 107), 'C2': (164, 107), 'C3': (328, 107),
+              'B1': (0, 214), 'B2': (164, 214), 'B3': (328, 214),
+              'A1': (0, 321), 'A2': (164, 321)}
+
+# 96-channel pipette of the full-plate mode (run-time parameter pipette_mode), its tipracks and the adapter they sit on for 96-tip pick-ups
+full_plate_pipette = {'name': 'flex_96channel_1000', 'adapter': 'opentrons_flex_96_tiprack_adapter', 'tipracks': ['opentrons_flex_96_tiprack_1000ul']}
+
+# Staging area slots holding the labware the gripper swaps on and off the deck (run-time parameter use_gripper).
+# A4 cannot be used: its staging area fixture would take the place of the trash bin on A3.
+gripper_staging_slots = ['B4', 'C4', 'D4']
+
+# Heater-Shaker module of the 'heater_shaker' chloroform mixing mode: its slot (column 1 or 3), the Flex pipettes reach every slot beside it
+heater_shaker_slots = {'module': 'A1', 'blocked': [], 'tipracks_only': []}
+
+# Liquid classes: how each reagent is pipetted by every step (volumes in uL, rates relative to the default flow rates, speeds in mm/s,
+# heights in mm, dwell in s). The keys of the first line of a class are the ones distribute() uses; the sections below them hold the
+# settings of the other steps handling that liquid. Tuning a reagent is a change of this table, checked by check_liquid_classes()
+# before the run and measured with tools/benchmark.py --liquid.
+liquid_classes = {
+    'te_water':           {'speed': 400, 'dispense_speed': 100, 'aspirate_z': 2.5,  'aspirate_rate': 1,    'dwell': 0,   'liquid_cap': 0,  'liquid_cap_air': 0,  'leading_air_gap': 0,  'air_gap': 10, 'dispense_from': 'bottom', 'dispense_rate': 1,   'touch_tip': None, 'return_to_source': 'blow_out'},
+
+    'extraction_buffer':  {'speed': 400, 'dispense_speed': 400, 'aspirate_z': 2,    'aspirate_rate': 0.85, 'dwell': 1.5, 'liquid_cap': 0,  'liquid_cap_air': 0,  'leading_air_gap': 40, 'air_gap': 0,  'dispense_from': 'top',    'dispense_rate': 2,   'touch_tip': None, 'return_to_source': 'dispense',
+                           'suck_back': 20,                                     # Drop caught at the dispense height and returned to the reservoir
+                           'supernatant': {'volumes': (290, 85),                # Aqueous phase after centrifugation, first and second aspirations
+                                           'interstice_z': (3.25, 2.5),         # mm above the interstice, clear of the chloroform phase
+                                           'descent_speeds': (15, 7),
+                                           'aspirate_rates': (0.6, 0.2),
+                                           'dispense_rates': (1, 2.5),
+                                           'dispense_speed': 200,
+                                           'air_gap': 10,
+                                           'blow_out_z': -1,
+                                           'touch_tip': {'v_offset': -3, 'radius': 1.2, 'speed': 40}}},
+
+    'chloroform_isoamyl': {'speed': 400, 'dispense_speed': 200, 'aspirate_z': 2.5,  'aspirate_rate': 4,    'dwell': 0,   'liquid_cap': 40, 'liquid_cap_air': 55, 'leading_air_gap': 5,  'air_gap': 10, 'dispense_from': 'top',    'dispense_rate': 1,   'touch_tip': {'v_offset': -3, 'radius': 1.2, 'speed': 40}, 'return_to_source': 'dispense',
+                           'liquid_cap_rate': 4,                                # Water "Liquid-Cap" keeping the volatile chloroform in the tip
+                           'dispense_volume': 200,                              # Two dispensings per sample, the first one from the top of the well
+                           'first_dispense_z': 9,
+                           'pipette_mixing': {'aspirations': ((200, 5), (193, 2)),     # (chloroform, air gap) of the two dispensings of 'dispense_volume'
+                                              'dispense_volume': 195,
+                                              'interstice_dispense_z': 6,       # mm from the interstice: second dispensing and mixing dispenses,
+                                              'interstice_mix_z': -7,      # mixing aspirations in the organic phase
+                                              'mix_volume': 130,
+                                              'aspirate_rate': 2, 'mix_aspirate_rate': 0.7, 'mix_dispense_rate': 2, 'cycles': 5},
+                           'bubble_mixing': {'interstice_dispense_z': -2,       # mm from the interstice: second dispensing and air bubbles
+                                             'air_volumes': (205, 160, 180),    # Air aspirated above the well, blown at every cycle, blown last
+                                             'mix_aspirate_rate': 4, 'mix_dispense_rate': 1, 'cycles': 10},
+                           'heater_shaker': {'shake_speed': 1500, 'shake_time': 120}},     # Emulsion shaken in the sealed plates (rpm, s)
+
+    'isopropanol':        {'speed': 400, 'dispense_speed': 400, 'aspirate_z': 2.5,  'aspirate_rate': 1,    'dwell': 0,   'liquid_cap': 0,  'liquid_cap_air': 0,  'leading_air_gap': 5,  'air_gap': 10, 'dispense_from': 'top',    'dispense_rate': 1,   'touch_tip': None, 'return_to_source': 'dispense',
+                           'removal': {'tip_blow_out_z': 21.5,                  # Pipetting off: drops blown on the tiprack walls, then three aspirations
+                                       'aspirations': ((295, 8), (295, 4), (70, 1.75)),    # (uL, lowest height; the first two follow the surface)
+                                       'air_gap_release_z': (14, 11),           # Heights the air gap of the previous trip is released at
+                                       'aspirate_rates': (0.7, 0.4, 0.1),
+                                       'descent_speed': 30,
+                                       'air_gap': 5,
+                                       'dispense_rate': 2}},
+
+    'ethanol_70':         {'speed': 400, 'dispense_speed': 400, 'aspirate_z': 2.5,  'aspirate_rate': 1.5,  'dwell': 0,   'liquid_cap': 0,  'liquid_cap_air': 0,  'leading_air_gap': 5,  'air_gap': 0,  'dispense_from': 'top',    'dispense_rate': 0.8, 'touch_tip': None, 'return_to_source': 'blow_out',
+                           'blow_out_z': 4,                                     # Above the well, after dispensing on its side wall
+                           'removal': {'tip_blow_out_z': 21,
+                                       'aspirations': ((200, 5), (60, 3), (35, 2)),        # (uL, lowest height; the first two follow the surface)
+                                       'aspirate_rates': (0.7, 0.2, 0.1),
+                                       'descent_speeds': (20, 10),
+                                       'air_gap': 5}},
+
+    'elution_buffer':     {'speed': 400, 'dispense_speed': 100, 'aspirate_z': 1.75, 'aspirate_rate': 1,    'dwell': 0,   'liquid_cap': 0,  'liquid_cap_air': 0,  'leading_air_gap': 0,  'air_gap': 10, 'dispense_from': 'bottom', 'dispense_rate': 1,   'touch_tip': {'v_offset': 0.1, 'radius': 0.5, 'speed': 60}, 'return_to_source': 'blow_out'},
+}
+
+def check_liquid_classes(classes):
+    # Raises a ValueError naming the first setting of "classes" the steps cannot use (missing key, negative volume, null rate...)
+    required = list(classes['te_water'])
+    for name, liquid in classes.items():
+        missing = [key for key in required if key not in liquid]
+        if missing:
+            raise ValueError(f'Liquid class {name}: missing {", ".join(missing)}')
+        if liquid['dispense_from'] not in ('top', 'bottom'):
+            raise ValueError(f'Liquid class {name}: dispense_from must be top or bottom, not {liquid["dispense_from"]!r}')
+        if liquid['return_to_source'] not in ('blow_out', 'dispense'):
+            raise ValueError(f'Liquid class {name}: return_to_source must be blow_out or dispense, not {liquid["return_to_source"]!r}')
+        if liquid['liquid_cap'] > 0 and 'liquid_cap_rate' not in liquid:
+            raise ValueError(f'Liquid class {name}: a liquid_cap needs a liquid_cap_rate')
+
+        def check(path, key, value):
+            if isinstance(value, dict):
+                if key == 'touch_tip' and sorted(value) != ['radius', 'speed', 'v_offset']:
+                    raise ValueError(f'Liquid class {path}: touch_tip needs v_offset, radius and speed')
+                for sub_key, sub_value in value.items():
+                    check(f'{path}.{sub_key}', sub_key, sub_value)
+            elif isinstance(value, (tuple, list)):
+                for item in value:
+                    check(path, key, item)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                if ('rate' in key or 'speed' in key or key == 'radius') and value <= 0:
+                    raise ValueError(f'Liquid class {path}: {value} must be greater than 0')
+                if key.endswith('_z') or key == 'v_offset':                 # Heights can be under the top of a well
+                    return
+                if value < 0:
+                    raise ValueError(f'Liquid class {path}: {value} cannot be negative')
+        for key, value in liquid.items():
+            check(f'{name}.{key}', key, value)
+
+# Well positions: Well.top() and Well.bottom() ask the protocol engine for the well position and build the well name of the Location
+# they return, about 70 us a call. The timing model, the well volume model and the gantry paths only need the deck coordinates of the
+# top of the wells (the bottom is "depth" mm lower): they are computed once per well and labware position, a labware moved is looked up again.
+well_tops = {}
+
+def well_top(well):
+    labware = well.parent
+    position = labware.parent
+    key = (id(labware), position if isinstance(position, str) else id(position), well.well_name)
+    if key not in well_tops:
+        well_tops[key] = well.top().point
+    return well_tops[key]
+
+# Timing model: stands in for the pipette while a step function is dry-run (see estimate_step_time() in run)
+# and adds up the time its commands take from move distances, gantry speeds, flow rates, dwells and touch-tip speeds.
+class TimedPipette:
+
+    def __init__(self, pipette, ctx, trash):
+        self.pipette = pipette
+        self.trash = trash
+        self.default_speed = pipette.default_speed
+        self.current_volume = 0
+        self.seconds = 0
+        self.commands = 0
+        self.counts = {}                        # Times every timing_calibration constant was added (see tools/step_log_report.py)
+        self.dwell_seconds = 0
+        self.distance = 0                       # mm travelled in X/Y between known locations
+        self.position = None
+        self.well = None
+        self.tip = None
+        self.deck_safe_z = max([self._highest_z(labware) for labware in ctx.loaded_labwares.values()] + [0]) + timing_calibration['arc_clearance']
+
+    def __getattr__(self, name):                # max_volume, tip_racks, flow_rate... are read from the real pipette
+        return getattr(self.pipette, name)
+
+    def _highest_z(self, labware):
+        try:
+            return labware.highest_z
+        except Exception:                       # Labware waiting off deck
+            return 0
+
+    def _point(self, location):                 # Deck coordinates of a Location or Well, None when they are unknown (off deck labware, trash bin)
+        try:
+            if hasattr(location, 'point'):
+                return location.point
+            if hasattr(location, 'bottom'):
+                return well_top(location)
+        except Exception:
+            pass
+        return None
+
+    def _well(self, location):
+        if hasattr(location, 'point'):
+            return location.labware.as_well()
+        if hasattr(location, 'bottom'):
+            return location
+        return None
+
+    def _count(self, constant):
+        self.counts[constant] = self.counts.get(constant, 0) + 1
+
+    def _command(self, seconds, constant = None):     # "constant": the timing_calibration constant "seconds" comes from
+        self.seconds += seconds + timing_calibration['command_overhead']
+        self.commands += 1
+        self._count('command_overhead')
+        if constant:
+            self._count(constant)
+
+    def _move(self, location, speed = None):
+        speed = min(speed or self.default_speed, timing_calibration['xy_speed'])
+        z_speed = min(speed, timing_calibration['z_speed'])
+        point = self._point(location)
+        well = self._well(location)
+
+        if point is None or self.position is None:
+            seconds = timing_calibration['unknown_move']
+            self._count('unknown_move')
+        elif well is not None and well is self.well:            # Straight move inside the same well
+            seconds = max(abs(point.z - self.position.z) / z_speed, math.hypot(point.x - self.position.x, point.y - self.position.y) / speed)
+        else:                                                   # Arc: up to a safe height, across, then down
+            if well is not None and self.well is not None and well.parent is self.well.parent:
+                safe_z = self._highest_z(well.parent) + timing_calibration['arc_clearance']
+            else:
+                safe_z = self.deck_safe_z
+            seconds = (max(safe_z - self.position.z, 0) + max(safe_z - point.z, 0)) / z_speed + math.hypot(point.x - self.position.x, point.y - self.position.y) / speed
+
+        if point is not None and self.position is not None:
+            self.distance += math.hypot(point.x - self.position.x, point.y - self.position.y)
+        self.seconds += seconds
+        self.position = point
+        self.well = well
+
+    def _plunger(self, volume, flow_rate):
+        self._command(volume / flow_rate)
+
+    def aspirate(self, volume = None, location = None, rate = 1.0):
+        if location is not None:
+            self._move(location)
+        self._plunger(volume, self.pipette.flow_rate.aspirate * rate)
+        self.current_volume += volume
+
+    def dispense(self, volume = None, location = None, rate = 1.0):
+        if location is not None:
+            self._move(location)
+        volume = self.current_volume if volume is None else volume
+        self._plunger(volume, self.pipette.flow_rate.dispense * rate)
+        self.current_volume = max(self.current_volume - volume, 0)
+
+    def air_gap(self, volume = None):
+        if self.well is not None:
+            self._move(self.well.top())
+        self.aspirate(volume)
+
+    def blow_out(self, location = None):
+        if location is not None:
+            self._move(location)
+        self._command(timing_calibration['blow_out'], 'blow_out')
+        self.current_volume = 0
+
+    def touch_tip(self, location = None, radius = 1.0, v_offset = -1.0, speed = 60.0):
+        well = self.well if location is None else location
+        self._move(well.top(z = v_offset))
+        well_radius = (well.diameter or min(well.width, well.length)) / 2 * radius
+        self._command((5 + math.sqrt(2)) * well_radius / speed)          # Center -> +x -> -x -> +y -> -y
+
+    def move_to(self, location, speed = None, **kwargs):
+        self._move(location, speed)
+        self._command(0)
+
+    def pick_up_tip(self, location = None, **kwargs):
+        if location is None:
+            location = self.pipette.starting_tip or self.pipette.tip_racks[0].wells()[0]
+        self._move(location)
+        self._command(timing_calibration['pick_up_tip'], 'pick_up_tip')
+        self.tip = location
+
+    def drop_tip(self, location = None, home_after = None):
+        self._move(self.trash if location is None else location)
+        self._command(timing_calibration['drop_tip'], 'drop_tip')
+        if home_after is not False:
+            self._command(timing_calibration['home_plunger'], 'home_plunger')
+        self.current_volume = 0
+
+    def return_tip(self, home_after = None):
+        self.drop_tip(self.tip, home_after = home_after)
+
+    def wait(self, seconds):
+        self._command(seconds)
+        self.dwell_seconds += seconds
+
+# Dwells (liquid class 'dwell'): the pipette is held still with a robot delay, which the run log shows and which analysis and
+# simulation skip instead of waiting. While a step is dry-run the timing model counts it instead.
+def hold_pipette(ctx, pipette, seconds):
+    if isinstance(pipette, TimedPipette):
+        pipette.wait(seconds)
+    else:
+        ctx.delay(seconds = seconds)
+
+# Well volume model: liquid height (mm from the bottom) of "volume" uL in "well", the well being taken as a straight tube of its mean
+# cross-section (max volume / depth). A round or conical bottom is narrower than that mean, so low volumes stand higher than computed.
+def liquid_height(well, volume):
+    return max(volume, 0) / (well.max_volume / well.depth)
+
+# Follows the liquid volume of every well of the "plates" (samples and final plates) through every aspiration and dispense
+# of the pipette it wraps (the robot pipette or the timing model), all other calls go to the pipette. Multi-channel pipettes
+# are followed through the well of the first row, which stands for its column (A1 stands for the plate with the 96-channel pipette).
+# Aspirations from the top of the wells (air gaps) take no liquid, the air in the tip is taken as part of the first dispense.
+class TrackedPipette:
+
+    own_attributes = ('pipette', 'plates', 'volumes', 'liquid_in_tip', 'location')
+
+    def __init__(self, pipette, plates, volumes = None):
+        self.pipette = pipette
+        self.plates = plates
+        self.volumes = dict(volumes or {})      # uL in every followed well by (plate id, well name), empty wells are missing
+        self.liquid_in_tip = 0
+        self.location = None
+
+    def __getattr__(self, name):
+        return getattr(self.pipette, name)
+
+    def __setattr__(self, name, value):         # default_speed... are set on the wrapped pipette
+        if name in self.own_attributes:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.pipette, name, value)
+
+    def _followed(self, well):
+        return well is not None and any(well.parent is plate for plate in self.plates)
+
+    def _key(self, well):                       # Wells hash from their position, unknown while their plate waits off deck
+        return (id(well.parent), well.well_name)
+
+    def volume(self, well):                     # uL in "well"
+        return self.volumes.get(self._key(well), 0)
+
+    def empty(self, well):                      # The liquid of "well" was removed by hand (plate inverted to pour it off)
+        self.volumes.pop(self._key(well), None)
+
+    def _level(self, location):                 # (well, height of the location from its bottom), well None when the location is not in a well
+        if location is None:
+            location = self.location
+        self.location = location
+        if hasattr(location, 'point'):
+            well = location.labware.as_well() if location.labware.is_well else None
+            return well, (location.point.z - (well_top(well).z - well.depth) if well is not None else None)
+        if hasattr(location, 'bottom'):
+            return location, 1                  # The pipette goes 1mm above the bottom of wells given without height
+        return None, None
+
+    def aspirate(self, volume = None, location = None, rate = 1.0, **kwargs):
+        well, z = self._level(location)
+        if well is None or z >= well.depth:
+            liquid = 0
+        elif self._followed(well):
+            liquid = min(volume, self.volume(well))
+            self.volumes[self._key(well)] = self.volume(well) - liquid
+        else:                                   # Reservoirs
+            liquid = volume
+        self.liquid_in_tip += liquid
+        return self.pipette.aspirate(volume, location, rate = rate, **kwargs)
+
+    def dispense(self, volume = None, location = None, rate = 1.0, **kwargs):
+        well, z = self._level(location)
+        liquid = min(self.pipette.current_volume if volume is None else volume, self.liquid_in_tip)
+        if self._followed(well):
+            self.volumes[self._key(well)] = self.volume(well) + liquid
+        self.liquid_in_tip -= liquid
+        return self.pipette.dispense(volume, location, rate = rate, **kwargs)
+
+    def blow_out(self, location = None, **kwargs):
+        well, z = self._level(location)
+        if self._followed(well):
+            self.volumes[self._key(well)] = self.volume(well) + self.liquid_in_tip
+        self.liquid_in_tip = 0
+        return self.pipette.blow_out(location, **kwargs)
+
+    def drop_tip(self, location = None, **kwargs):
+        self.liquid_in_tip = 0
+        return self.pipette.drop_tip(location, **kwargs)
+
+    def return_tip(self, **kwargs):
+        self.liquid_in_tip = 0
+        return self.pipette.return_tip(**kwargs)
+
+# Sample plates to extract as (plate number, columns holding samples) from the (first, last) columns of plates 1 to 4. Plates
+# without samples (first column = 0) are skipped, so any combination of plates can be extracted (e.g. plates 1 and 3 only).
+def samples_to_extract(column_ranges):
+    sample_plates = []
+    for plate, (first, last) in enumerate(column_ranges, start = 1):
+        if first == 0:
+            continue
+        if not 1 <= first <= last <= 12:
+            raise ValueError(f'Plate {plate}: the last column ({last}) cannot be before the first column ({first})')
+        sample_plates.append((plate, list(range(first, last + 1))))
+    return sample_plates
+
+# Sample manifest (run-time parameters use_sample_manifest and sample_manifest): a CSV file with a plate (1 to 4) and a column (1 to 12)
+# or a well (e.g. B7) on every row, one row per column or per sample, the other fields (sample names...) being ignored. Only the columns
+# it lists are pipetted, in any order and with gaps, e.g. for the sparse plates of re-extraction batches.
+plate_well_names = {f'{row}{column}' for row in 'ABCDEFGH' for column in range(1, 13)}
+
+def read_sample_manifest(manifest):
+    # Sample plates to extract from the "manifest" file, as samples_to_extract() returns them. Raises a ValueError naming the first bad row.
+    # Fields past the header (a trailing comma) have no name and are skipped, and a UTF-8 byte order mark before the header is ignored.
+    columns = {}
+    for line, row in enumerate(csv.DictReader(manifest), start = 2):
+        row = {key.lstrip('\ufeff').strip().lower(): (value or '').strip() for key, value in row.items() if key is not None}
+        try:
+            plate = int(row['plate'])
+            column = int(row['column']) if row.get('column') else int(row['well'][1:])
+        except (KeyError, ValueError):
+            raise ValueError(f'Sample manifest line {line}: a plate and a column (or a well) are needed')
+        if not row.get('column') and row['well'].upper() not in plate_well_names:
+            raise ValueError(f'Sample manifest line {line}: {row["well"]} is not a well of the samples plates (A1 to H12)')
+        if not (1 <= plate <= 4 and 1 <= column <= 12):
+            raise ValueError(f'Sample manifest line {line}: plate {plate} column {column} is not on plates 1 to 4, columns 1 to 12')
+        columns.setdefault(plate, set()).add(column)
+    if not columns:
+        raise ValueError('Sample manifest: no sample listed')
+    return [(plate, sorted(columns[plate])) for plate in sorted(columns)]
+
+# Deck planner: decides in which slot every labware sits, for any number of sample plates the deck can hold.
+# The run is split in stages: 0 = TE buffer to chloroform (sample plates), 1 to n = supernatant transfer batches,
+# n + 1 = isopropanol, ethanol and elution buffer (final plates). A labware keeps one slot from the first to the last stage
+# it is needed at. Slots are shared only when the deck is full, as every shared slot costs the operator a removal and a placement.
+def plan_reagent_tips(sample_plates, mixing_tipracks, keep_transfer_tipracks, strategy):
+    # Rack and column (0 to 11) of the tips of every reagent step (8-channel pipette). "strategy" tells where they come from:
+    # 'stage_racks': the first stage takes the columns the samples leave free in the mixing tipracks (tiprack 1 without mixing) and
+    # the washes take tiprack 9, 'transfer_spares': the washes take the columns the samples leave free in the transfer tipracks,
+    # 'shared_rack': tiprack 9 holds the tips of every reagent and stays on the deck for the whole run.
+    # Returns None when the strategy cannot supply the tips (not enough free columns).
+    plates = [plate for plate, columns in sample_plates]
+    first_stage = ['TE buffer dispensing'] + ([] if mixing_tipracks else ['Chloroform dispensing'])
+    wash_stage = ['Isopropanol dispensing', 'Ethanol dispensing', 'Elution buffer dispensing']
+    def spare_columns(rack):                    # Columns of the "rack" of every plate not used by its samples, fullest racks first
+        spares = [[(f'{rack}_{plate}', column) for column in range(12) if column + 1 not in columns] for plate, columns in sample_plates]
+        return [tip for tips in sorted(spares, key = len, reverse = True) for tip in tips]
+    if strategy == 'shared_rack':
+        return {step: ('tiprack_9', column) for column, step in enumerate(first_stage + wash_stage)}
+    reagent_tips = {}
+    if mixing_tipracks:                         # No free column: the TE buffer tip is returned and reused for the first chloroform mixing
+        first = sample_plates[0][1][0]
+        reagent_tips['TE buffer dispensing'] = (spare_columns('tiprack') or [(f'tiprack_{plates[0]}', first - 1)])[0]
+    else:
+        reagent_tips.update({step: (f'tiprack_{plates[0]}', column) for column, step in enumerate(first_stage)})
+    if strategy == 'transfer_spares':
+        spares = spare_columns('transfer_tiprack')
+        if len(spares) < len(wash_stage):
+            return None
+        reagent_tips.update(zip(wash_stage, spares))
+    else:
+        reagent_tips.update({step: ('tiprack_9', column) for column, step in enumerate(wash_stage)})
+    return reagent_tips
+
+def labware_lifetimes(batches, mixing_tipracks, keep_transfer_tipracks, full_plate = False, reagent_tips = None):
+    # First and last stage at which every labware is needed, in loading priority order. In the full-plate mode (96-channel pipette)
+    # the reagents are dispensed with the reagent tiprack, replaced by the operator before each reagent, instead of the "reagent_tips"
+    # racks (see plan_reagent_tips()). A tiprack supplying reagent tips stays on the deck until its last reagent step.
+    wash_stage = len(batches) + 1
+    plates = [plate for batch in batches for plate in batch]
+    reagent_racks = {}
+    for step, (rack, column) in (reagent_tips or {}).items():
+        stage = 0 if step in ('TE buffer dispensing', 'Chloroform dispensing') else wash_stage
+        first, last = reagent_racks.get(rack, (stage, stage))
+        reagent_racks[rack] = (min(first, stage), max(last, stage))
+    lifetimes = {}
+    for stage, batch in enumerate(batches, start = 1):
+        for plate in batch:
+            lifetimes[f'samples_plate_{plate}'] = (0, stage)
+    lifetimes['reservoir_1'] = (0, wash_stage)
+    if full_plate:
+        lifetimes['reagent_tiprack'] = (0, wash_stage)
+    for plate in (plates if mixing_tipracks else []):     # One tip column per sample column for the chloroform mixing
+        lifetimes[f'tiprack_{plate}'] = (0, 0)
+    for rack, lifetime in reagent_racks.items():
+        if rack.startswith('tiprack_') and rack not in lifetimes and rack != 'tiprack_9':
+            lifetimes[rack] = lifetime
+    lifetimes['water_reservoir'] = (0, 0)
+    for stage, batch in enumerate(batches, start = 1):
+        for plate in batch:
+            lifetimes[f'final_plate_{plate}'] = (stage, wash_stage)
+            lifetimes[f'transfer_tiprack_{plate}'] = (stage, wash_stage if keep_transfer_tipracks else stage)   # Transfer tips are reused to pipette-off the washes
+            if f'transfer_tiprack_{plate}' in reagent_racks:
+                lifetimes[f'transfer_tiprack_{plate}'] = (stage, wash_stage)
+    if 'tiprack_9' in reagent_racks:
+        lifetimes['tiprack_9'] = reagent_racks['tiprack_9']
+    return lifetimes
+
+def assign_slots(lifetimes, order, slots, tipracks_on_adapters = False, tiprack_slots = ()):
+    # Gives every labware (taken in "order") a slot free over its whole lifetime. Slots not used yet are preferred (no labware move)
+    # and the final plates and transfer tipracks take the free slot closest to their samples plate (shorter supernatant transfer moves).
+    # Tipracks on adapters share slots only with other tipracks: the adapter stays on the deck and only the tipracks are swapped.
+    # The "tiprack_slots" (next to a Heater-Shaker) only hold tipracks.
+    occupants = {slot: [] for slot in slots}                            # Labware using each slot, in the order they are placed
+    slot_of = {}
+    for name in order:
+        first, last = lifetimes[name]
+        free_slots = [slot for slot in slots if all(lifetimes[other][1] < first or last < lifetimes[other][0] for other in occupants[slot])
+                      and not (tipracks_on_adapters and any(('tiprack' in other) != ('tiprack' in name) for other in occupants[slot]))
+                      and ('tiprack' in name or slot not in tiprack_slots)]
+        if not free_slots:
+            return None
+        candidates = [slot for slot in free_slots if not occupants[slot]] or free_slots
+        partner = 'samples_plate_' + name.split('_')[-1]
+        if name.startswith(('final_plate', 'transfer_tiprack')) and partner in slot_of:
+            candidates.sort(key = lambda slot: math.dist(slots[slot], slots[slot_of[partner]]))
+        slot_of[name] = candidates[0]
+        occupants[candidates[0]].append(name)
+        occupants[candidates[0]].sort(key = lambda name: lifetimes[name][0])
+    return occupants
+
+def plan_deck(sample_plates, mixing_tipracks, keep_transfer_tipracks, slots, full_plate = False, tiprack_slots = ()):
+    # Tries every split of the plates in consecutive supernatant transfer batches and every reagent tips strategy (see plan_reagent_tips())
+    # and keeps the plan with the fewest batches (each batch is an operator intervention and the pipette is idle meanwhile),
+    # then the fewest labware moves, then the fewest tipracks.
+    if len(sample_plates) == 0:
+        raise ValueError('No samples to extract: set the first and last columns of at least one samples plate')
+    plates = [plate for plate, columns in sample_plates]
+    placing_priority = ['samples_plate', 'reservoir', 'final_plate', 'transfer_tiprack']
+    strategies = [None] if full_plate else ['stage_racks', 'transfer_spares', 'shared_rack']
+    best_plan = None
+    for splits, strategy in itertools.product(itertools.product([False, True], repeat = len(plates) - 1), strategies):
+        batches = [[plates[0]]]
+        for plate, split in zip(plates[1:], splits):
+            if split:
+                batches.append([plate])
+            else:
+                batches[-1].append(plate)
+        reagent_tips = None if full_plate else plan_reagent_tips(sample_plates, mixing_tipracks, keep_transfer_tipracks, strategy)
+        if reagent_tips is None and not full_plate:
+            continue
+
+        # The samples plates and their final plates and transfer tipracks are placed first to sit side by side. When the deck
+        # is too full for that order, the labware is placed by stage, which always succeeds when every stage fits on the deck.
+        lifetimes = labware_lifetimes(batches, mixing_tipracks, keep_transfer_tipracks, full_plate, reagent_tips)
+        by_priority = sorted(lifetimes, key = lambda name: ([name.startswith(kind) for kind in placing_priority] + [True]).index(True))
+        by_stage = sorted(lifetimes, key = lambda name: lifetimes[name][0])
+        occupants = assign_slots(lifetimes, by_priority, slots, full_plate, tiprack_slots) or assign_slots(lifetimes, by_stage, slots, full_plate, tiprack_slots)
+        if occupants is None:
+            continue
+        moves = sum(2 * (len(names) - 1) for names in occupants.values() if names)
+        tipracks = sum('tiprack' in name for name in lifetimes)
+        if best_plan is None or (len(batches), moves, tipracks) < (len(best_plan['batches']), best_plan['moves'], best_plan['tipracks']):
+            best_plan = {'batches': batches, 'lifetimes': lifetimes, 'occupants': occupants, 'moves': moves, 'tipracks': tipracks,
+                         'reagent_tips': reagent_tips, 'slot': {name: slot for slot, names in occupants.items() for name in names}}
+    if best_plan is None:
+        raise ValueError(f'{len(plates)} samples plates do not fit on the {len(slots)} deck slots')
+    return best_plan
+
+def tip_budget(plan, sample_plates, mixing_tipracks, pipette_off_steps, full_plate = False):
+    # Every tip pick-up of the run as (step, rack, column, stage, reused), column 0 standing for the whole rack in the full-plate mode.
+    # The budget is checked before anything is loaded: a ValueError is raised when a rack is not on the deck at the stage its tips
+    # are needed, when the same fresh tips are planned twice or when reused tips were never picked up before.
+    wash_stage = len(plan['batches']) + 1
+    stage_of = {plate: stage for stage, batch in enumerate(plan['batches'], start = 1) for plate in batch}
+    columns = {plate: [0] if full_plate else [column - 1 for column in plate_columns] for plate, plate_columns in sample_plates}
+    ledger = []
+    def reagent(step, stage):
+        rack, column = ('reagent_tiprack', 0) if full_plate else plan['reagent_tips'][step]
+        ledger.append((step, rack, column, stage, False))
+
+    reagent('TE buffer dispensing', 0)
+    ledger.append(('Extraction buffer dispensing',) + ledger[-1][1:4] + (True,))
+    if mixing_tipracks:
+        te_tip = ledger[0][1:3]
+        ledger += [('Chloroform dispensing', f'tiprack_{plate}', column, 0, (f'tiprack_{plate}', column) == te_tip) for plate in columns for column in columns[plate]]
+    else:
+        reagent('Chloroform dispensing', 0)
+    transfer_tips = [(f'transfer_tiprack_{plate}', column, stage_of[plate]) for plate in columns for column in columns[plate]]
+    ledger += [('Supernatant transfer', rack, column, stage, False) for rack, column, stage in transfer_tips]
+    for reagent_step, pipette_off_step in [('Isopropanol dispensing', 'Isopropanol discarding'), ('Ethanol dispensing', 'Ethanol discarding')]:
+        reagent(reagent_step, wash_stage)
+        if pipette_off_step in pipette_off_steps:
+            ledger += [(pipette_off_step, rack, column, wash_stage, True) for rack, column, stage in transfer_tips]
+    reagent('Elution buffer dispensing', wash_stage)
+
+    picked = set()
+    for step, rack, column, stage, reused in ledger:
+        first, last = plan['lifetimes'].get(rack, (None, None))
+        if first is None or not first <= stage <= last:
+            raise ValueError(f'Tip budget - {step}: {rack} is not on the deck when its tips are needed')
+        if not 0 <= column < 12:
+            raise ValueError(f'Tip budget - {step}: {rack} has no column {column + 1}')
+        if reused and (rack, column) not in picked:
+            raise ValueError(f'Tip budget - {step}: the tips of {rack} column {column + 1} are reused before being used')
+        if not reused and (rack, column) in picked and rack != 'reagent_tiprack':        # The reagent tiprack is replaced before every reagent
+            raise ValueError(f'Tip budget - {step}: the tips of {rack} column {column + 1} are already used')
+        picked.add((rack, column))
+    return ledger
+
+# Plate scheduler: every samples plate goes through the robot steps and the manual steps between them in the same order. The sequential
+# plan runs a robot step on every plate before the operator takes them all for the next manual step; the staggered plan (run-time parameter
+# stagger_plates) hands each plate to the operator as soon as its robot step is done, so the robot works on the next plates meanwhile.
+manual_steps = {'Grinding': 15, 'Incubation': 60, 'Centrifugation': 10, 'Plate inversion': 2, 'Evaporation': 20}     # min
+
+def makespan(chain, robot_minutes, plates, staggered = ()):
+    # Minutes from the first robot step to the end of the run. "chain" lists the steps of every plate as (name, manual): a robot step
+    # takes robot_minutes[name][plate] of the single pipette, a plate at a time, a manual step takes manual_steps[name] and starts once
+    # the robot is done with every plate, or once the robot is done with each plate when its index in "chain" is in "staggered"
+    # (the incubator and the centrifuge take the plates as they come).
+    ready = dict.fromkeys(plates, 0)            # Minute at which every plate is free for its next step
+    robot_free = 0
+    for index, (name, manual) in enumerate(chain):
+        if manual and index in staggered:
+            ready = {plate: ready[plate] + manual_steps[name] for plate in plates}
+        elif manual:
+            ready = dict.fromkeys(plates, max(ready.values()) + manual_steps[name])
+        else:
+            for plate in plates:
+                robot_free = max(robot_free, ready[plate]) + robot_minutes[name][plate]
+                ready[plate] = robot_free
+    return max(ready.values())
+
+# Reagent calculator: the reagents to prepare and the volumes to pour for a run from its number of samples, without a robot (see
+# tools/reagent_calculator.py for batches of runs). Every reagent poured in a reservoir gets a dead volume: the liquid under the aspiration
+# height of its liquid class, that the tips cannot reach in the reservoir, and never less than dead_volume_samples_number samples.
+dead_volume_samples_number = 20
+# Reservoir wells (mm, from the Opentrons labware definitions): the bottom is made of troughs, one under each tip, whose length and width
+# grow linearly from their bottom to their top, under the rectangular well. (troughs, trough bottom and top length x width, trough height, well length x width)
+reservoir_geometries = {'agilent_1_reservoir_290ml': (8, (101.25, 1.66), (106.79, 8), 2, (106.79, 71)),
+                        'nest_1_reservoir_290ml': (12, (3.127, 66.85), (7.75, 70.75), 2, (106.75, 70.75))}
+reagent_sample_volumes = {'te_water': 50, 'extraction_buffer': 400, 'chloroform_isoamyl': 400, 'isopropanol': 295, 'ethanol_70': 295}    # uL per sample
+
+def reservoir_volume_under(reservoir_type, height):
+    # Volume (uL) of the reservoir well under "height" mm from its bottom
+    troughs, (bottom_length, bottom_width), (top_length, top_width), trough_height, (length, width) = reservoir_geometries[reservoir_type]
+    h = min(height, trough_height)
+    length_slope = (top_length - bottom_length) / trough_height
+    width_slope = (top_width - bottom_width) / trough_height
+    volume = troughs * (bottom_length * bottom_width * h + (bottom_length * width_slope + bottom_width * length_slope) * h ** 2 / 2 + length_slope * width_slope * h ** 3 / 3)
+    return volume + max(height - trough_height, 0) * length * width
+
+def dead_volume_samples(reservoir_type, elution_buffer_volume = 40):
+    # Dead volume of every reagent in its reservoir, in samples
+    volumes = dict(reagent_sample_volumes, elution_buffer = elution_buffer_volume)
+    return {reagent: max(dead_volume_samples_number, math.ceil(reservoir_volume_under(reservoir_type, liquid_classes[reagent]['aspirate_z']) / volume))
+            for reagent, volume in volumes.items()}
+
+def reagent_quantities(samples_number, reservoir_type = 'agilent_1_reservoir_290ml', elution_buffer_volume = 40):
+    # Reagents to prepare (g, mL, and uL for the Rnase, named as in the instructions) and volumes to pour in the reservoirs ('poured', uL,
+    # see reservoir_z()) for "samples_number" samples. A list of sample numbers (e.g. the runs of a week) gives a list of results, a numpy
+    # array an array of results of the same shape.
+    if not isinstance(samples_number, numbers.Integral):
+        if hasattr(samples_number, 'shape'):
+            import numpy
+            return numpy.vectorize(lambda number: reagent_quantities(number, reservoir_type, elution_buffer_volume), otypes = [object])(samples_number)
+        return [reagent_quantities(number, reservoir_type, elution_buffer_volume) for number in samples_number]
+    samples_number = int(samples_number)
+    dead = dead_volume_samples(reservoir_type, elution_buffer_volume)
+    samples = {reagent: samples_number + dead_samples for reagent, dead_samples in dead.items()}
+    quantities = {'Metabisulfite': round(samples['extraction_buffer'] * 0.0028, 3),         # g/sample
+                  'PVPK29': round(samples['extraction_buffer'] * 0.0056, 3),                # g/sample
+                  'StockLysisSolution_A': round(samples['extraction_buffer'] * 0.2344, 1),  # mL/sample
+                  'StockLysisSolution_B': round(samples['extraction_buffer'] * 0.2344, 1),  # mL/sample
+                  'Sarkosyl': round(samples['extraction_buffer'] * 0.0938, 1),              # mL/sample
+                  'Rnase': int(round(samples['extraction_buffer'] * 0.2812, 0))}            # uL/sample
+
+    # Chloroform/Acool Isoamyl (24:1)
+    quantities['AlcoholIsoamyl'] = math.ceil(samples['chloroform_isoamyl'] * 0.4 / 24)
+    quantities['Chloroform'] = quantities['AlcoholIsoamyl'] * 24
+
+    # Ethanol 70% from 95% ethanol (C1 x V1 = C2 x V2)
+    quantities['Ethanol_70'] = int(round(samples['ethanol_70'] * 0.3, 0))                  # mL/sample
+    quantities['Ethanol_95'] = int(round(0.7 * quantities['Ethanol_70'] / 0.95, 1))
+    quantities['Water'] = quantities['Ethanol_70'] - quantities['Ethanol_95']
+
+    # The reagents poured as they are: the volume dispensed to the samples plus the dead volume. The TE buffer reservoir also gives the
+    # water "Liquid-Cap" of the chloroform dispensings.
+    columns = math.ceil(samples_number / 8)
+    quantities['poured'] = {'te_water': samples['te_water'] * 50 + columns * 2 * liquid_classes['chloroform_isoamyl']['liquid_cap'],
+                            'extraction_buffer': (quantities['StockLysisSolution_A'] + quantities['StockLysisSolution_B'] + quantities['Sarkosyl']) * 1000,
+                            'chloroform_isoamyl': (quantities['Chloroform'] + quantities['AlcoholIsoamyl']) * 1000,
+                            'isopropanol': samples['isopropanol'] * 295,
+                            'ethanol_70': quantities['Ethanol_70'] * 1000,
+                            'elution_buffer': samples['elution_buffer'] * elution_buffer_volume}
+    return quantities
+
+# Interstice calibration: the aqueous/organic interface of the samples lies at the top of the chloroform phase. Its height is measured
+# with a ruler once per samples plate type and stored by calibrate(ctx) in interstice_cache_file, which run(ctx) loads when the
+# "Interstice height" parameter is 0. A plate type not calibrated yet keeps the height measured on the original plates. The height of
+# the phase computed from the well geometry (see liquid_height(), 7.6 mm for NEST deep well plates) is only shown as a guide: the round
+# and conical bottoms of the wells put the interface above it, and mixing under it would hit the bottom, so it is never stored.
+measured_interstice_height = 14             # mm
+sample_phases = {'organic': 400, 'aqueous': 50 + 400}      # uL: chloroform:isoamyl alcohol, TE buffer + extraction buffer
+data_directory = '/data' if os.path.isdir('/data') else os.path.expanduser('~')    # Robot storage kept between runs
+interstice_cache_file = os.path.join(data_directory, 'roboctab_measured_interstice_heights.json')
+
+def load_interstice_heights(path = interstice_cache_file):
+    # Interstice heights (mm) by samples plate type from the calibration cache, empty when nothing is calibrated yet
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def calibrate(ctx, labware_types, measured = None, path = interstice_cache_file):
+    # Calibration entry point (see tools/calibrate_interstice.py): adds the heights "measured" by hand ({labware type: mm}) to the cache.
+    # Returns the height run(ctx) uses for every "labware_types" plate, its source and its straight-tube estimate, by labware type.
+    measured = measured or {}
+    heights = dict(load_interstice_heights(path), **measured)
+    if measured:
+        with open(path, 'w') as f:
+            json.dump(heights, f, indent = 1)
+    calibration = {}
+    for labware_type, slot in zip(labware_types, deck_slots):
+        well = ctx.load_labware(labware_type, slot).wells()[0]
+        source = 'measured' if labware_type in measured else 'calibration cache' if labware_type in heights else 'not calibrated, measured default'
+        calibration[labware_type] = (heights.get(labware_type, measured_interstice_height), source, round(liquid_height(well, sample_phases['organic']), 2))
+        ctx.comment(f'Interstice height - {labware_type}: {calibration[labware_type][0]} mm ({source}), straight-tube estimate {calibration[labware_type][2]} mm (not stored)')
+    return calibration
+
+# Step log: on the robot, every robot step (see robot_steps() in run) appends one JSON line to step_log_file with its start and end
+# times, its duration, its commands, the estimate of the timing model with the number of times it added every timing_calibration constant
+# and its dwells, and the duration and commands of every column of the samples and final plates it worked on. A command lasts until the next one starts; the commands on reservoirs and tipracks count for the last
+# column served. It wraps the robot pipette like TrackedPipette and logs nothing while a step is dry-run (simulation and analysis).
+step_log_file = os.path.join(data_directory, 'roboctab_step_log.jsonl')
+
+class StepLog:
+
+    own_attributes = ('pipette', 'path', 'run', 'plates', 'step', 'records', 'commands')
+    commands = ('pick_up_tip', 'drop_tip', 'return_tip', 'aspirate', 'dispense', 'air_gap', 'blow_out', 'touch_tip', 'move_to')
+
+    def __init__(self, pipette, path, run, plates):
+        self.pipette = pipette
+        self.path = path
+        self.run = run                          # Fields of every line of the run: start of the run, unique run id, robot hostname and protocol name
+        self.plates = plates                    # Name of every followed labware (samples and final plates) by id
+        self.step = None
+        self.records = []                       # (start time, command, (plate, column) or None) of the commands of the step
+
+    def __getattr__(self, name):
+        attribute = getattr(self.pipette, name)
+        if name not in StepLog.commands or self.step is None:
+            return attribute
+
+        def command(*args, **kwargs):
+            positional = args[1:2] if name in ('aspirate', 'dispense') else args[:1]        # aspirate(volume, location), move_to(location)...
+            location = kwargs.get('location', positional[0] if positional else None)
+            self.records.append((time.time(), name, self._column(location)))
+            return attribute(*args, **kwargs)
+        return command
+
+    def __setattr__(self, name, value):         # default_speed... are set on the wrapped pipette
+        if name in self.own_attributes:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.pipette, name, value)
+
+    def _column(self, location):                # (plate name, column) of a location in a followed plate, else the column served last
+        well = location.labware.as_well() if hasattr(location, 'point') and location.labware.is_well else location if hasattr(location, 'well_name') else None
+        if well is not None and id(well.parent) in self.plates:
+            return self.plates[id(well.parent)], int(well.well_name[1:])
+        return self.records[-1][2] if self.records else None
+
+    def start(self, name, plates, estimate):   # "estimate": the dry-run of the step on the timing model (TimedPipette)
+        self.step = {**self.run, 'step': name, 'plates': plates, 'estimated_seconds': round(estimate.seconds, 2), 'estimated_counts': estimate.counts,
+                     'estimated_dwell_seconds': round(estimate.dwell_seconds, 2), 'start': time.time()}
+        self.records = []
+
+    def end(self):
+        step, end = self.step, time.time()
+        self.step = None
+        columns = {}
+        for (start, name, column), next_start in zip(self.records, [record[0] for record in self.records[1:]] + [end]):
+            seconds, commands = columns.get(column, (0, 0))
+            columns[column] = (seconds + next_start - start, commands + 1)
+        step['start'] = round(step['start'], 2)
+        step.update(end = round(end, 2), seconds = round(end - step['start'], 2), commands = len(self.records),
+                    command_counts = {name: sum(record[1] == name for record in self.records) for name in StepLog.commands if any(record[1] == name for record in self.records)},
+                    columns = [{'plate': column[0] if column else None, 'column': column[1] if column else None, 'seconds': round(seconds, 2), 'commands': commands}
+                               for column, (seconds, commands) in columns.items()])
+        try:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(step) + '\n')
+        except OSError:                         # A step log that cannot be written does not stop the run
+            pass
 
 def run(ctx):
-    
-    # testing how many plates to extract
-    if  first_column_plate_1 != 0 and \
-        first_column_plate_2 == 0 and \
-        first_column_plate_3 == 0 and \
-        first_column_plate_4 == 0 : number_of_plates_to_extract = 1
-    if  first_column_plate_1 != 0 and \
-        first_column_plate_2 != 0 and \
-        first_column_plate_3 == 0 and \
-        first_column_plate_4 == 0 : number_of_plates_to_extract = 2
-    if  first_column_plate_1 != 0 and \
-        first_column_plate_2 != 0 and \
-        first_column_plate_3 != 0 and \
-        first_column_plate_4 == 0 : number_of_plates_to_extract = 3
-    if  first_column_plate_1 != 0 and \
-        first_column_plate_2 != 0 and \
-        first_column_plate_3 != 0 and \
-        first_column_plate_4 != 0 : number_of_plates_to_extract = 4
 
+    # Run-time parameters of this run (see add_parameters())
+    params = ctx.params
+    elution_buffer_volume = params.elution_buffer_volume
+    tipsbox = params.tipsbox
+    samples_plate_type = params.samples_plate_type
+    final_plate_type = params.final_plate_type
+    reservoir_type = params.reservoir_type
+    chloroform_buffer_mixing = params.chloroform_buffer_mixing
+    pipetteOff_isopropanol = params.pipetteOff_isopropanol
+    pipetteOff_ethanol = params.pipetteOff_ethanol
+    distance_interstice_to_bottom = params.distance_interstice_to_bottom
+    supernatant_transfer_mode = params.supernatant_transfer_mode
+    if params.use_sample_manifest:             # The columns listed in the sample manifest (see read_sample_manifest()) instead of the column ranges
+        sample_plates = read_sample_manifest(params.sample_manifest.file)
+        for plate, columns in sample_plates:
+            ctx.comment(f'Sample manifest - plate {plate}: column' + ('s ' if len(columns) > 1 else ' ') + ', '.join(str(column) for column in columns))
+    else:
+        sample_plates = samples_to_extract([(getattr(params, f'first_column_plate_{plate}'), getattr(params, f'last_column_plate_{plate}')) for plate in range(1, 5)])
+    stagger_plates = params.stagger_plates and len(sample_plates) > 1     # A single plate has no other plate to overlap with
+    total_number_of_columns = sum(len(columns) for plate, columns in sample_plates)
+    check_liquid_classes(liquid_classes)
+
+    # Full-plate mode: the 96-channel pipette processes a whole plate per stroke (Flex only, see full_plate_pipette)
+    full_plate_mode = full_plate_pipette is not None and params.pipette_mode == '96_channel'
+    if full_plate_mode:
+        partial_plates = [str(plate) for plate, columns in sample_plates if len(columns) != 12]
+        if partial_plates:
+            raise ValueError(f'The 96-channel pipette processes whole plates: set the columns of plate(s) {", ".join(partial_plates)} from 1 to 12 or use the 8-channel pipette')
+        if tipsbox not in full_plate_pipette['tipracks']:
+            raise ValueError(f'The 96-channel pipette needs Flex tipracks ({", ".join(full_plate_pipette["tipracks"])}), not {tipsbox}')
+
+    # Heater-Shaker mode: the chloroform is dispensed without mixing and the emulsion is shaken on the Heater-Shaker, one sealed samples plate
+    # at a time. A single samples plate is also incubated on it. The module slot and the slots it blocks are taken out of the deck plan.
+    heater_shaker_mode = chloroform_buffer_mixing == 'heater_shaker'
+    mixing_with_tips = chloroform_buffer_mixing in ('pipette_mixing', 'bubble_mixing')      # One tip column per sample column mixes the chloroform
+    slots = deck_slots
+    if heater_shaker_mode:
+        slots = {slot: position for slot, position in deck_slots.items() if slot != heater_shaker_slots['module'] and slot not in heater_shaker_slots['blocked']}
+
+    # Planning the deck for the samples plates to extract (see plan_deck())
+    plan = plan_deck(sample_plates, mixing_with_tips, pipetteOff_isopropanol == True or pipetteOff_ethanol == True, slots, full_plate_mode,
+                     heater_shaker_slots['tipracks_only'] if heater_shaker_mode else ())
+    pipette_off_steps = [step for step, pipette_off in [('Isopropanol discarding', pipetteOff_isopropanol), ('Ethanol discarding', pipetteOff_ethanol)] if pipette_off == True]
+    tip_ledger = tip_budget(plan, sample_plates, mixing_with_tips, pipette_off_steps, full_plate_mode)
+    optimise_paths = params.optimise_gantry_paths       # Switched off while the original paths are dry-run for comparison (see path_savings())
+
+    # Gripper mode (Flex): the labware waiting for a slot shared with another labware goes through the staging slots. The first ones
+    # are placed there at the beginning; the gripper swaps them with the labware that is done, which it puts on a free staging slot.
+    # At every checklist the operator takes the used labware off the staging slots and places the next waiting labware on them (see
+    # refill_staging()). The operator only swaps the labware that finds no staging slot.
+    gripper_mode = gripper_staging_slots is not None and params.use_gripper
+    waiting_labware = sorted((name for names in plan['occupants'].values() for name in names[1:]), key = lambda name: plan['lifetimes'][name][0])
+    staging = dict(zip(gripper_staging_slots, waiting_labware + [None] * len(gripper_staging_slots))) if gripper_mode else {}  # Staging slot -> labware on it
+    staged = {name: slot for slot, name in staging.items() if name}    # Labware placed on the staging slots at the beginning
+    taken_off = set()                           # Labware the gripper took off the deck
+    swapped_in = set()
+    swap_moves = {'gripper': 0, 'operator': 0, 'staging': 0}     # Labware moves of the swaps, and of the staging slot refills
 
 # Defining the functions executed in the protocols
-    def water_distribute(all_samples_vector, volume, bottom_dispense_heigth, return_tip, source):
-
-        nb_consecutive_dispense = 300 // volume
-        nb_full_distribution = len(all_samples_vector) // nb_consecutive_dispense
+    def dwell(seconds):                         # Holding the pipette still (e.g. to let viscous liquids fill the tip)
+        hold_pipette(ctx, p300.pipette, seconds)
+
+    # Gantry paths: where the tip enters the reservoirs and in which order the columns of consecutive plates are visited
+    reservoir_wall_margin = 6                   # mm kept between the tips and the end walls of the reservoir
+    reservoir_immersion = 3                     # mm the tips are kept under the liquid surface of the reservoirs
+    well_immersion = 3                          # mm the tips are kept under the liquid surface of the samples and final plates wells
+
+    def reservoir_access(reservoir, destinations, z, top = False):
+        # Location in "reservoir" (bottom or top + z) facing the mean X of the "destinations" wells, slid along the long (X) axis of
+        # the reservoir. Reservoirs too narrow for the tips to move (e.g. 12-well reservoirs) are accessed in their center.
+        location = reservoir.top(z = z) if top else reservoir.bottom(z = z)
+        if not optimise_paths or full_plate_mode:             # The 96 tips of the full-plate mode fill the reservoir
+            return location
+        destinations = destinations if isinstance(destinations, list) else [destinations]
+        reach = max((reservoir.length or 0) / 2 - reservoir_wall_margin, 0)
+        offset = sum(well_top(well).x for well in destinations) / len(destinations) - location.point.x
+        return location.move(types.Point(x = min(max(offset, -reach), reach)))
+
+    def reservoir_z(reservoir, liquid_class, volume, z):
+        # Aspiration height (mm from the bottom) of "volume" per tip of "liquid_class" in "reservoir": "reservoir_immersion" mm under the
+        # surface left after the aspiration, from the volume tracked since the reservoir was filled (see reservoir_volumes), and never
+        # under "z". Volumes returned to the reservoir are not tracked: the liquid is higher than planned and the tips only deeper in it.
+        reservoir_volumes[liquid_class] -= volume * (96 if full_plate_mode else 8)
+        if not optimise_paths:
+            return z
+        surface = reservoir_volumes[liquid_class] / (reservoir.length * reservoir.width)
+        return max(z, surface - reservoir_immersion)
+
+    def well_z(well, volume, z):
+        # Aspiration height (mm from the bottom) of "volume" from a well of the samples or final plates: "well_immersion" mm under
+        # the surface left after the aspiration (see TrackedPipette), never under the height "z" the last drops are aspirated at.
+        if not optimise_paths:
+            return z
+        return max(z, liquid_height(well, p300.volume(well) - volume) - well_immersion)
+
+    def serpentine(columns):
+        # Visiting order of "columns" spread over several plates: each plate is crossed in the direction starting closest
+        # to the last column of the previous plate (e.g. right to left when the next plate sits above the end of the previous one).
+        if not optimise_paths:
+            return columns
+        ordered = []
+        for plate, plate_columns in itertools.groupby(columns, key = lambda column: column.parent):
+            plate_columns = list(plate_columns)
+            if ordered:
+                end = well_top(ordered[-1])
+                if math.dist(end, well_top(plate_columns[-1])) < math.dist(end, well_top(plate_columns[0])):
+                    plate_columns.reverse()
+            ordered += plate_columns
+        return ordered
+
+    def reagent_tip(step):
+        # Tips of a reagent dispensing "step", planned with the deck (see plan_reagent_tips()). In the full-plate mode, the 96 tips
+        # of the reagent tiprack, which the operator replaces with a new one before every reagent. A dry-run of the step (estimates,
+        # step log) leaves the tips of the robot's rack as they are.
+        if full_plate_mode:
+            if not isinstance(p300.pipette, TimedPipette):
+                labware['reagent_tiprack'].reset()
+            return labware['reagent_tiprack']['A1']
+        rack, column = plan['reagent_tips'][step]
+        return labware[rack].rows()[0][column]
+
+    def tip_capacity():                         # uL one channel holds: the smallest of the pipette and tip max volumes (300 on the OT-2, 1000 with Flex tips)
+        return min(p300.max_volume, p300.tip_racks[0].wells()[0].max_volume)
+
+    def cycles(items, per_aspiration):          # Splits "items" in groups served by one aspiration each
+        return [items[i:i + per_aspiration] for i in range(0, len(items), per_aspiration)]
+
+    def distribute(liquid_class, all_samples_vector, volume, dispense_heigth, source, return_tip = None, tip = None):
+        # Multi-dispense "volume" from "source" to every column of "all_samples_vector" with the fewest aspirate cycles.
+        # return_tip: True returns the tip to its rack, False drops it in the trash, None keeps it attached for the next step.
+        liquid = liquid_classes[liquid_class]
+
+        # Number of columns served by one aspiration, limited by the real capacity of the pipette and its tips
+        usable_volume = tip_capacity() - liquid['liquid_cap'] - liquid['liquid_cap_air'] - liquid['leading_air_gap']
+        nb_consecutive_dispense = int(usable_volume // volume)
+        if nb_consecutive_dispense == 0:
+            raise ValueError(f'Cannot distribute {volume}uL of {liquid_class}: only {usable_volume}uL fit in the tip')
+        aspirate_cycles = cycles(serpentine(all_samples_vector), nb_consecutive_dispense)
+
+        p300.default_speed = liquid['speed']
+        if tip is None:
+            p300.pick_up_tip()
+        else:
+            p300.pick_up_tip(tip)
 
-        p300.default_speed = 400
-        p300.pick_up_tip()
+        if liquid['liquid_cap'] > 0:
+            p300.aspirate(liquid['liquid_cap'], reservoir_access(water_reservoir_01, aspirate_cycles[0], reservoir_z(water_reservoir_01, 'te_water', liquid['liquid_cap'], 2.5)), rate = liquid['liquid_cap_rate']) # Aspirating the water "Liquid-Cap"
+            p300.aspirate(liquid['liquid_cap_air'], reservoir_access(water_reservoir_01, aspirate_cycles[0], 5, top = True), rate = liquid['liquid_cap_rate'])
 
-        # Defining the vectors for distribution
-        count = 1
-        while count <= nb_full_distribution + 1:
+        for destinations in aspirate_cycles:
 
-            if count == 1 :
-                samples_start = 0
-                samples_end = nb_consecutive_dispense
-            
-            elif count > 1 and count <= nb_full_distribution:
-                 samples_start = (count * nb_consecutive_dispense) - nb_consecutive_dispense 
-                 samples_end = samples_start + nb_consecutive_dispense 
-            
-            elif count == (nb_full_distribution + 1):
-                samples_start = (nb_full_distribution * nb_consecutive_dispense)
-                samples_end = len(all_samples_vector)     
-            
-            destinations = all_samples_vector[samples_start:samples_end]
+            p300.default_speed = liquid['speed']
+            p300.aspirate(volume * len(destinations), reservoir_access(source, destinations, reservoir_z(source, liquid_class, volume * len(destinations), liquid['aspirate_z'])), rate = liquid['aspirate_rate'])
+            if liquid['dwell'] > 0:
+                dwell(liquid['dwell'])
+            if liquid['leading_air_gap'] > 0:
+                p300.air_gap(liquid['leading_air_gap'])
 
-            p300.default_speed = 400
-            p300.aspirate(300, source.bottom(z = 2.5), rate = 1)
-            
-            dispense_count = 1
+            air_in_tip = liquid['leading_air_gap']                  # The air gap sitting at the end of the tip is expelled with the next dispense
             for column in destinations:
 
-                if dispense_count == 1:
-                    volume_to_dispense = volume
-                    p300.default_speed = 400
+                if liquid['dispense_from'] == 'top':
+                    location = column.top(z = dispense_heigth)
                 else:
-                    volume_to_dispense = volume + 10
-                    p300.default_speed = 100
-               
-                p300.dispense(volume_to_dispense, location = column.bottom(z = bottom_dispense_heigth), rate = 1)
-                
-               
-                p300.air_gap(10)
+                    location = column.bottom(z = dispense_heigth)
+
+                p300.dispense(volume + air_in_tip, location = location, rate = liquid['dispense_rate'])
+                if liquid['touch_tip'] is not None:
+                    p300.touch_tip(location = column, **liquid['touch_tip'])
+                if liquid['air_gap'] > 0:
+                    p300.air_gap(liquid['air_gap'])
 
-                dispense_count += 1
+                air_in_tip = liquid['air_gap']
+                p300.default_speed = liquid['dispense_speed']
 
             p300.default_speed = 400
-            p300.blow_out(location = source)
-            
-            count += 1
+            if liquid['return_to_source'] == 'blow_out':
+                p300.blow_out(location = reservoir_access(source, destinations, 0, top = True))
+            else:
+                p300.dispense(p300.current_volume - liquid['liquid_cap'] - liquid['liquid_cap_air'], location = reservoir_access(source, destinations, 0, top = True))   # Keeping the "Liquid-Cap" in the tip
 
+        if return_tip == True:
+            p300.return_tip()
+        if return_tip == False:
+            p300.drop_tip()
 
-    def pre_grinding_water_dispense():
-        p300.pick_up_tip()
-        p300.default_speed = 400
-        for plate in plates:
-            for d in plate:
-                p300.aspirate(50, water_reservoir_01.bottom(z = 2.5), rate = 1)
-                p300.air_gap(5)
-                p300.dispense(50 + 5, d.top(0), rate = 2)
-                p300.blow_out(d.top(0))
-        p300.return_tip()
-
-    def ExtractionBuffer_dispense():
-        p300.default_speed = 400
+    def ExtractionBuffer_dispense(pick_up_tip = False):       # The TE buffer tip is still attached, unless it was returned after a previous plate
+        liquid = liquid_classes['extraction_buffer']
+        if pick_up_tip:
+            p300.pick_up_tip(reagent_tip('TE buffer dispensing'))
+        # 400uL per column in as few aspirations as the tip holds with its air gap: two of 200uL with 300uL tips, one with 1000uL tips
+        aspirations = math.ceil(400 / (tip_capacity() - liquid['leading_air_gap']))
+        volume = 400 / aspirations
+        p300.default_speed = liquid['speed']
         #p300.pick_up_tip(tiprack_1.wells()[0])
         for plate in plates:
             for d in plate:
-                # First dispense
-                p300.aspirate(200, reservoir_01.bottom(z = 2), rate = 0.85)
-                time.sleep(1.5)
-                p300.air_gap(40)
-                p300.dispense(240, d.top(2), rate = 2)
-                p300.aspirate(20, d.top(2))
-                p300.dispense(20, reservoir_01.top(z = 0))
-
-                # Second dispense
-                p300.aspirate(200, reservoir_01.bottom(z = 2), rate = 0.85)
-                time.sleep(1.5)
-                p300.air_gap(40)
-                p300.dispense(240, d.top(2), rate = 2)
-                p300.aspirate(20, d.top(2))
-                p300.dispense(20, reservoir_01.top(z = 0))
+                for aspiration in range(aspirations):
+                    p300.aspirate(volume, reservoir_access(reservoir_01, d, reservoir_z(reservoir_01, 'extraction_buffer', volume, liquid['aspirate_z'])), rate = liquid['aspirate_rate'])
+                    if liquid['dwell'] > 0:
+                        dwell(liquid['dwell'])
+                    p300.air_gap(liquid['leading_air_gap'])
+                    p300.dispense(volume + liquid['leading_air_gap'], d.top(2), rate = liquid['dispense_rate'])
+                    p300.aspirate(liquid['suck_back'], d.top(2))
+                    p300.dispense(liquid['suck_back'], reservoir_access(reservoir_01, d, 0, top = True))
         p300.return_tip()         
     
 
-    def Chloroform_distribute(all_samples_vector, volume, top_dispense_heigth, return_tip, source):
+    def chloroform_liquid_cap(destinations):   # Aspirating the water "Liquid-Cap" keeping the chloroform from dripping out of the tip
+        liquid = liquid_classes['chloroform_isoamyl']
+        p300.aspirate(liquid['liquid_cap'], reservoir_access(water_reservoir_01, destinations, reservoir_z(water_reservoir_01, 'te_water', liquid['liquid_cap'], 2.5)), rate = liquid['liquid_cap_rate']) 
+        p300.aspirate(liquid['liquid_cap_air'], reservoir_access(water_reservoir_01, destinations, 5, top = True), rate = liquid['liquid_cap_rate']) 
 
-        nb_consecutive_dispense = 300 // volume
-        nb_full_distribution = len(all_samples_vector) // nb_consecutive_dispense
-        
-        p300.default_speed = 400
-        p300.pick_up_tip()
-        p300.aspirate(25, water_reservoir_01.bottom(z = 2.5), rate = 4) # Aspirating the water "Liquid-Cap"
-        p300.aspirate(25, water_reservoir_01.top(z = 5), rate = 4)
-        
-        count = 1
-        while count <= nb_full_distribution + 1:
-
-            if count == 1 :
-                samples_start = 0
-                samples_end = nb_consecutive_dispense
-            
-            elif count > 1 and count <= nb_full_distribution:
-                 samples_start = (count * nb_consecutive_dispense) - nb_consecutive_dispense 
-                 samples_end = samples_start + nb_consecutive_dispense                     
-            
-            elif count == (nb_full_distribution + 1):
-                samples_start = (nb_full_distribution * nb_consecutive_dispense)
-                samples_end = len(all_samples_vector)     
-            
-            destinations = all_samples_vector[samples_start:samples_end]
-
-
-            p300.default_speed = 200
-            p300.aspirate(240, reservoir_01.bottom(z = 2.5), rate = 4)
-            p300.aspirate(10, location = reservoir_01.top(z = 2.5))
-
-            for column in destinations:
-
-                p300.dispense(volume + 10, location = column.top(z = top_dispense_heigth), rate = 1)
-                p300.air_gap(10)
-
-            p300.default_speed = 400
-            p300.dispense(volume = 10, location = source)
-            
-            count += 1
+    def dispensing_chloroform_and_pipetteMixing():
 
-        if return_tip == True:
-            p300.return_tip()
-        else:
-            p300.drop_tip()
+        liquid = liquid_classes['chloroform_isoamyl']
+        mixing = liquid['pipette_mixing']
+        liquid_cap = liquid['liquid_cap'] + liquid['liquid_cap_air']
+        (first_volume, first_air_gap), (second_volume, second_air_gap) = mixing['aspirations']
+        single_aspiration = tip_capacity() >= liquid_cap + first_volume + first_air_gap + second_volume + second_air_gap      # Liquid-Cap and both dispensings in one aspiration (1000uL tips)
+        dispense_z = distance_interstice_to_bottom + mixing['interstice_dispense_z']
+        mix_z = distance_interstice_to_bottom + mixing['interstice_mix_z']
 
-    def dispensing_chloroform_and_pipetteMixing():
-        
         # Loop through the plates
         for plate, tiprack in zip(plates, mixing_tipracks):
             
             # Loop through the wells in the plate
             for samples_wells, tips_column in zip(plate, tiprack):
                 
-                p300.default_speed = 400
+                p300.default_speed = liquid['speed']
 
                 p300.pick_up_tip(location = tips_column)
 
-                 # Aspirating the water "Liquid-Cap"
-                p300.aspirate(40, water_reservoir_01.bottom(z = 2.5), rate = 4) 
-                p300.aspirate(55, water_reservoir_01.top(z = 5), rate = 4) 
+                chloroform_liquid_cap(samples_wells)
 
                 # First dispensing
-                p300.aspirate(200, reservoir_01.bottom(z = 2.5), rate = 2) 
-                p300.aspirate(5, location = reservoir_01.top(z = 2.5)) 
-                p300.dispense(195, location = samples_wells.top(z = 9), rate = 1)
+                if single_aspiration:
+                    p300.aspirate(first_volume + second_volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', first_volume + second_volume, liquid['aspirate_z'])), rate = mixing['aspirate_rate']) 
+                    p300.aspirate(first_air_gap + second_air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True)) 
+                else:
+                    p300.aspirate(first_volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', first_volume, liquid['aspirate_z'])), rate = mixing['aspirate_rate']) 
+                    p300.aspirate(first_air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True)) 
+                p300.dispense(mixing['dispense_volume'], location = samples_wells.top(z = liquid['first_dispense_z']), rate = liquid['dispense_rate'])
 
                 # Second dispensing
-                p300.aspirate(193, reservoir_01.bottom(z = 2.5), rate = 2) 
-                p300.aspirate(2, location = reservoir_01.top(z = 2.5))
-                p300.dispense(195, location = samples_wells.bottom(z = distance_interstice_to_bottom + 6), rate = 1)
+                if not single_aspiration:
+                    p300.aspirate(second_volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', second_volume, liquid['aspirate_z'])), rate = mixing['aspirate_rate']) 
+                    p300.aspirate(second_air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True))
+                p300.dispense(mixing['dispense_volume'], location = samples_wells.bottom(z = dispense_z), rate = liquid['dispense_rate'])
                 
                 # This loop will mix the chloroform and extraction buffer by blowing air in the liquids
-                p300.aspirate(130, location = samples_wells.bottom(z = distance_interstice_to_bottom - 7), rate = 0.7)
-                p300.default_speed = 400
+                p300.aspirate(mixing['mix_volume'], location = samples_wells.bottom(z = mix_z), rate = mixing['mix_aspirate_rate'])
+                p300.default_speed = liquid['speed']
                 i = 0                                   
-                while i < 5:  
-                    p300.dispense(130, location = samples_wells.bottom(z = distance_interstice_to_bottom + 6), rate = 2)
-                    p300.aspirate(130, location = samples_wells.bottom(z = distance_interstice_to_bottom - 7), rate = 0.7) 
+                while i < mixing['cycles']:  
+                    p300.dispense(mixing['mix_volume'], location = samples_wells.bottom(z = dispense_z), rate = mixing['mix_dispense_rate'])
+                    p300.aspirate(mixing['mix_volume'], location = samples_wells.bottom(z = mix_z), rate = mixing['mix_aspirate_rate']) 
                     i += 1
 
-                p300.dispense(130, location = samples_wells.bottom(z = distance_interstice_to_bottom + 6), rate = 2)
+                p300.dispense(mixing['mix_volume'], location = samples_wells.bottom(z = dispense_z), rate = mixing['mix_dispense_rate'])
                 
-                p300.touch_tip(samples_wells, v_offset = -3, radius = 1.2, speed = 40)
+                p300.touch_tip(samples_wells, **liquid['touch_tip'])
 
                 p300.default_speed = 200
                 p300.drop_tip(location = tips_column, home_after = False) # drop_tip() with no argument will drop the tips in the trash.
-                p300.default_speed = 400
+                p300.default_speed = liquid['speed']
 
-    time_dispensing_chloroform_and_bubbleMixing = 77             # Defining a time (s) variable to calculate the duration of the step
 
 
     def dispensing_chloroform_and_bubbleMixing():
-        
+
+        liquid = liquid_classes['chloroform_isoamyl']
+        mixing = liquid['bubble_mixing']
+        air_gap = liquid['leading_air_gap']
+        liquid_cap = liquid['liquid_cap'] + liquid['liquid_cap_air']
+        volume = liquid['dispense_volume']
+        single_aspiration = tip_capacity() >= liquid_cap + 2 * (volume + air_gap)     # Liquid-Cap and both dispensings in one aspiration (1000uL tips)
+        dispense_z = distance_interstice_to_bottom + mixing['interstice_dispense_z']
+        first_air_volume, mix_air_volume, last_air_volume = mixing['air_volumes']
+
         # Loop through the plates
         for plate, tiprack in zip(plates, mixing_tipracks):
             
             # Loop through the wells in the plate
             for samples_wells, tips_column in zip(plate, tiprack):
                 
-                p300.default_speed = 400
+                p300.default_speed = liquid['speed']
 
                 p300.pick_up_tip(location = tips_column)
 
-                 # Aspirating the water "Liquid-Cap"
-                p300.aspirate(40, water_reservoir_01.bottom(z = 2.5), rate = 4) 
-                p300.aspirate(55, water_reservoir_01.top(z = 5), rate = 4) 
+                chloroform_liquid_cap(samples_wells)
 
                 # First dispensing
-                p300.aspirate(200, reservoir_01.bottom(z = 2.5), rate = 4) 
-                p300.aspirate(5, location = reservoir_01.top(z = 2.5)) 
-                p300.dispense(205, location = samples_wells.top(z = 9), rate = 1)
+                if single_aspiration:
+                    p300.aspirate(2 * volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', 2 * volume, liquid['aspirate_z'])), rate = liquid['aspirate_rate']) 
+                    p300.aspirate(2 * air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True)) 
+                else:
+                    p300.aspirate(volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', volume, liquid['aspirate_z'])), rate = liquid['aspirate_rate']) 
+                    p300.aspirate(air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True)) 
+                p300.dispense(volume + air_gap, location = samples_wells.top(z = liquid['first_dispense_z']), rate = liquid['dispense_rate'])
 
                 # Second dispensing
-                p300.aspirate(200, reservoir_01.bottom(z = 2.5), rate = 4) 
-                p300.aspirate(5, location = reservoir_01.top(z = 2.5))
-                p300.dispense(205, location = samples_wells.bottom(z = distance_interstice_to_bottom - 2), rate = 1)
+                if not single_aspiration:
+                    p300.aspirate(volume, reservoir_access(reservoir_01, samples_wells, reservoir_z(reservoir_01, 'chloroform_isoamyl', volume, liquid['aspirate_z'])), rate = liquid['aspirate_rate']) 
+                    p300.aspirate(air_gap, location = reservoir_access(reservoir_01, samples_wells, liquid['aspirate_z'], top = True))
+                p300.dispense(volume + air_gap, location = samples_wells.bottom(z = dispense_z), rate = liquid['dispense_rate'])
                 
                 # This loop will mix the chloroform and extraction buffer by blowing air in the liquids
-                p300.aspirate(205, location = samples_wells.top(z = 0), rate = 4)
-                p300.default_speed = 400
+                p300.aspirate(first_air_volume, location = samples_wells.top(z = 0), rate = mixing['mix_aspirate_rate'])
+                p300.default_speed = liquid['speed']
                 i = 0                                   
-                while i < 10:  
-                    p300.dispense(160, location = samples_wells.bottom(z = distance_interstice_to_bottom - 2), rate = 1)
-                    p300.aspirate(160, location = samples_wells.top(z = 0), rate = 4) 
+                while i < mixing['cycles']:  
+                    p300.dispense(mix_air_volume, location = samples_wells.bottom(z = dispense_z), rate = mixing['mix_dispense_rate'])
+                    p300.aspirate(mix_air_volume, location = samples_wells.top(z = 0), rate = mixing['mix_aspirate_rate']) 
                     i += 1
 
-                p300.dispense(180, location = samples_wells.bottom(z = distance_interstice_to_bottom - 2), rate = 1)
+                p300.dispense(last_air_volume, location = samples_wells.bottom(z = dispense_z), rate = mixing['mix_dispense_rate'])
                 
-                p300.touch_tip(samples_wells, v_offset = -3, radius = 1.2, speed = 40)
+                p300.touch_tip(samples_wells, **liquid['touch_tip'])
 
                 p300.default_speed = 200
                 p300.drop_tip(location = tips_column, home_after = False) # drop_tip() with no argument will drop the tips in the trash.
-                p300.default_speed = 400
+                p300.default_speed = liquid['speed']
 
-    time_dispensing_chloroform_and_bubbleMixing = 77             # Defining a time (s) variable to calculate the duration of the step
 
     def dispensing_chloroform():
-        p300.pick_up_tip()
+        liquid = liquid_classes['chloroform_isoamyl']
+        air_gap = liquid['leading_air_gap']
+        p300.pick_up_tip(reagent_tip('Chloroform dispensing'))
 
-        # Aspirating the water "Liquid-Cap"
-        p300.aspirate(40, water_reservoir_01.bottom(z = 2.5), rate = 4) 
-        p300.aspirate(55, water_reservoir_01.top(z = 5), rate = 4)
+        chloroform_liquid_cap(plates[0][0])
         
-        # Loop through the plates
-        for plate in plates:
-            
-            # Loop through the wells in the plate
-            for samples_wells in plate:
-            
-                p300.default_speed = 400
-                # First dispensing
-                p300.aspirate(200, reservoir_01.bottom(z = 2.5), rate = 4) # Chloroform pipetting
-                p300.aspirate(5, location = reservoir_01.top(z = 2.5)) # Air gap
-                p300.dispense(205, location = samples_wells.top(z = 9), rate = 1)
-                # Second dispensing
-                p300.aspirate(200, reservoir_01.bottom(z = 2.5), rate = 4) # Chloroform pipetting
-                p300.aspirate(5, location = reservoir_01.top(z = 2.5))
-                p300.dispense(205, location = samples_wells.top(z = 9), rate = 1)
+        # Every column receives two dispensings of 200uL, as many per aspiration as the tip holds
+        # with the Liquid-Cap and the air gap: one with 300uL tips, four (two columns) with 1000uL tips
+        volume = liquid['dispense_volume']
+        dispensings = [samples_wells for plate in plates for samples_wells in plate for half in range(2)]
+        dispensings_per_aspiration = int((tip_capacity() - liquid['liquid_cap'] - liquid['liquid_cap_air'] - air_gap) // volume)
+
+        for cycle in cycles(dispensings, dispensings_per_aspiration):
+            p300.default_speed = liquid['speed']
+            p300.aspirate(volume * len(cycle), reservoir_access(reservoir_01, cycle, reservoir_z(reservoir_01, 'chloroform_isoamyl', volume * len(cycle), liquid['aspirate_z'])), rate = liquid['aspirate_rate']) # Chloroform pipetting
+            p300.aspirate(air_gap, location = reservoir_access(reservoir_01, cycle, liquid['aspirate_z'], top = True)) # Air gap
+            air_in_tip = air_gap
+            for samples_wells in cycle:
+                p300.dispense(volume + air_in_tip, location = samples_wells.top(z = liquid['first_dispense_z']), rate = liquid['dispense_rate'])
+                air_in_tip = 0
                 
         p300.drop_tip()
-    time_dispensing_chloroform = 7                      # Defining a time (s) variable to calculate the duration of the step
 
-    volume_1 = 290 #
-    volume_2 = 85 #
-    
     def Supernatant_transfer(samples_plate, final_plate, transfer_tiprack):
+        supernatant = liquid_classes['extraction_buffer']['supernatant']
+        volume_1, volume_2 = supernatant['volumes']
+        first_z, second_z = (distance_interstice_to_bottom + z for z in supernatant['interstice_z'])      # Clear of the water-chloroform interstice
+        first_rate, second_rate = supernatant['aspirate_rates']
+        first_descent_speed, second_descent_speed = supernatant['descent_speeds']
+        first_dispense_rate, second_dispense_rate = supernatant['dispense_rates']
+        air_gap = supernatant['air_gap']
 
         for source, destination, t in zip(samples_plate, final_plate, transfer_tiprack):
             
             p300.pick_up_tip(location = t)
             p300.move_to(source.top(-16), speed = 400)
-            p300.move_to(source.bottom(z = distance_interstice_to_bottom + 3.25), speed = 15)                 # The z value is the distance to avoid touching the water-Chloroform interstice
-            p300.aspirate(volume_1, source.bottom(z = distance_interstice_to_bottom + 3.25), rate = 0.6)      # The z value is the distance to avoid touching the water-Chloroform interstice
-            p300.air_gap(10)
+            p300.move_to(source.bottom(z = first_z), speed = first_descent_speed)
+            p300.aspirate(volume_1, source.bottom(z = first_z), rate = first_rate)
+            p300.air_gap(air_gap)
 
-            p300.default_speed = 200
-            p300.dispense(volume_1 + 10, destination.top(z = 1), rate = 1)            
-            p300.blow_out(location = destination.top(z = -1))
-            p300.touch_tip(location = destination, v_offset = -3, radius = 1.2, speed = 40)
+            p300.default_speed = supernatant['dispense_speed']
+            p300.dispense(volume_1 + air_gap, destination.top(z = 1), rate = first_dispense_rate)            
+            p300.blow_out(location = destination.top(z = supernatant['blow_out_z']))
+            p300.touch_tip(location = destination, **supernatant['touch_tip'])
 
             p300.move_to(source.top(-16), speed = 400)
-            p300.move_to(source.bottom(z = distance_interstice_to_bottom + 2.5), speed = 7)                  # The z value is the distance to avoid touching the water-Chloroform interstice
-            p300.aspirate(volume_2, source.bottom(z = distance_interstice_to_bottom + 2.5), rate = 0.2)    # The z value is the distance to avoid touching the water-Chloroform interstice
-            p300.air_gap(10)
+            p300.move_to(source.bottom(z = second_z), speed = second_descent_speed)
+            p300.aspirate(volume_2, source.bottom(z = second_z), rate = second_rate)
+            p300.air_gap(air_gap)
 
-            p300.default_speed = 200
-            p300.dispense(volume_2 + 10, destination.top(z = 1), rate = 2.5)
+            p300.default_speed = supernatant['dispense_speed']
+            p300.dispense(volume_2 + air_gap, destination.top(z = 1), rate = second_dispense_rate)
      
-            p300.blow_out(location = destination.top(z = -1))
-            p300.touch_tip(location =destination, v_offset = -3, radius = 1.2, speed = 40)
+            p300.blow_out(location = destination.top(z = supernatant['blow_out_z']))
+            p300.touch_tip(location = destination, **supernatant['touch_tip'])
             p300.default_speed = 400
             p300.drop_tip(location = t, home_after = False)                            # This will return the tip in the tip rack at the same location were it was attached. This can be usefull if we would like to reuse the tips for removing isopropanol and ethanol from wash.
 
-    time_supernatant_transfer = 45   
+    def Supernatant_transfer_optimised(samples_plate, final_plate, transfer_tiprack):
+        # Same volumes, flow rates and interstice safety heights as Supernatant_transfer() with shorter moves: the tip goes straight
+        # (one arc) to just above the aqueous phase and descends slowly only through the liquid, the blow-out is done at the touch-tip height.
+        supernatant = liquid_classes['extraction_buffer']['supernatant']
+        volume_1, volume_2 = supernatant['volumes']
+        first_z, second_z = (distance_interstice_to_bottom + z for z in supernatant['interstice_z'])      # Clear of the water-chloroform interstice
+        first_rate, second_rate = supernatant['aspirate_rates']
+        first_descent_speed, second_descent_speed = supernatant['descent_speeds']
+        first_dispense_rate, second_dispense_rate = supernatant['dispense_rates']
+        air_gap = supernatant['air_gap']
+        blow_out_z = supernatant['touch_tip']['v_offset']
 
-    def isopropanol_dispensing():
-        isopropanol_volume = 295
-        p300.pick_up_tip(tiprack_9["A1"])                  # transfer_tiprack_1 is always the firts tip rack for Isopropanol dispensing and supernanter stransfer
-        p300.default_speed = 400
-        
-        for plate in final_plates:
-            for d in plate:
-                p300.aspirate(isopropanol_volume, reservoir_01.bottom(z = 2.5))
-                p300.air_gap(5)
-                p300.dispense(isopropanol_volume + 5, d.top(10))
-                p300.aspirate(10, d.top(10))
-                p300.dispense(volume = 10, location = reservoir_01.top(z = 4))
-        p300.drop_tip()
+        def approach_height(well, z):                       # 2mm above the liquid (volume model), never lower than the aspiration height nor higher than the standard approach (top -16mm)
+            return max(z, min(well.depth - 16, liquid_height(well, p300.volume(well)) + 2))
 
-    time_isopropanol_dispensing = 5                                 # Defining a time (s) variable to calculate the duration of the step
+        single_trip = tip_capacity() >= volume_1 + volume_2 + air_gap                                  # Both aspirations in one trip (1000uL tips)
 
-    def isopropanol_distribution(all_samples_vector, volume, top_dispense_heigth, return_tip, source):
+        for source, destination, t in zip(samples_plate, final_plate, transfer_tiprack):
+            p300.pick_up_tip(location = t)
+            p300.move_to(source.bottom(z = approach_height(source, first_z)), speed = 400)
+            p300.move_to(source.bottom(z = first_z), speed = first_descent_speed)
+            p300.aspirate(volume_1, source.bottom(z = first_z), rate = first_rate)
+
+            if single_trip:                                                                            # The tip stays in the aqueous phase and goes down to the second height
+                p300.move_to(source.bottom(z = second_z), speed = second_descent_speed)
+                p300.aspirate(volume_2, source.bottom(z = second_z), rate = second_rate)
+                p300.air_gap(air_gap)
+
+                p300.default_speed = supernatant['dispense_speed']
+                p300.dispense(volume_1 + volume_2 + air_gap, destination.top(z = 1), rate = first_dispense_rate)
+                p300.blow_out(location = destination.top(z = blow_out_z))
+                p300.touch_tip(location = destination, **supernatant['touch_tip'])
+                p300.default_speed = 400
+                p300.drop_tip(location = t, home_after = False)
+                continue
 
-        nb_consecutive_dispense = 300 // volume
-        nb_full_distribution = len(all_samples_vector) // nb_consecutive_dispense
-        
-        p300.default_speed = 400
-        p300.pick_up_tip(tiprack_9["A1"]) # Preventing a bug, it has to be define in this function
-        count = 1
-        while count <= nb_full_distribution + 1:
-
-            if count == 1 :
-                samples_start = 0
-                samples_end = nb_consecutive_dispense
-            
-            elif count > 1 and count <= nb_full_distribution:
-                 samples_start = (count * nb_consecutive_dispense) - nb_consecutive_dispense   
-                 samples_end = samples_start + nb_consecutive_dispense                      
-            
-            elif count == (nb_full_distribution + 1):
-                samples_start = (nb_full_distribution * nb_consecutive_dispense)
-                samples_end = len(all_samples_vector)     
-            
-            destinations = all_samples_vector[samples_start:samples_end]
+            p300.air_gap(air_gap)
 
+            p300.default_speed = supernatant['dispense_speed']
+            p300.dispense(volume_1 + air_gap, destination.top(z = 1), rate = first_dispense_rate)
+            p300.blow_out(location = destination.top(z = blow_out_z))
+            p300.touch_tip(location = destination, **supernatant['touch_tip'])
+
+            p300.move_to(source.bottom(z = approach_height(source, second_z)), speed = 400)
+            p300.move_to(source.bottom(z = second_z), speed = second_descent_speed)
+            p300.aspirate(volume_2, source.bottom(z = second_z), rate = second_rate)
+            p300.air_gap(air_gap)
+
+            p300.default_speed = supernatant['dispense_speed']
+            p300.dispense(volume_2 + air_gap, destination.top(z = 1), rate = second_dispense_rate)
+            p300.blow_out(location = destination.top(z = blow_out_z))
+            p300.touch_tip(location = destination, **supernatant['touch_tip'])
             p300.default_speed = 400
-            p300.aspirate(290, source.bottom(z = 2.5), rate = 1)
-            time.sleep(1)
-            p300.air_gap(10)
+            p300.drop_tip(location = t, home_after = False)
 
-            for column in destinations:
 
-                p300.dispense(volume + 10, location = column.top(z = top_dispense_heigth), rate = 1)
-                p300.air_gap(10)
+    def isopropanol_dispensing():
+        liquid = liquid_classes['isopropanol']
+        isopropanol_volume = reagent_sample_volumes['isopropanol']
+        p300.pick_up_tip(reagent_tip('Isopropanol dispensing'))
+        p300.default_speed = liquid['speed']
+
+        # Columns served by one aspiration (air gap included): one with 300uL tips, three with 1000uL tips
+        columns_per_aspiration = int((tip_capacity() - liquid['leading_air_gap']) // isopropanol_volume)
+        for columns in cycles([d for plate in final_plates for d in plate], columns_per_aspiration):
+            p300.aspirate(isopropanol_volume * len(columns), reservoir_access(reservoir_01, columns, reservoir_z(reservoir_01, 'isopropanol', isopropanol_volume * len(columns), liquid['aspirate_z'])), rate = liquid['aspirate_rate'])
+            p300.air_gap(liquid['leading_air_gap'])
+            air_in_tip = liquid['leading_air_gap']
+            for d in columns:
+                p300.dispense(isopropanol_volume + air_in_tip, d.top(10), rate = liquid['dispense_rate'])
+                p300.aspirate(liquid['air_gap'], d.top(10))                 # Expelled with the next dispense, or back to the reservoir
+                air_in_tip = liquid['air_gap']
+            p300.dispense(volume = liquid['air_gap'], location = reservoir_access(reservoir_01, columns, 4, top = True))
+        p300.drop_tip()
 
-            p300.default_speed = 400
-            p300.blow_out(location = source)
-            
-            count += 1
 
-        if return_tip == True:
-            p300.return_tip()
-        else:
-            p300.drop_tip()
+    def tiprack_blow_out(t, z):                 # Blowing out the drops left in the tip on the side walls of its tiprack well
+        center_location = t.center()
+        p300.blow_out(location = t.top(z = -8))
+        p300.blow_out(center_location.move(types.Point(x = 1, y = 4, z = z)))  
+        p300.blow_out(center_location.move(types.Point(x = 1, y =-4, z = z)))  
+        p300.blow_out(center_location.move(types.Point(x = 4, y = 1, z = z)))  
+        p300.blow_out(center_location.move(types.Point(x =-4, y = 1, z = z)))  
+        p300.blow_out(center_location.move(types.Point(x = 0, y = 0, z = z)))
 
     def isopropanol_discarding(final_plate, transfer_tiprack):
+        removal = liquid_classes['isopropanol']['removal']
+        (first_volume, first_z), (second_volume, second_z), (last_volume, last_z) = removal['aspirations']
+        first_release_z, second_release_z = removal['air_gap_release_z']
+        first_rate, second_rate, last_rate = removal['aspirate_rates']
+        air_gap = removal['air_gap']
         for s, t in zip(final_plate, transfer_tiprack):
             p300.default_speed = 400
             p300.pick_up_tip(location = t)
 
             # Doing a blow out on the side walls of the tiprak
-            center_location = t.center()
-            p300.blow_out(location = t.top(z = -8))
-            p300.blow_out(center_location.move(types.Point(x = 1, y = 4, z = 21.5)))  
-            p300.blow_out(center_location.move(types.Point(x = 1, y =-4, z = 21.5)))  
-            p300.blow_out(center_location.move(types.Point(x = 4, y = 1, z = 21.5)))  
-            p300.blow_out(center_location.move(types.Point(x =-4, y = 1, z = 21.5)))  
-            p300.blow_out(center_location.move(types.Point(x = 0, y = 0, z = 21.5)))
+            tiprack_blow_out(t, removal['tip_blow_out_z'])
               
-            p300.aspirate(location =s.bottom(z = 8), volume = 295, rate = 0.7)
-            p300.air_gap(5)
-            p300.dispense(location = trash, volume = 300, rate = 2)
-            p300.air_gap(5)
-
-
-            p300.move_to(location = s.bottom(14))
-            p300.dispense(location = s.bottom(14), volume = 5)
-            p300.move_to(location = s.bottom(z = 4), speed = 30)            
-            p300.aspirate(location =s.bottom(z = 4), volume = 295, rate = 0.4)
-            p300.dispense(location = trash, volume = 300, rate = 2)
-            p300.air_gap(5)
-
-            p300.move_to(location = s.bottom(11))
-            p300.dispense(location = s.bottom(11), volume = 5)
-            p300.move_to(location = s.bottom(z = 1.75), speed = 30)            
-            p300.aspirate(location =s.bottom(z = 1.75), volume = 70, rate = 0.1)
-            p300.air_gap(5)
+            p300.aspirate(location =s.bottom(z = well_z(s, first_volume, first_z)), volume = first_volume, rate = first_rate)
+            p300.air_gap(air_gap)
+            p300.dispense(location = trash, volume = first_volume + air_gap, rate = removal['dispense_rate'])
+            p300.aspirate(air_gap, s.top())                                 # Air gap taken over the well: air_gap() cannot be done over the trash bin
+
+
+            p300.move_to(location = s.bottom(first_release_z))
+            p300.dispense(location = s.bottom(first_release_z), volume = air_gap)
+            z = well_z(s, second_volume, second_z)
+            p300.move_to(location = s.bottom(z = z), speed = removal['descent_speed'])            
+            p300.aspirate(location =s.bottom(z = z), volume = second_volume, rate = second_rate)
+            p300.dispense(location = trash, volume = second_volume, rate = removal['dispense_rate'])
+            p300.aspirate(air_gap, s.top())                                 # Air gap taken over the well: air_gap() cannot be done over the trash bin
+
+            p300.move_to(location = s.bottom(second_release_z))
+            p300.dispense(location = s.bottom(second_release_z), volume = air_gap)
+            p300.move_to(location = s.bottom(z = last_z), speed = removal['descent_speed'])            
+            p300.aspirate(location =s.bottom(z = last_z), volume = last_volume, rate = last_rate)
+            p300.air_gap(air_gap)
 
             p300.default_speed = 400
             p300.drop_tip(location = t, home_after = False)    # Drop_tip with no arguments will drop the tips in the trash.
     
-    time_isopropanol_discarding = 55
 
     def ethanol_dispensing():
-        p300.default_speed = 400
-        p300.pick_up_tip(tiprack_9["A2"])
+        liquid = liquid_classes['ethanol_70']
+        ethanol_volume = reagent_sample_volumes['ethanol_70']
+        p300.default_speed = liquid['speed']
+        p300.pick_up_tip(reagent_tip('Ethanol dispensing'))
         for plate in final_plates:
             for f in plate:
                 center_location = f.center()
-                p300.aspirate(295, reservoir_01.bottom(z = 2.5), rate = 1.5)
-                p300.air_gap(5)
-                p300.dispense(300, center_location.move(types.Point(x = 1.25, y = 0, z = 22)), rate = 0.8) # Dispensing on the sidewall to avoid detachment of the DNA pellet at the bottom of the tubes.
-                p300.blow_out(f.top(z = 4)) # Messy
+                p300.aspirate(ethanol_volume, reservoir_access(reservoir_01, f, reservoir_z(reservoir_01, 'ethanol_70', ethanol_volume, liquid['aspirate_z'])), rate = liquid['aspirate_rate'])
+                p300.air_gap(liquid['leading_air_gap'])
+                p300.dispense(ethanol_volume + liquid['leading_air_gap'], center_location.move(types.Point(x = 1.25, y = 0, z = 22)), rate = liquid['dispense_rate']) # Dispensing on the sidewall to avoid detachment of the DNA pellet at the bottom of the tubes.
+                p300.blow_out(f.top(z = liquid['blow_out_z'])) # Messy
                 #p300.air_gap(5) # Useless
         p300.drop_tip()
 
     def ethanol_discarding(final_plate, transfer_tiprack):
+        removal = liquid_classes['ethanol_70']['removal']
+        (first_volume, first_z), (second_volume, second_z), (last_volume, last_z) = removal['aspirations']
+        first_rate, second_rate, last_rate = removal['aspirate_rates']
+        second_descent_speed, last_descent_speed = removal['descent_speeds']
         for s, t in zip(final_plate, transfer_tiprack):
             p300.pick_up_tip(location = t)
             p300.move_to(location = t.top(z = 0)) # Experimental to avoid the Homing after picking up the tip
 
             # Doing a blow out on the side walls of the tiprak
-            center_location = t.center()
-            p300.blow_out(location = t.top(z = -8))
-            p300.blow_out(center_location.move(types.Point(x = 1, y = 4, z = 21)))    
-            p300.blow_out(center_location.move(types.Point(x = 1, y =-4, z = 21)))    
-            p300.blow_out(center_location.move(types.Point(x = 4, y = 1, z = 21)))    
-            p300.blow_out(center_location.move(types.Point(x =-4, y = 1, z = 21)))    
-            p300.blow_out(center_location.move(types.Point(x = 0, y = 0, z = 21))) 
-
-            p300.aspirate(location =s.bottom(z = 5), volume = 200, rate = 0.7)
-            
-            p300.move_to(location = s.bottom(z = 3), speed = 20)
-            p300.aspirate(location =s.bottom(z = 3), volume = 60, rate = 0.2)
-
-            p300.move_to(location = s.bottom(z = 2), speed = 10)
-            p300.aspirate(location =s.bottom(z = 2), volume = 35, rate = 0.1)
-            p300.air_gap(5)
-            
-            p300.drop_tip(t, home_after = False)      # Drop_tip with no arguments will drop the tips in the trash.     
-
-
-    time_ethanol_discarding = 32                       # Defining a time (s) variable to calculate the duration of the step
-
-    def EBbuffer_dispensing():
-            p300.default_speed = 400
-            p300.pick_up_tip()    
-            for plate in final_plates:   
-                for f in plate:
-                    p300.aspirate(elution_buffer_volume, reservoir_01.bottom(z = 1.5))
-                    p300.air_gap(10)
-                    p300.dispense(elution_buffer_volume + 10, f.top(0))
-                    p300.blow_out(f.top(1))
-            p300.drop_tip()
-
-    def EB_distribute(all_samples_vector, volume, bottom_dispense_heigth, return_tip, source):
+            tiprack_blow_out(t, removal['tip_blow_out_z'])
 
-        nb_consecutive_dispense = 300 // volume
-        nb_full_distribution = len(all_samples_vector) // nb_consecutive_dispense
-        
-        p300.default_speed = 400
-        p300.pick_up_tip(tiprack_9["A3"])
-        count = 1
-        while count <= nb_full_distribution + 1:
-
-            if count == 1 :
-                samples_start = 0
-                samples_end = nb_consecutive_dispense
-            
-            elif count > 1 and count <= nb_full_distribution:
-                 samples_start = (count * nb_consecutive_dispense) - nb_consecutive_dispense 
-                 samples_end = samples_start + nb_consecutive_dispense                       
+            p300.aspirate(location =s.bottom(z = well_z(s, first_volume, first_z)), volume = first_volume, rate = first_rate)
             
-            elif count == (nb_full_distribution + 1):
-                samples_start = (nb_full_distribution * nb_consecutive_dispense)
-                samples_end = len(all_samples_vector)     
-            
-            destinations = all_samples_vector[samples_start:samples_end]
+            z = well_z(s, second_volume, second_z)
+            p300.move_to(location = s.bottom(z = z), speed = second_descent_speed)
+            p300.aspirate(location =s.bottom(z = z), volume = second_volume, rate = second_rate)
 
-            p300.default_speed = 400
-            p300.aspirate(300, source.bottom(z = 1.75), rate = 1)
+            p300.move_to(location = s.bottom(z = last_z), speed = last_descent_speed)
+            p300.aspirate(location =s.bottom(z = last_z), volume = last_volume, rate = last_rate)
+            p300.air_gap(removal['air_gap'])
             
-            dispense_count = 1
-            for column in destinations:
+            p300.drop_tip(t, home_after = False)      # Drop_tip with no arguments will drop the tips in the trash.     
 
-                if dispense_count == 1:
-                    volume_to_dispense = volume
-                    p300.default_speed = 400
-                else:
-                    volume_to_dispense = volume + 10
-                    p300.default_speed = 100
-               
-                p300.dispense(volume_to_dispense, location = column.bottom(z = bottom_dispense_heigth), rate = 1)
-                p300.touch_tip(location = column, v_offset = 0.1, radius = 0.5, speed = 60) 
-                p300.air_gap(10)
 
-                dispense_count += 1
 
-            p300.default_speed = 400
-            p300.blow_out(location = source)
-            
-            count += 1
+    def TE_buffer_dispensing():
+        distribute('te_water', all_samples, volume = 50, dispense_heigth = 40, source = water_reservoir_01, tip = reagent_tip('TE buffer dispensing'))   # The tip is kept for ExtractionBuffer_dispense()
 
-        if return_tip == True:
-            p300.return_tip()
-        else:
-            p300.drop_tip()
+    def supernatant_transfer_all():
+        transfer = Supernatant_transfer_optimised if supernatant_transfer_mode == 'optimised' else Supernatant_transfer
+        for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
+            transfer(samples, final, tiprack)
+
+    def isopropanol_discarding_all():
+        for final, tiprack in zip(final_plates, transfer_tipracks):
+            isopropanol_discarding(final, tiprack)
+
+    def ethanol_discarding_all():
+        for final, tiprack in zip(final_plates, transfer_tipracks):
+            ethanol_discarding(final, tiprack)
+
+    def elution_buffer_dispensing():
+        distribute('elution_buffer', all_final_plates, volume = elution_buffer_volume, dispense_heigth = 16, source = reservoir_01, return_tip = False, tip = reagent_tip('Elution buffer dispensing'))
+
+    def logged(name, step):
+        # The step, logging its real duration on the robot (see StepLog) next to the estimate of a dry-run of the same call
+        def logged_step(*args, **kwargs):
+            if step_log is None or isinstance(p300.pipette, TimedPipette):
+                return step(*args, **kwargs)
+            estimate = dry_run(lambda: step(*args, **kwargs))
+            step_plates = [plate for plate, columns in sample_plates if any(vector is samples_columns[plate] for vector in plates)]
+            step_log.start(name, step_plates, estimate)
+            try:
+                return step(*args, **kwargs)
+            finally:
+                step_log.end()
+        return logged_step
+
+    TE_buffer_dispensing = logged('TE buffer dispensing', TE_buffer_dispensing)
+    ExtractionBuffer_dispense = logged('Extraction buffer dispensing', ExtractionBuffer_dispense)
+    dispensing_chloroform_and_pipetteMixing = logged('Chloroform dispensing', dispensing_chloroform_and_pipetteMixing)
+    dispensing_chloroform_and_bubbleMixing = logged('Chloroform dispensing', dispensing_chloroform_and_bubbleMixing)
+    dispensing_chloroform = logged('Chloroform dispensing', dispensing_chloroform)
+    supernatant_transfer_all = logged('Supernatant transfer', supernatant_transfer_all)
+    isopropanol_dispensing = logged('Isopropanol dispensing', isopropanol_dispensing)
+    isopropanol_discarding_all = logged('Isopropanol discarding', isopropanol_discarding_all)
+    ethanol_dispensing = logged('Ethanol dispensing', ethanol_dispensing)
+    ethanol_discarding_all = logged('Ethanol discarding', ethanol_discarding_all)
+    elution_buffer_dispensing = logged('Elution buffer dispensing', elution_buffer_dispensing)
+
+    chloroform_steps = {'pipette_mixing': dispensing_chloroform_and_pipetteMixing,
+                        'bubble_mixing': dispensing_chloroform_and_bubbleMixing,
+                        'no_mixing': dispensing_chloroform,
+                        'heater_shaker': dispensing_chloroform}
+
+    def robot_steps():                          # The robot steps of this configuration, in the order they are run
+        steps = [('TE buffer dispensing', TE_buffer_dispensing),
+                 ('Extraction buffer dispensing', ExtractionBuffer_dispense),
+                 ('Chloroform dispensing', chloroform_steps[chloroform_buffer_mixing]),
+                 ('Supernatant transfer', supernatant_transfer_all),
+                 ('Isopropanol dispensing', isopropanol_dispensing)]
+        if pipetteOff_isopropanol == True:
+            steps.append(('Isopropanol discarding', isopropanol_discarding_all))
+        steps.append(('Ethanol dispensing', ethanol_dispensing))
+        if pipetteOff_ethanol == True:
+            steps.append(('Ethanol discarding', ethanol_discarding_all))
+        steps.append(('Elution buffer dispensing', elution_buffer_dispensing))
+        return steps
+
+    def dry_run(step, *args, well_volumes = None):
+        # Runs a step on the timing model and returns it (seconds, distance, well volumes...), the robot does not move.
+        # The step starts from "well_volumes" (see TrackedPipette), by default the volumes in the wells now.
+        nonlocal p300
+        robot_pipette = p300
+        volumes = dict(reservoir_volumes)
+        p300 = TrackedPipette(TimedPipette(robot_pipette, ctx, trash), robot_pipette.plates, robot_pipette.volumes if well_volumes is None else well_volumes)
+        try:
+            step(*args)
+            return p300
+        finally:
+            p300 = robot_pipette
+            reservoir_volumes.update(volumes)
+
+    def estimate_step_time(step, *args):        # Estimated duration (s) of a step
+        return dry_run(step, *args).seconds
+
+    def path_savings(step, optimised, well_volumes = None):     # Gantry travel (mm) and time (s) saved on a step by the path optimisation, from its optimised dry-run
+        nonlocal optimise_paths
+        optimise_paths = False
+        try:
+            original = dry_run(step, well_volumes = well_volumes)
+        finally:
+            optimise_paths = True
+        return original.distance - optimised.distance, original.seconds - optimised.seconds
+
+    step_times = {}                             # Estimated duration (s) of every robot step, see report_time_estimates()
+
+    def report_time_estimates():                # Lists the estimated duration of every robot step before any liquid moves
+        total_time = 0
+        not_estimated = 0
+        distance_saved = 0
+        time_saved = 0
+        well_volumes = p300.volumes             # Every step is dry-run on the well volumes left by the previous steps
+        for name, step in robot_steps():
+            try:
+                timed_step = dry_run(step, well_volumes = well_volumes)
+                step_time = timed_step.seconds
+                if optimise_paths:
+                    step_distance_saved, step_time_saved = path_savings(step, timed_step, well_volumes)
+                    distance_saved += step_distance_saved
+                    time_saved += step_time_saved
+                if poured_off(name):
+                    pour_off(timed_step)
+                well_volumes = timed_step.volumes
+            except Exception as error:
+                if type(error).__name__ != 'InvalidLabwarePositionError':
+                    raise
+                not_estimated += 1                  # Wells of labware waiting off deck have no coordinates yet, the step is estimated when they are placed
+                ctx.comment(f'Estimated robot time - {name}: estimated once its labware is placed on the deck')
+                continue
+            total_time += step_time
+            step_times[name] = step_time
+            ctx.comment(f'Estimated robot time - {name}: {truncate(step_time / 60, 1)} min')
+        if heater_shaker_mode:
+            shaking_time = len(sample_plates) * liquid_classes['chloroform_isoamyl']['heater_shaker']['shake_time']
+            total_time += shaking_time
+            step_times['Chloroform dispensing'] = step_times.get('Chloroform dispensing', 0) + shaking_time
+            ctx.comment(f'Estimated robot time - Emulsion shaking: {truncate(shaking_time / 60, 1)} min (plate moves not included)')
+        ctx.comment(f'Estimated robot time - whole run: {truncate(total_time / 60, 1)} min (manual steps, centrifugations and incubations not included)')
+        if not_estimated > 0:
+            ctx.comment(f'{not_estimated} step(s) not included in the whole run estimate')
+        if optimise_paths:
+            ctx.comment(f'Gantry path optimisation: {truncate(distance_saved / 1000, 1)} m less travel and {truncate(time_saved / 60, 1)} min saved over the estimated steps')
+
+    def poured_off(name):                       # True when the operator inverts the final plates to pour off the liquid of the robot step "name"
+        return (name == 'Isopropanol dispensing' and pipetteOff_isopropanol != True) or (name == 'Ethanol dispensing' and pipetteOff_ethanol != True)
+
+    def pour_off(pipette):                      # Empties the final plates in the well volumes of "pipette" (see TrackedPipette) once they are poured off
+        for well in all_final_plates:
+            pipette.empty(well)
+
+    def plate_chain():                          # The robot steps (see robot_steps()) and manual steps every plate goes through, as (name, manual)
+        manual_after = {'TE buffer dispensing': ['Grinding'], 'Extraction buffer dispensing': ['Incubation'], 'Chloroform dispensing': ['Centrifugation'],
+                        'Isopropanol dispensing': ['Centrifugation'], 'Ethanol dispensing': ['Centrifugation']}
+        chain = []
+        for name, step in robot_steps():
+            if name == 'Elution buffer dispensing':
+                chain.append(('Evaporation', True))
+            chain.append((name, False))
+            chain += [(manual, True) for manual in manual_after.get(name, []) + (['Plate inversion'] if poured_off(name) else [])]
+        return chain
+
+    def report_makespan():                      # Compares the run length of the sequential and staggered plans (see makespan()), from the step estimates
+        chain = plate_chain()
+        columns = {plate: len(plate_columns) for plate, plate_columns in sample_plates}
+        robot_minutes = {name: {plate: step_times.get(name, 0) / 60 * columns[plate] / total_number_of_columns for plate in columns}
+                         for name, manual in chain if not manual}
+        staggered = [chain.index(('Incubation', True))]
+        if mixing_with_tips:                    # The chloroform is mixed plate by plate with the tips of each plate
+            staggered.append(chain.index(('Chloroform dispensing', False)) + 1)
+        sequential_time = makespan(chain, robot_minutes, list(columns))
+        staggered_time = makespan(chain, robot_minutes, list(columns), staggered)
+        ctx.comment(f'Makespan - sequential plan: {truncate(sequential_time / 60, 2)} h, staggered plan: {truncate(staggered_time / 60, 2)} h '
+                    f'({round(sequential_time - staggered_time)} min less with Staggered plates, ' + ('used' if stagger_plates else 'not used') + ')' +
+                    (f' - {len(robot_steps()) - len(step_times)} robot step(s) not estimated' if len(step_times) < len(robot_steps()) else ''))
+
+    def report_tip_budget():                    # Lists the tips every step picks up (see tip_budget()) and the tipracks they come from
+        tips_per_pick = 96 if full_plate_mode else 8
+        for name, step in robot_steps():
+            picks = [reused for step_name, rack, column, stage, reused in tip_ledger if step_name == name]
+            ctx.comment(f'Tip budget - {name}: {picks.count(False) * tips_per_pick} new tips' + (f', {picks.count(True) * tips_per_pick} reused' if True in picks else ''))
+        new_tips = sum(not reused for step, rack, column, stage, reused in tip_ledger) * tips_per_pick
+        racks = len({rack for step, rack, column, stage, reused in tip_ledger if rack != 'reagent_tiprack'}) + sum(rack == 'reagent_tiprack' for step, rack, column, stage, reused in tip_ledger if not reused)
+        ctx.comment(f'Tip budget - whole run: {new_tips} tips from {racks} tipracks')
 
     def truncate(n, decimals=0):                # This function is used to round decimal number for time calculation
         multiplier = 10**decimals
@@ -576,29 +1570,16 @@ def run(ctx):
 #           REAGENTS                            REAGENTS                        REAGENTS 
 #
 #################################################################################################
-    dead_volume_samples_number = 20
     samples_number = total_number_of_columns * 8
-    
-    Metabisulfite = round((samples_number + dead_volume_samples_number) * 0.0028, 3) # gram/sample
-    PVPK29 = round((samples_number + dead_volume_samples_number) * 0.0056, 3) # gram/sample
-    StockLysisSolution_A = round((samples_number + dead_volume_samples_number) * 0.2344, 1) # mL/sample
-    StockLysisSolution_B = round((samples_number + dead_volume_samples_number)* 0.2344, 1) # mL/sample
-    Sarkosyl  = round((samples_number + dead_volume_samples_number) * 0.0938,1) # mL/sample
-    Rnase= int(round((samples_number + dead_volume_samples_number) * 0.2812, 0))  # uL/sample
-
-    # Chloroform/Acool Isoamyl (24:1) calculator
-    needed = (samples_number + dead_volume_samples_number) * 0.4 
-    AlcoholIsoamyl = math.ceil(needed / 24)
-    Chloroform = AlcoholIsoamyl * 24
-    
-    # Ethanol 70% calculator from 95% ethanol
-    quantity_needed = int(round((samples_number + dead_volume_samples_number) * 0.3, 0))# in Ml
-    C1 = 0.95  # C1 x V1 = C2 x V2
-    C2 = 0.7
-    V2 = quantity_needed
-    V1 = int(round(C2 * V2 / C1, 1))
-    volume_of_water1 = V2 - V1 # mL
-    volume_of_ethanol95 = V1 # mL
+    reagents = reagent_quantities(samples_number, reservoir_type, elution_buffer_volume)     # See reagent_quantities()
+    Metabisulfite, PVPK29, Rnase = reagents['Metabisulfite'], reagents['PVPK29'], reagents['Rnase']
+    StockLysisSolution_A, StockLysisSolution_B, Sarkosyl = reagents['StockLysisSolution_A'], reagents['StockLysisSolution_B'], reagents['Sarkosyl']
+    AlcoholIsoamyl, Chloroform = reagents['AlcoholIsoamyl'], reagents['Chloroform']
+    volume_of_water1, volume_of_ethanol95 = reagents['Water'], reagents['Ethanol_95']
+
+    # Volumes (uL) poured in the reservoirs, from which their liquid heights are tracked (see reservoir_z())
+    poured_volumes = reagents['poured']
+    reservoir_volumes = dict(poured_volumes)
 
 #################################################################################################
 #
@@ -614,8 +1595,9 @@ def run(ctx):
 
     comment_beginning = "Centrifuge the samples plates for 30s, then remove sealing tape and add metalic beads."
     
-    def comment_1(p, sp, tr, wr):
-        return f' Place samples plate {p} respectively on sites {sp} ---- Tipracks on sites {tr} ---- TE buffer reservoir on site {wr}'
+    def comment_1(p, sp, tr, wr):                # One checklist item per labware to place
+        return [f'Place samples plate {p} respectively on sites {sp}', f'Place tipracks on sites {tr}',
+                f'Place TE buffer reservoir (at least {math.ceil(poured_volumes["te_water"] / 1000)}mL) on site {wr}']
 
     def comment_2(sp): 
         return f'START TE buffer  dispensing to samples on sites {sp}'
@@ -637,677 +1619,438 @@ def run(ctx):
     def comment_decontaminate_chloroform(mixing_tipracks_sites):
         return f'Remove chloroform contaminated tipracks on sites {mixing_tipracks_sites} (dispose tips, clean tipracks)'
     
-################################            ##    
-#                              #          ####
-# ONE plate (96-well) protocol #            ##
-#                              #            ##   
-################################           ####    
-    if number_of_plates_to_extract == 1 :
-
-        # Load Labware
-        tiprack_1 = ctx.load_labware(tipsbox, 'D2')
-        transfer_tiprack_1 = ctx.load_labware(tipsbox, 'B1')
-        tiprack_9 = ctx.load_labware(tipsbox, 'C2')
-        samples_plate_1 = ctx.load_labware(samples_plate_type, 'D1')
-        final_plate_1 = ctx.load_labware(final_plate_type, 'C1')
-        reservoir_1 = ctx.load_labware(reservoir_type, 'D3')
-        water_reservoir = ctx.load_labware(reservoir_type, 'C3')
-        trash = ctx.load_trash_bin("A3")
-
-        # Load Instrument
-        p300 = ctx.load_instrument('flex_8channel_1000', 'left', tip_racks=[tiprack_1, transfer_tiprack_1, tiprack_9])
-        p300.default_speed = 200
-
-        # Subset only the columns with samples in your plates
-        samples_P1 = samples_plate_1.rows()[0][first_column_plate_1 - 1:last_column_plate_1]
-        plates = [samples_P1]
-        all_samples = [well for plate in plates for well in plate]
-
-        mixing_tiprack_1 = tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-        mixing_tipracks = [mixing_tiprack_1]
-
-        final_plate_01 = final_plate_1.rows()[0][first_column_plate_1 - 1:last_column_plate_1]
-        final_plates = [final_plate_01]
-        all_final_plates = [well for plate in final_plates for well in plate]
-
-        transfer_tiprack_01 = transfer_tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-        transfer_tipracks = [transfer_tiprack_01]
-
-        reservoir_01 = reservoir_1.wells()[0]
-        water_reservoir_01 = water_reservoir.wells()[0]
-
-
-        #############################################################################################################
-        #                                           DNA extraction actions
-        #############################################################################################################
-        
-        samples_sites = 'D1'
-        tipracks_sites = 'B1, C2 & D2'
-        mixing_tipracks_sites = 'D2'
-        water_reservoir_site ='C3'
-        reservoirs_sites = 'D3'
-
-        ctx.pause(comment_reagents_1(Metabisulfite, PVPK29, StockLysisSolution_A, StockLysisSolution_B, Sarkosyl, Rnase))
-        ctx.pause(comment_reagents_2(AlcoholIsoamyl, Chloroform, volume_of_water1, volume_of_ethanol95))
-        ctx.pause('''Place full Isopropanol reservoir at -20°C''')
-        ctx.pause(comment_beginning)
-        ctx.pause(comment_1(samples_sites, samples_sites, tipracks_sites, water_reservoir_site))
-        ctx.pause(comment_2(samples_sites))
-        
-        water_distribute(all_samples, volume = 50, bottom_dispense_heigth = 40, return_tip = True, source =  water_reservoir_01)
-
-        ctx.pause('''Grind samples on a tyssus-lyser machine''')
-        ctx.pause(comment_spinDown)
-        ctx.pause('''Place samples plate back to site D1. Add Rnase to Extraction buffer and place in reservoir on site D3''')
-        ctx.pause('''START post-grinding Extraction buffer dispensing to samples on site D1''')
-
-        ExtractionBuffer_dispense()
-        
-        ctx.pause('''Seal plates with sealing tape and invert plates 10 times. Spin plates then remove sealing tape and incubate the plates (65C, 60 min)''')
-        ctx.pause('''After incubation, place the plate back on site D1 and place Chloroform reservoir on site D3 and water reservoir on site C3''')
-        time_estimation = str(truncate((time_dispensing_chloroform_and_bubbleMixing * total_number_of_columns / 60), 1))
-        ctx.pause(comment_start_Chloro_dispensing(time_estimation))
-
-        if chloroform_buffer_mixing == 'pipette_mixing':
-            dispensing_chloroform_and_pipetteMixing()
-            ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-            ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-        if chloroform_buffer_mixing == 'bubble_mixing':
-            dispensing_chloroform_and_bubbleMixing()
-            ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-            ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-        if chloroform_buffer_mixing == 'no_mixing':
-            dispensing_chloroform()
-            ctx.pause('''Mix (vortex carefully) then centrifugate the plate (6000rpm, 10 min).''')
-        
-        ctx.pause('''When centrifugation is done place the samples plate back on site D1 and place an empty plate (1.0ml 96-Deep well) on site C1 (label the plate)''')
-        time_estimation = str(truncate(time_supernatant_transfer * total_number_of_columns / 60, 1))
-        ctx.pause(comment_start_Supernatant_transfer(time_estimation))
-
-        for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
-                    Supernatant_transfer(samples, final, tiprack)
-
-        ctx.pause('''Remove Chloroform reservoir on site D3 and place cold Isopropanol reservoir on site D3''')
-        ctx.pause('''START Isopropanol dispensing to plate on site C1''')
-
-        isopropanol_dispensing()   
-
-        ctx.pause('''At this point the plate (site C1) can be sealed and stored at -20C and the DNA extraction completed the next day (or later)'''  )
-        ctx.pause('''Seal and invert 20x the plate on site C1 then centrifugate (10min, 6000 rpm)''') # and prepare cold 70 percent ethanol
-
-
-        # Evaluating if the Isopropanol discarding is done by plate inversion or py pipetting off
-        if pipetteOff_isopropanol == True:
-            ctx.pause('''When centrifugation is done, place the plate back to site C1''')
-            time_estimation = str(truncate(time_isopropanol_discarding * total_number_of_columns / 60, 1))
-            ctx.pause(comment_start_Isopropanol_discarding(time_estimation))
-        
-            for final, tiprack in zip(final_plates, transfer_tipracks):
-                isopropanol_discarding(final, tiprack)
-        
-        if pipetteOff_isopropanol == False:
-            ctx.pause('''Gently invert the plate to poor off the supernatant then centrifuge the plate 10s''')
-            ctx.pause('''Place plate back to site C1''')
-
-        ctx.pause('''Remove Isopropanol reservoir on site D3, add Ethanol 70 percent reservoir to site D3''')
-        ctx.pause('''START Ethanol dispensing to plate on site C1''')
-
-        p300.starting_tip = tiprack_9.wells_by_name()['A1']
-
-        ethanol_dispensing()
-
-        ctx.pause('''Centrifugate the plate for 10 minutes at 6000 rpm''')
-
-        # Ethanol discarding method (by inversion or py pipetting off)       
-        if pipetteOff_ethanol == True:
-            ctx.pause('''When centrifugation is done, place the plate back on site C1''')
-            time_estimation = str(truncate(time_ethanol_discarding * total_number_of_columns / 60, 1))
-            ctx.pause(comment_start_Ethanol_discarding(time_estimation))
-            for final, tiprack in zip(final_plates, transfer_tipracks):
-                ethanol_discarding(final, tiprack)
-        if pipetteOff_ethanol == False:
-            ctx.pause('''Gently invert the plate to poor off the supernatant then centrifuge the plate (6000rpm, 10sec)''')
-        
-        ctx.pause('''Evaporate ethanol (20min, 45C). Remove and clean tiprack on site C1 (place tips in trash)''')
-        ctx.pause('''Prepare for Elution buffer dispensing: remove Ethanol reservoir on site D3 and place Elution buffer on site D3''')
-        ctx.pause('''When evaporation is done, place plate back to site C1''')
-        ctx.pause('''START Elution buffer dispensing''')
-
-        p300.starting_tip = tiprack_9.wells_by_name()['A2']
-        #EBbuffer_dispensing()
-        EB_distribute(all_final_plates, volume = elution_buffer_volume, bottom_dispense_heigth = 16, return_tip = False, source = reservoir_01)
-
-        ctx.pause('''Centrifuge plates at 4000rpm 5s. Seal plates with tape and store plates at 4C. DNA extraction completed''')
-        ctx.comment('\n~~~~~~~~~~~~~~Protocol Complete~~~~~~~~~~~~~~\n')
+#################################################################################################
+#
+#              DECK                            DECK                        DECK
+#
+#################################################################################################
 
+    # Load Labware: the first labware of every slot is loaded in it, the others wait off deck until their stage
+    def labware_type(name):
+        if 'tiprack' in name: return tipsbox
+        if 'samples_plate' in name: return samples_plate_type
+        if 'final_plate' in name: return final_plate_type
+        return reservoir_type
+
+    labware = {}
+    adapters = {}                               # Full-plate mode: tiprack adapter of every tiprack slot, the tipracks are swapped on it
+    for slot, names in plan['occupants'].items():
+        if full_plate_mode and names and 'tiprack' in names[0]:
+            adapters[slot] = ctx.load_adapter(full_plate_pipette['adapter'], slot)
+        for name in names:
+            if name in staged:
+                labware[name] = ctx.load_labware(labware_type(name), staged[name])
+            elif name != names[0]:
+                labware[name] = ctx.load_labware(labware_type(name), protocol_api.OFF_DECK)
+            elif slot in adapters:
+                labware[name] = adapters[slot].load_labware(labware_type(name))
+            else:
+                labware[name] = ctx.load_labware(labware_type(name), slot)
+    trash = ctx.load_trash_bin("A3")
+
+    # Heater-Shaker mode: the samples plates are moved on the deep well adapter of the module to be incubated or shaken
+    incubation_temperature = 65                 # °C
+    incubation_time = 60                        # min
+    incubate_on_deck = heater_shaker_mode and len(sample_plates) == 1      # The module holds one plate: several plates go to the water bath
+    if heater_shaker_mode:
+        heater_shaker = ctx.load_module('heaterShakerModuleV1', heater_shaker_slots['module'])
+        heater_shaker_adapter = heater_shaker.load_adapter('opentrons_96_deep_well_adapter')
+        heater_shaker.close_labware_latch()     # The pipette cannot move next to an open latch
+
+    plate_numbers = [plate for plate, columns in sample_plates]
+    tiprack_names = [name for name in plan['lifetimes'] if name.startswith('tiprack_') and name != 'tiprack_9']
+
+    reagent_tiprack_names = [name for name in ('tiprack_9', 'reagent_tiprack') if name in labware]
+
+    # Load Instrument
+    tipracks = [labware[name] for name in tiprack_names] + [labware[f'transfer_tiprack_{plate}'] for plate in plate_numbers] + [labware[name] for name in reagent_tiprack_names]
+    if full_plate_mode:
+        p300 = ctx.load_instrument(full_plate_pipette['name'], 'left', tip_racks = tipracks)
     else:
-
-###############################          ####
-#                             #        ##    ##
-# TWO plates 96-well protocol #             ##
-#                             #           ##        
-###############################         #######
-
-        if number_of_plates_to_extract == 2 :
-            
-            # Load Labware
-            tiprack_1 = ctx.load_labware(tipsbox, 'C3')
-            tiprack_2 = ctx.load_labware(tipsbox, 'B3')
-            transfer_tiprack_1 = ctx.load_labware(tipsbox, 'B1')
-            transfer_tiprack_2 = ctx.load_labware(tipsbox, 'B2')
-            tiprack_9 = ctx.load_labware(tipsbox, 'A1')
-            samples_plate_1 = ctx.load_labware(samples_plate_type, 'D1')
-            samples_plate_2 = ctx.load_labware(samples_plate_type, 'D2')
-            final_plate_1 = ctx.load_labware(final_plate_type, 'C1')
-            final_plate_2 = ctx.load_labware(final_plate_type, 'C2')
-            reservoir_1 = ctx.load_labware(reservoir_type, 'D3')
-            water_reservoir = ctx.load_labware(reservoir_type, 'A2')
-            trash = ctx.load_trash_bin("A3")
-
-            # Load Instrument
-            p300 = ctx.load_instrument('flex_8channel_1000', 'left', tip_racks=[tiprack_1, tiprack_2, transfer_tiprack_1, transfer_tiprack_2, tiprack_9])
-            p300.default_speed = 200
-
-            # Subset only the columns with samples in your plates
-            samples_P1 = samples_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-            samples_P2 = samples_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-            plates = [samples_P1, samples_P2]
-            all_samples = [well for plate in plates for well in plate]
-
-            mixing_tiprack_1 = tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-            mixing_tiprack_2 = tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-            mixing_tipracks = [mixing_tiprack_1, mixing_tiprack_2]
-
-            final_plate_01 = final_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-            final_plate_02 = final_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-            final_plates = [final_plate_01, final_plate_02]
-            all_final_plates = [well for plate in final_plates for well in plate]
-
-            transfer_tiprack_01 = transfer_tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-            transfer_tiprack_02 = transfer_tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-            transfer_tipracks = [transfer_tiprack_01, transfer_tiprack_02]
-            
-            reservoir_01 = reservoir_1.wells()[0]
-            water_reservoir_01 = water_reservoir.wells()[0]
-
-            #############################################################################################################
-            #                                           DNA extraction actions
-            #############################################################################################################
-            
-            samples_sites = 'D1 & D2'
-            tipracks_sites = 'B1, B2, B3, C3, A1'
-            mixing_tipracks_sites = 'C3 & B3'
-            water_reservoir_site ='A2'
-            reservoirs_sites = 'D3'
-
-            ctx.pause(comment_reagents_1(Metabisulfite, PVPK29, StockLysisSolution_A, StockLysisSolution_B, Sarkosyl, Rnase))
-            ctx.pause(comment_reagents_2(AlcoholIsoamyl, Chloroform, volume_of_water1, volume_of_ethanol95))
-            ctx.pause('''Place full Isopropanol reservoir at -20°C''')
-            ctx.pause(comment_beginning)
-            ctx.pause(comment_1(samples_sites, samples_sites, tipracks_sites, water_reservoir_site))          
-            ctx.pause(comment_2(samples_sites))
-            
-            water_distribute(all_samples, volume = 50, bottom_dispense_heigth = 40, return_tip = True, source =  water_reservoir_01)
-
-            ctx.pause('''Grind samples on a tyssus-lyser machine''')
-            ctx.pause(comment_spinDown)
-            ctx.pause('''Place samples plates back to respective sites D1 & D2. Add Rnase to Extraction buffer and place in reservoir on site D3''')
-            ctx.pause('''START dispensing of Extraction buffer to samples''')
-
-            ExtractionBuffer_dispense()
-
-            ctx.pause('''Seal plates with sealing tape and invert plates 10 times. Spin plates then remove sealing tape and incubate the plates (65C, 60 min)''')
-            ctx.pause('''After incubation place the plates back to respective sites D1 & D2 and place Chloroform reservoir on site D3 and place water reservoir on site A2''')
-            time_estimation = str(truncate((time_dispensing_chloroform_and_bubbleMixing * total_number_of_columns / 60), 1))
-            ctx.pause(comment_start_Chloro_dispensing(time_estimation))
-
-            if chloroform_buffer_mixing == 'pipette_mixing':
-                dispensing_chloroform_and_pipetteMixing()
-                ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-            if chloroform_buffer_mixing == 'bubble_mixing':
-                dispensing_chloroform_and_bubbleMixing()
-                ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-            if chloroform_buffer_mixing == 'no_mixing':
-                dispensing_chloroform()
-                ctx.pause('''Mix (vortex carefully) then centrifugate the plate (6000rpm, 10 min).''')
-
-            ctx.pause('''When the 10 minutes centrifugation is done place the sample plates back to respective sites D1 & D2 and place empty plates (1.0ml 96-Deep well) on sites C1 and C2 (label the plates)''')
-            
-            time_estimation = str(truncate(time_supernatant_transfer * total_number_of_columns / 60, 1))
-            ctx.pause(comment_start_Supernatant_transfer(time_estimation))
-               
-            for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
-                    Supernatant_transfer(samples, final, tiprack)
-
-            ctx.pause('''Remove Chloroform reservoir on site D3 and place Isopropanol reservoir on site D3''')
-            ctx.pause('''START Isopropanol dispensing to plates on site C1 & C2''')
-
-            isopropanol_dispensing()
-
-            ctx.pause('''At this point the plate (site C1 & C2) can be sealed and stored at -20C and the DNA extraction completed the next day (or later)'''  )
-            ctx.pause('''Seal and invert 20x the plate on site C1 & C2 then centrifugate (10min, 6000 rpm)''') # and prepare cold 70 percent ethanol
-
-
-            # Evaluating if the Isopropanol discarding is done by plate inversion or py pipetting off
-            if pipetteOff_isopropanol == True:
-                ctx.pause('''When centrifugation is done, place the plate back to respective sites C1 & C2''')
-                time_estimation = str(truncate(time_isopropanol_discarding * total_number_of_columns / 60, 1))
-                ctx.pause(comment_start_Isopropanol_discarding(time_estimation))
-
-                for final, tiprack in zip(final_plates, transfer_tipracks):
-                    isopropanol_discarding(final, tiprack)
-
-            if pipetteOff_isopropanol == False:
-                ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates 10s''')
-                ctx.pause('''Place plates back to respective sites C1 & C2''')
-
-
-            ctx.pause('''Remove Isopropanol reservoir on site D3, add Ethanol 70 percent reservoir to site D3''')
-            ctx.pause('''START Ethanol dispensing to plates on site C1 & C2''')
-
-            p300.starting_tip = tiprack_9.wells_by_name()['A1']
-
-            ethanol_dispensing()
-
-            ctx.pause('''Centrifugate the plates for 10 minutes at 6000 rpm''')
-
-            # Ethanol discarding method (by inversion or py pipetting off)       
-            if pipetteOff_ethanol == True:
-                ctx.pause('''When centrifugation is done, place the plates back to respective sites C1 & C2''')
-                time_estimation = str(truncate(time_ethanol_discarding * total_number_of_columns / 60, 1))
-                ctx.pause(comment_start_Ethanol_discarding(time_estimation))
-                for final, tiprack in zip(final_plates, transfer_tipracks):
-                    ethanol_discarding(final, tiprack)
-            if pipetteOff_ethanol == False:
-                ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates (6000rpm, 10sec)''')
-
-            ctx.pause('''Evaporate ethanol (20min, 45C). Remove and clean tipracks on sites C1 & B3 (place tips in trash)''')
-            ctx.pause('''Prepare for Elution buffer dispensing: remove Ethanol reservoir on site D3 and place Elution buffer on site D3''')
-            ctx.pause('''When evaporation is done, place plates back to respective sites C1 & C2''')
-            ctx.pause('''START Elution buffer dispensing''')
-            
-            p300.starting_tip = tiprack_9.wells_by_name()['A2']
-            #EBbuffer_dispensing()
-            EB_distribute(all_final_plates, volume = elution_buffer_volume, bottom_dispense_heigth = 16, return_tip = False, source = reservoir_01)
-            ctx.pause('''Centrifuge plates at 4000rpm 5s. Seal plates with tape and store plates at 4C. DNA extraction completed''')
-            ctx.comment('\n~~~~~~~~~~~~~~Protocol Complete~~~~~~~~~~~~~~\n')
-        
+        p300 = ctx.load_instrument('flex_8channel_1000', 'left', tip_racks = tipracks)
+    followed_plates = [name for name in labware if name.startswith(('samples_plate', 'final_plate'))]
+    step_log = None if ctx.is_simulating() else StepLog(p300, step_log_file, {'run': time.strftime('%Y-%m-%d %H:%M:%S'), 'run_id': uuid.uuid4().hex, 'robot': socket.gethostname(), 'protocol': metadata['protocolName']}, {id(labware[name]): name for name in followed_plates})
+    p300 = TrackedPipette(step_log or p300, [labware[name] for name in followed_plates])
+    p300.default_speed = 200
+
+    # Subset only the columns with samples in your plates. In the full-plate mode the A1 well stands for the whole plate (96 tips)
+    def sample_columns(name, plate):
+        if full_plate_mode:
+            return [labware[f'{name}_{plate}']['A1']]
+        columns = dict(sample_plates)[plate]
+        return [labware[f'{name}_{plate}'].rows()[0][column - 1] for column in columns]
+
+    samples_columns = {plate: sample_columns('samples_plate', plate) for plate in plate_numbers}
+    if distance_interstice_to_bottom == 0:      # Not entered: height measured for the samples plate type (see calibrate()), else on the original plates
+        calibrated = load_interstice_heights().get(samples_plate_type)
+        distance_interstice_to_bottom = calibrated or measured_interstice_height
+        ctx.comment(f'Interstice height: {round(distance_interstice_to_bottom, 2)} mm (' + ('measured, calibration cache)' if calibrated else f'{samples_plate_type} not calibrated, measured default)'))
+    final_columns = {plate: sample_columns('final_plate', plate) for plate in plate_numbers}
+    transfer_tiprack_columns = {plate: sample_columns('transfer_tiprack', plate) for plate in plate_numbers}
+
+    plates = [samples_columns[plate] for plate in plate_numbers]
+    all_samples = [well for plate in plates for well in plate]
+    mixing_tipracks = [sample_columns('tiprack', plate) for plate in plate_numbers] if mixing_with_tips else []
+    final_plates = [final_columns[plate] for plate in plate_numbers]
+    all_final_plates = [well for plate in final_plates for well in plate]
+    transfer_tipracks = [transfer_tiprack_columns[plate] for plate in plate_numbers]
+
+    reservoir_01 = labware['reservoir_1'].wells()[0]
+    water_reservoir_01 = labware['water_reservoir'].wells()[0]
+
+    def enumeration(items):                     # '1, 2 & 3'
+        items = [str(item) for item in items]
+        return ' & '.join([', '.join(items[:-1]), items[-1]]) if len(items) > 1 else items[0]
+
+    def sites(names):
+        return enumeration([plan['slot'][name] for name in names])
+
+    def on_sites(names):                        # 'site 4' or 'sites 1, 2 & 3'
+        return ('sites ' if len(names) > 1 else 'site ') + sites(names)
+
+    def samples_plates_text(numbers):
+        return ('samples plates ' if len(numbers) > 1 else 'samples plate ') + enumeration(numbers)
+
+    def change_labware(stage):                  # Swaps the labware of the slots shared with "stage", returns the labware the operator removes and places
+        removed = []
+        placed = []
+        swaps = [(slot, previous_name, name) for slot, names in plan['occupants'].items() for previous_name, name in zip(names, names[1:])
+                 if plan['lifetimes'][name][0] == stage]
+        swaps.sort(key = lambda swap: swap[2] not in staging.values())     # Gripper mode: the staged labware first, each frees a staging slot
+        if swaps:
+            give_instructions()                 # The deck has to be as the instructions given so far leave it
+        for slot, previous_name, name in swaps:
+            free_slots = [staging_slot for staging_slot, staged_name in staging.items() if staged_name is None]
+            if free_slots:
+                ctx.move_labware(labware = labware[previous_name], new_location = free_slots[0], use_gripper = True)
+                staging[free_slots[0]] = previous_name
+                taken_off.add(previous_name)
+                swap_moves['gripper'] += 1
+            else:
+                ctx.move_labware(labware = labware[previous_name], new_location = protocol_api.OFF_DECK)
+                removed.append(previous_name)
+            staging_slot = next((staging_slot for staging_slot, staged_name in staging.items() if staged_name == name), None)
+            if staging_slot:
+                ctx.move_labware(labware = labware[name], new_location = adapters.get(slot, slot), use_gripper = True)
+                staging[staging_slot] = None
+                swap_moves['gripper'] += 1
+            else:
+                ctx.move_labware(labware = labware[name], new_location = adapters.get(slot, slot))
+                placed.append(name)
+            swapped_in.add(name)
+        swap_moves['operator'] += len(removed) + len(placed)
+        operator_stops['labware_moves'] += len(removed) + len(placed)
+        return removed, placed
+
+    # Operator instructions: the instructions given between two robot actions are queued and given as one numbered checklist,
+    # so that the robot stops once for all of them. operator_stops counts the stops, the manual labware moves included.
+    pending_instructions = []
+    operator_stops = {'checklists': 0, 'labware_moves': 0}
+
+    def instruct(message):
+        pending_instructions.append(message.strip())
+
+    def refill_staging():                       # Gripper mode: staging slots the operator clears and labware placed on them at a checklist
+        upcoming = [name for name in waiting_labware if name not in swapped_in and name not in staging.values()]
+        if not upcoming:
+            return [], {}
+        empty = [slot for slot, name in staging.items() if name is None]
+        used = [slot for slot, name in staging.items() if name in taken_off]
+        kept_free = (empty + used)[:1]          # For the next labware the gripper takes off the deck
+        refilled = dict(zip(upcoming, [slot for slot in empty + used if slot not in kept_free]))
+        cleared = [slot for slot in used if slot in kept_free or slot in refilled.values()]
+        return cleared, refilled
+
+    def give_instructions():                    # Stops the robot for the instructions queued, if any
+        if not pending_instructions:
+            return
+        cleared, refilled = refill_staging() if gripper_mode else ([], {})
+        if refilled:
+            pending_instructions.insert(0, comment_staged_labware(refilled))
+        if cleared:
+            contaminated = any(staging[slot] in mixing_tiprack_names for slot in cleared)
+            pending_instructions.insert(0, f'Take the used labware off the staging slot{"s" if len(cleared) > 1 else ""} {enumeration(cleared)}' +
+                                        (' (chloroform contaminated tipracks: dispose tips, clean tipracks)' if contaminated else ''))
+        if len(pending_instructions) == 1:
+            ctx.pause(pending_instructions[0])
         else:
-             
-#################################            ###
-#                               #           #  ##
-# THREE plates 96-well protocol #             ##
-#                               #           #  ##
-#################################            ###
-             
-            if number_of_plates_to_extract == 3 :
-
-                # Load Labware
-                tiprack_1 = ctx.load_labware(tipsbox, 'B1')
-                tiprack_2 = ctx.load_labware(tipsbox, 'B2')
-                tiprack_3 = ctx.load_labware(tipsbox, 'B3')
-                transfer_tiprack_1 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                transfer_tiprack_2 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                transfer_tiprack_3 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                tiprack_9 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                samples_plate_1 = ctx.load_labware(samples_plate_type, 'D1')
-                samples_plate_2 = ctx.load_labware(samples_plate_type, 'D2')
-                samples_plate_3 = ctx.load_labware(samples_plate_type, 'D3')
-                final_plate_1 = ctx.load_labware(final_plate_type, 'C1')
-                final_plate_2 = ctx.load_labware(final_plate_type, 'C2')
-                final_plate_3 = ctx.load_labware(final_plate_type, 'C3')
-                reservoir_1 = ctx.load_labware(reservoir_type, 'A1')
-                water_reservoir = ctx.load_labware(reservoir_type, 'A2')
-                trash = ctx.load_trash_bin("A3")
-
-                # Load Instrument
-                p300 = ctx.load_instrument('flex_8channel_1000', 'left', tip_racks=[tiprack_1, tiprack_2, tiprack_3, transfer_tiprack_1, transfer_tiprack_2, transfer_tiprack_3, tiprack_9])
-                p300.default_speed = 200
-
-                # Subset only the columns with samples in your plates
-                samples_P1 = samples_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                samples_P2 = samples_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                samples_P3 = samples_plate_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                plates = [samples_P1, samples_P2, samples_P3]                
-                all_samples = [well for plate in plates for well in plate]
-
-                mixing_tiprack_1 = tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                mixing_tiprack_2 = tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                mixing_tiprack_3 = tiprack_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                mixing_tipracks = [mixing_tiprack_1, mixing_tiprack_2, mixing_tiprack_3]
-
-                final_plate_01 = final_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                final_plate_02 = final_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                final_plate_03 = final_plate_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                final_plates = [final_plate_01, final_plate_02, final_plate_03]
-                all_final_plates = [well for plate in final_plates for well in plate]
-
-                transfer_tiprack_01 = transfer_tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                transfer_tiprack_02 = transfer_tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                transfer_tiprack_03 = transfer_tiprack_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                transfer_tipracks = [transfer_tiprack_01, transfer_tiprack_02, transfer_tiprack_03]               
-                
-                reservoir_01 = reservoir_1.wells()[0]
-                water_reservoir_01 = water_reservoir.wells()[0]
-
-                #############################################################################################################
-                #                                           DNA extraction actions
-                #############################################################################################################
-                
-                samples_sites = 'D1, D2 & D3'
-                mixing_tipracks_sites = 'B1, B2 & B3'
-                water_reservoir_site ='A2'
-                reservoirs_sites = 'A1'
-
-                ctx.pause(comment_reagents_1(Metabisulfite, PVPK29, StockLysisSolution_A, StockLysisSolution_B, Sarkosyl, Rnase))
-                ctx.pause(comment_reagents_2(AlcoholIsoamyl, Chloroform, volume_of_water1, volume_of_ethanol95))
-                ctx.pause('''Place full Isopropanol reservoir at -20°C''')
-                ctx.pause(comment_beginning)
-                
-                ctx.pause('''Place Samples plates '1, 2 & 3' respectively on sites D1, D2 and D3''')
-                ctx.pause('''Place tip racks on site B1, B2, B3 and place TE buffer reservoir on site A2''')
-                ctx.pause('''START TE buffer  dispensing to samples''')
-                
-                water_distribute(all_samples, volume = 50, bottom_dispense_heigth = 40, return_tip = True, source =  water_reservoir_01)
-                
-                ctx.pause('''Grind samples on a tyssus-lyser machine''')
-                ctx.pause(comment_spinDown)
-                ctx.pause('''Place samples plates back to respective sites D1, D2 & D3. Add Rnase to Extraction buffer and place in reservoir on site A1''')
-                ctx.pause('''START Extraction buffer dispenssing to samples on sites D1, D2 and D3''')
-                
-                ExtractionBuffer_dispense() 
-                
-                ctx.pause('''Seal plates with sealing tape and invert plates 10 times. Spin plates then remove sealing tape and incubate plates (65C, 60 min)''')
-                ctx.pause('''After incubation, place the plates back to respective sites D1, D2, D3 and place Chloroform reservoir on site A1 and place water reservoir on site A2)''')
-                time_estimation = str(truncate((time_dispensing_chloroform_and_bubbleMixing * total_number_of_columns / 60), 1))
-                ctx.pause(comment_start_Chloro_dispensing(time_estimation))
-                
-                if chloroform_buffer_mixing == 'pipette_mixing':
-                    dispensing_chloroform_and_pipetteMixing()
-                    ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                    ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-                if chloroform_buffer_mixing == 'bubble_mixing':
-                    dispensing_chloroform_and_bubbleMixing()
-                    ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                    ctx.pause(comment_decontaminate_chloroform(mixing_tipracks_sites))
-                if chloroform_buffer_mixing == 'no_mixing':
-                    dispensing_chloroform()
-                    ctx.pause('''Mix (vortex carefully) then centrifugate the plate (6000rpm, 10 min).''')
-                
-                for tiprack in [tiprack_1, tiprack_2, tiprack_3]:
-                    ctx.move_labware(labware = tiprack, new_location = protocol_api.OFF_DECK)
-
-                ctx.move_labware(labware = transfer_tiprack_1, new_location = 'B1')
-                ctx.move_labware(labware = transfer_tiprack_2, new_location = 'B2')
-                ctx.move_labware(labware = transfer_tiprack_3, new_location = 'B3')
-
-                ctx.pause('''When the 10 minutes centrifugation is done place the sample plates back to respective sites D1, D2 & D3 and place empty plate (1.0ml 96-Deep well)s on sites C1, C2 & C3 (label the plates)''')
-        
-                time_estimation = str(truncate(time_supernatant_transfer * total_number_of_columns / 60, 1))
-                ctx.pause(comment_start_Supernatant_transfer(time_estimation))
-
-                for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
-                    Supernatant_transfer(samples, final, tiprack)
-
-                ctx.pause('''Remove Chloroform reservoir on site A1 and place cold Isopropanol reservoir on site A1''')
-                
-                ctx.pause('''Remove reservoir on site A2 and place new tiprack on site A2''')
-                ctx.move_labware(labware = water_reservoir, new_location = protocol_api.OFF_DECK)
-                ctx.move_labware(labware = tiprack_9, new_location = 'A2')
-                ctx.pause('''START Isopropanol dispensing to plates on site C1, C2 & C3''')
-
-                isopropanol_dispensing()
-
-                ctx.pause('''At this point the plates (sites C1, C2 & C3) can be sealed and stored at -20C and the DNA extraction completed the next day (or later)'''  )
-                ctx.pause('''Seal and invert 20x the plate on sites C1, C2 & C3 then centrifugate (10min, 6000 rpm)''') # and prepare cold 70 percent ethanol
-
-                # Evaluating if the Isopropanol discarding is done by plate inversion or py pipetting off
-                if pipetteOff_isopropanol == True:
-                    ctx.pause('''When centrifugation is done, place the plate back to respective sites C1, C2 & C3''')
-                    time_estimation = str(truncate(time_isopropanol_discarding * total_number_of_columns / 60, 1))
-                    ctx.pause(comment_start_Isopropanol_discarding(time_estimation))
-
-                    for final, tiprack in zip(final_plates, transfer_tipracks):
-                        isopropanol_discarding(final, tiprack)
-
-                if pipetteOff_isopropanol == False:
-                    ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates 10s''')
-                    ctx.pause('''Place plates back to respective sites C1, C2 & C3''')
-
-                ctx.pause('''Remove Isopropanol reservoir on site A1, add Ethanol 70 percent reservoir to site A1''')
-                ctx.pause('''START Ethanol dispensing to plates on site C1, C2, C3''')
-
-                ethanol_dispensing()
-
-                ctx.pause('''Centrifugate the plates for 10 minutes at 6000 rpm''')
-
-                # Ethanol discarding method (by inversion or py pipetting off)       
-                if pipetteOff_ethanol == True:
-                    ctx.pause('''When centrifugation is done, place the plates back to respective sites C1, C2 & C3''')
-                    time_estimation = str(truncate(time_ethanol_discarding * total_number_of_columns / 60, 1))
-                    ctx.pause(comment_start_Ethanol_discarding(time_estimation))
-                    for final, tiprack in zip(final_plates, transfer_tipracks):
-                        ethanol_discarding(final, tiprack)
-                if pipetteOff_ethanol == False:
-                    ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates (6000rpm, 10sec)''')
-
-                ctx.pause('''Evaporate ethanol (20min, 45C). Remove and clean tipracks on sites C1, C2 & C3 (place tips in trash)''')
-                ctx.pause('''Prepare for Elution buffer dispensing: remove Ethanol reservoir on site A1 and place Elution buffer on site A1''')
-                ctx.pause('''When evaporation is done, place plates back to respective sites C1, C2 & C3''')
-                ctx.pause('''START Elution buffer dispensing''')
-
-                EB_distribute(all_final_plates, volume = elution_buffer_volume, bottom_dispense_heigth = 16, return_tip = False, source = reservoir_01)
-                ctx.pause('''Centrifuge plates at 4000rpm 5s. Seal plates with tape and store plates at 4C. DNA extraction completed''')
-
+            ctx.pause(' ---- '.join(f'{number}) {message}' for number, message in enumerate(pending_instructions, start = 1)))
+        pending_instructions.clear()
+        operator_stops['checklists'] += 1
+        for slot in cleared:                    # Done by the operator during the checklist, the robot waits for the confirmation
+            ctx.move_labware(labware = labware[staging[slot]], new_location = protocol_api.OFF_DECK)
+            staging[slot] = None
+        for name, slot in refilled.items():
+            ctx.move_labware(labware = labware[name], new_location = slot)
+            staging[slot] = name
+        operator_stops['labware_moves'] += len(cleared) + len(refilled)
+        swap_moves['staging'] += len(cleared) + len(refilled)
+
+    def comment_labware_changes(removed, placed):
+        changes = []
+        removed = [name for name in removed if name not in decontaminated_tiprack_names]     # Already removed for decontamination
+        contaminated = any(name in mixing_tiprack_names for name in removed)
+        if removed:
+            changes.append(f'Remove the labware on {on_sites(removed)}' + (' (dispose the tips of the chloroform contaminated tipracks, clean the tipracks)' if contaminated else ''))
+        placed_final_plates = [name for name in placed if name.startswith('final_plate')]
+        placed_tipracks = [name for name in placed if 'tiprack' in name]
+        if placed_final_plates:
+            changes.append(comment_final_plates(placed_final_plates))
+        if placed_tipracks:
+            changes.append(f'place new tipracks on {"the adapters on " if full_plate_mode else ""}{on_sites(placed_tipracks)}')
+        changes = ' and '.join(changes)
+        return changes[:1].upper() + changes[1:]
+
+    def comment_final_plates(names):
+        return f'place empty plates (1.0ml 96-Deep well) on {on_sites(names)} for {samples_plates_text([name.split("_")[-1] for name in names])} (label the plates)'
+
+    def comment_staged_labware(staging_slots):  # Gripper mode: labware placed on the staging slots (name -> staging slot)
+        staged_labware = []
+        for name, slot in staging_slots.items():
+            if name.startswith('final_plate'):
+                staged_labware.append(f'an empty plate for {samples_plates_text([name.split("_")[-1]])} on {slot} (label the plate)')
             else:
-                
-#################################             ##    ##
-#                               #             ##    ##
-# FOUR plates 96-well protocol  #             ########      
-#                               #                   ##
-#################################                   ##
-                 
-                 if number_of_plates_to_extract == 4 :
-
-                    # Load Labware
-                    tiprack_1 = ctx.load_labware(tipsbox, 'B2')
-                    tiprack_2 = ctx.load_labware(tipsbox, 'B3')
-                    tiprack_3 = ctx.load_labware(tipsbox, 'C2')
-                    tiprack_4 = ctx.load_labware(tipsbox, 'C3')
-                    transfer_tiprack_1 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                    transfer_tiprack_2 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                    transfer_tiprack_3 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                    transfer_tiprack_4 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                    tiprack_9 = ctx.load_labware(tipsbox, protocol_api.OFF_DECK)
-                    samples_plate_1 = ctx.load_labware(samples_plate_type, 'D1')
-                    samples_plate_2 = ctx.load_labware(samples_plate_type, 'D2')
-                    samples_plate_3 = ctx.load_labware(samples_plate_type, 'D3')
-                    samples_plate_4 = ctx.load_labware(samples_plate_type, 'B1')
-                    final_plate_1 = ctx.load_labware(final_plate_type, protocol_api.OFF_DECK)
-                    final_plate_2 = ctx.load_labware(final_plate_type, protocol_api.OFF_DECK)
-                    final_plate_3 = ctx.load_labware(final_plate_type, protocol_api.OFF_DECK)
-                    final_plate_4 = ctx.load_labware(final_plate_type, protocol_api.OFF_DECK)
-                    reservoir_1 = ctx.load_labware(reservoir_type, 'A2')
-                    water_reservoir = ctx.load_labware(reservoir_type, 'A1')
-                    trash = ctx.load_trash_bin("A3")
-
-                    # Load Instrument
-                    p300 = ctx.load_instrument('flex_8channel_1000', 'left', tip_racks=[tiprack_1, tiprack_2, tiprack_3, tiprack_4, transfer_tiprack_1, transfer_tiprack_2, transfer_tiprack_3, transfer_tiprack_4, tiprack_9])
-                    p300.default_speed = 200
-
-                    # Subseting only the columns with samples in your plates
-                    samples_P1 = samples_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                    samples_P2 = samples_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                    samples_P3 = samples_plate_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                    samples_P4 = samples_plate_4.rows()[0][first_column_plate_4 - 1 : last_column_plate_4]
-                    plates = [samples_P1, samples_P2, samples_P3, samples_P4]                
-                    all_samples = [well for plate in plates for well in plate]
-
-                    mixing_tiprack_1 = tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                    mixing_tiprack_2 = tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                    mixing_tiprack_3 = tiprack_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                    mixing_tiprack_4 = tiprack_4.rows()[0][first_column_plate_4 - 1 : last_column_plate_4]
-                    mixing_tipracks = [mixing_tiprack_1, mixing_tiprack_2, mixing_tiprack_3, mixing_tiprack_4]
-                    
-                    final_plate_01 = final_plate_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                    final_plate_02 = final_plate_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                    final_plate_03 = final_plate_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                    final_plate_04 = final_plate_4.rows()[0][first_column_plate_4 - 1 : last_column_plate_4]
-                    final_plates = [final_plate_01, final_plate_02, final_plate_03, final_plate_04]
-                    all_final_plates = [well for plate in final_plates for well in plate]
-
-                    transfer_tiprack_01 = transfer_tiprack_1.rows()[0][first_column_plate_1 - 1 : last_column_plate_1]
-                    transfer_tiprack_02 = transfer_tiprack_2.rows()[0][first_column_plate_2 - 1 : last_column_plate_2]
-                    transfer_tiprack_03 = transfer_tiprack_3.rows()[0][first_column_plate_3 - 1 : last_column_plate_3]
-                    transfer_tiprack_04 = transfer_tiprack_4.rows()[0][first_column_plate_4 - 1 : last_column_plate_4]
-                    transfer_tipracks = [transfer_tiprack_01, transfer_tiprack_02, transfer_tiprack_03, transfer_tiprack_04]               
-                    
-                    reservoir_01 = reservoir_1.wells()[0]
-                    water_reservoir_01 = water_reservoir.wells()[0]
-
-
-                    #############################################################################################################
-                    #                                           DNA extraction actions
-                    #############################################################################################################
-                
-                    ctx.pause(comment_reagents_1(Metabisulfite, PVPK29, StockLysisSolution_A, StockLysisSolution_B, Sarkosyl, Rnase))
-                    ctx.pause(comment_reagents_2(AlcoholIsoamyl, Chloroform, volume_of_water1, volume_of_ethanol95))
-                    ctx.pause('''Place full Isopropanol reservoir at -20°C''')
-                    ctx.pause(comment_beginning)
-                    
-                    ctx.pause('''Place Samples plates '1, 2, 3 & 4' on sites D1, D2, D3 & B1''')
-                    ctx.pause('''Place tip racks on site B2, B3, C2, C3 and place TE buffer reservoir on site A1''')
-                    ctx.pause('''START TE buffer  dispensing''')
-
-                    water_distribute(all_samples, volume = 50, bottom_dispense_heigth = 40, return_tip = True, source =  water_reservoir_01)
-
-                    ctx.pause('''Grind samples on a tyssus-lyser machine''')
-                    ctx.pause(comment_spinDown)
-                    ctx.pause('''Place the plates back to respective sites D1, D2, D3 & B1. Add Rnase to Extraction buffer and place in reservoir on site A2''')
-                    ctx.pause('''START post-grinding Extraction buffer dispensing''')
-
-                    ExtractionBuffer_dispense()
-                    
-                    ctx.pause('''Seal plates with sealing tape and invert plates 10 times. Spin plates then remove sealing tape and incubate the plates (65C, 60 min)''')
-                    ctx.pause('''After incubation, place the plate back to respective sites D1, D2, D3, B1 and place Chloroform reservoir on site A2 and place water reservoir on site A1)''')
-                    time_estimation = str(truncate((time_dispensing_chloroform_and_bubbleMixing * total_number_of_columns / 60), 1))
-                    ctx.pause(comment_start_Chloro_dispensing(time_estimation))
-       
-                    if chloroform_buffer_mixing == 'pipette_mixing':
-                        dispensing_chloroform_and_pipetteMixing()
-                        ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                        ctx.pause('''Remove tip racks on sites B2, B3, C2 & C3 (dispose tips, clean tipracks) and place new tipracks on sites B2 & B3''')
-                    if chloroform_buffer_mixing == 'bubble_mixing':
-                        dispensing_chloroform_and_bubbleMixing()
-                        ctx.pause('''Centrifugate the plate (6000rpm, 10 min).''') 
-                        ctx.pause('''Remove tip racks on sites B2, B3, C2 & C3 (dispose tips, clean tipracks) and place new tipracks on sites B2 & B3''')
-                    if chloroform_buffer_mixing == 'no_mixing':
-                        dispensing_chloroform()
-                        ctx.pause('''Mix (vortex carefully) then centrifugate the plate (6000rpm, 10 min).''')
-                    
-                    ctx.pause('''Remove reservoir on site A1 and place empty plates (96-Deep wells) on sites B1, B2, B3 & D1 (identify the plates and mark site number)''')
-
-                    for tiprack in [tiprack_1, tiprack_2, tiprack_3, tiprack_4]:
-                        ctx.move_labware(labware = tiprack, new_location = protocol_api.OFF_DECK)
-
-                    ctx.move_labware(labware = water_reservoir, new_location = protocol_api.OFF_DECK)
-                    ctx.move_labware(labware = transfer_tiprack_1, new_location = 'B2')
-                    ctx.move_labware(labware = transfer_tiprack_2, new_location = 'B3')
-                    ctx.move_labware(labware = final_plate_1, new_location = 'C1')
-                    ctx.move_labware(labware = final_plate_2, new_location = 'C2')
-                    ctx.move_labware(labware = final_plate_3, new_location = 'C3')
-                    ctx.move_labware(labware = final_plate_4, new_location = 'A1')
-
-                    ctx.pause('''When the 10 minutes centrifugation is done place the Sample plates back to respective sites D1, D2, D3 & B1''')
-
-                    # Redefining vectors since we have only two tipracks on the deck
-                    plates = [samples_P1, samples_P2]
-                    final_plates =[final_plate_01, final_plate_02]
-                    transfer_tipracks = [transfer_tiprack_01, transfer_tiprack_02]
-                    
-                    time_estimation = str(truncate(time_supernatant_transfer * (number_of_columns_plate_1 + number_of_columns_plate_2) / 60, 1))
-                    ctx.pause(comment_start_Supernatant_transfer(time_estimation))
-
-                    for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
-                        Supernatant_transfer(samples, final, tiprack)
-
-                    ctx.pause('''Remove Samples plates on sites D1 & D2 and place new tipracks on sites D1 & D2''')
-                
-                    for plate in [samples_plate_1, samples_plate_2]:
-                        ctx.move_labware(labware = plate, new_location = protocol_api.OFF_DECK)
-                
-                    ctx.move_labware(labware = transfer_tiprack_3, new_location = 'D2')
-                    ctx.move_labware(labware = transfer_tiprack_4, new_location = 'D1')
-
-                    time_estimation = str(truncate(time_supernatant_transfer * (number_of_columns_plate_3 + number_of_columns_plate_4) / 60, 1))
-                    ctx.pause(comment_start_Supernatant_transfer(time_estimation))
-
-                    # Redefining vectors since we have only two tipracks on the deck
-                    plates = [samples_P3, samples_P4]
-                    final_plates =[final_plate_03, final_plate_04]
-                    transfer_tipracks = [transfer_tiprack_03, transfer_tiprack_04]
-
-                    for samples, final, tiprack in zip(plates, final_plates, transfer_tipracks):
-                        Supernatant_transfer(samples, final, tiprack)
-
-
-                    for plate in [samples_plate_3, samples_plate_4]:
-                        ctx.move_labware(labware = plate, new_location = protocol_api.OFF_DECK)
-                    
-                    # Redefining plate vectors
-                    final_plates =[final_plate_01, final_plate_02, final_plate_03, final_plate_04]
-                    transfer_tipracks = [transfer_tiprack_01, transfer_tiprack_02, transfer_tiprack_03, transfer_tiprack_04]
-
-                    ctx.pause('''Remove plates on sites D3 & B1 and Place a new tiprack on site D3''')
-                    ctx.move_labware(labware = tiprack_9, new_location = 'D3')
-
-                    ctx.pause('''Remove Chloroform reservoir on site A2 and place cold Isopropanol reservoir on site A2''')
-                    ctx.pause('''START Isopropanol dispensing to plates on sites C1, C2, C3 & A1''')
-
-                    isopropanol_dispensing()
-
-                    ctx.pause('''At this point the plates (sites C1, C2, C3 & A1) can be sealed and stored at -20C and the DNA extraction completed the next day (or later)'''  )
-                    ctx.pause('''Seal and invert 20x the plates on sites C1, C2, C3 & A1 then centrifugate (10min, 6000 rpm)''') # and prepare cold 70 percent ethanol
-
-                    # Evaluating if the Isopropanol discarding is done by plate inversion or py pipetting off
-                    if pipetteOff_isopropanol == True:
-                        ctx.pause('''When centrifugation is done, place the plate back to respective sites C1, C2, C3 & A1''')
-                        time_estimation = str(truncate(time_isopropanol_discarding * total_number_of_columns / 60, 1))
-                        ctx.pause(comment_start_Isopropanol_discarding(time_estimation))
-
-                        for final, tiprack in zip(final_plates, transfer_tipracks):
-                            isopropanol_discarding(final, tiprack)
-
-                    if pipetteOff_isopropanol == False:
-                        ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates 10s''')
-                        ctx.pause('''Place plates back to respective sites C1, C2, C3 & A1''')
-
-                    ctx.pause('''Remove Isopropanol reservoir on site D2 and place 70'%'Ethanol reservoir to site D2''')
-                    ctx.pause('''START Ethanol dispensing to plates on site C1, C2, C3 & A1''')
-
-                    ethanol_dispensing()
-
-                    ctx.pause('''Centrifugate the plates for 10 minutes at 6000 rpm''')
-
-                    # Ethanol discarding method (by inversion or py pipetting off)       
-                    if pipetteOff_ethanol == True:
-                        ctx.pause('''When centrifugation is done, place the plates back to respective sites C1, C2, C3 & A1''')
-                        time_estimation = str(truncate(time_ethanol_discarding * total_number_of_columns / 60, 1))
-                        ctx.pause(comment_start_Ethanol_discarding(time_estimation))
-                        for final, tiprack in zip(final_plates, transfer_tipracks):
-                            ethanol_discarding(final, tiprack)
-                    if pipetteOff_ethanol == False:
-                        ctx.pause('''Gently invert the plates to poor off the supernatant then centrifuge the plates (6000rpm, 10sec)''')
-
-                    ctx.pause('''Evaporate ethanol (20min, 45C). Remove and clean tipracks on sites D1, D2, B2 & B3 (place tips in trash)''')
-                    ctx.pause('''Prepare for Elution buffer dispensing: remove Ethanol reservoir on site A2 and place Elution buffer on site A2''')
-                    ctx.pause('''When evaporation is done, place plates back to respective sites C1, C2, C3 and A1''')
-                    ctx.pause('''START Elution buffer dispensing''')
-
-                    ctx.comment('\n~~~~~~~~~~~~~~ Dispensing Elution buffer to samples ~~~~~~~~~~~~~~')
+                staged_labware.append(f'a new tiprack on {slot}')
+        return 'Place ' + enumeration(staged_labware) + ' (staging slots, the gripper moves them on the deck)'
+
+    def new_reagent_tiprack(comment, needed = True):    # Full-plate mode: the reagent tiprack is replaced before every reagent
+        if full_plate_mode and needed:
+            return comment + f'. Place a new tiprack on the adapter on site {sites(["reagent_tiprack"])}'
+        return comment
+
+    def heater_shaker_move(name, on_module, use_gripper = None):   # Moves the samples plate "name" on the Heater-Shaker or back to its slot
+        use_gripper = gripper_mode if use_gripper is None else use_gripper
+        heater_shaker.open_labware_latch()
+        ctx.move_labware(labware = labware[name], new_location = heater_shaker_adapter if on_module else plan['slot'][name], use_gripper = use_gripper)
+        if not use_gripper:
+            operator_stops['labware_moves'] += 1
+        heater_shaker.close_labware_latch()
+
+    def shake_emulsions():                      # Heater-Shaker mode: the sealed samples plates are shaken one at a time to emulsify the chloroform
+        shaking = liquid_classes['chloroform_isoamyl']['heater_shaker']
+        for plate in plate_numbers:
+            heater_shaker_move(f'samples_plate_{plate}', on_module = True)
+            heater_shaker.set_and_wait_for_shake_speed(shaking['shake_speed'])
+            ctx.delay(seconds = shaking['shake_time'], msg = f'Shaking samples plate {plate}')
+            heater_shaker.deactivate_shaker()
+            heater_shaker_move(f'samples_plate_{plate}', on_module = False)
+
+    def incubate_on_heater_shaker(name):        # The samples plate, sealed by the operator, is placed on the preheated module (see set_target_temperature())
+        heater_shaker_move(name, on_module = True, use_gripper = False)
+        heater_shaker.wait_for_temperature()
+        ctx.delay(minutes = incubation_time, msg = f'Incubation ({incubation_temperature}C, {incubation_time} min)')
+        heater_shaker.deactivate_heater()
+        heater_shaker_move(name, on_module = False)
+
+    samples_plates = [f'samples_plate_{plate}' for plate in plate_numbers]
+    all_final_plate_names = [f'final_plate_{plate}' for plate in plate_numbers]
+    set_up = [names[0] for names in plan['occupants'].values() if names and names[0] != 'reservoir_1']  # Labware with a slot of its own is placed at the beginning
+
+    samples_sites = sites(samples_plates)
+    tipracks_sites = sites([name for name in set_up if 'tiprack' in name]) + (' (on the 96-channel tiprack adapters)' if full_plate_mode else '')
+    mixing_tiprack_names = tiprack_names if mixing_with_tips else []
+    # The mixing tipracks are removed for decontamination after the chloroform step, except in gripper mode those of shared slots,
+    # which the swaps take off the deck
+    decontaminated_tiprack_names = [name for name in mixing_tiprack_names if not gripper_mode or plan['occupants'][plan['slot'][name]][-1] == name]
+    mixing_tipracks_sites = sites(decontaminated_tiprack_names) if decontaminated_tiprack_names else ''
+    water_reservoir_site = sites(['water_reservoir'])
+    reservoirs_sites = sites(['reservoir_1'])
+    final_plates_sites = on_sites(all_final_plate_names)
+    set_up_final_plates = [name for name in all_final_plate_names if name in set_up]
+
+    #############################################################################################################
+    #                                           DNA extraction actions
+    #############################################################################################################
+
+    report_time_estimates()
+    report_tip_budget()
+    report_makespan()
+
+    instruct(comment_reagents_1(Metabisulfite, PVPK29, StockLysisSolution_A, StockLysisSolution_B, Sarkosyl, Rnase))
+    instruct(comment_reagents_2(AlcoholIsoamyl, Chloroform, volume_of_water1, volume_of_ethanol95))
+    instruct(f'''Place full Isopropanol reservoir (at least {math.ceil(poured_volumes["isopropanol"] / 1000)}mL) at -20°C''')
+    instruct(comment_beginning)
+    for comment in comment_1(enumeration(plate_numbers), samples_sites, tipracks_sites, water_reservoir_site):
+        instruct(comment)
+    if set_up_final_plates:
+        instruct('P' + comment_final_plates(set_up_final_plates)[1:])
+    if staged:
+        instruct(comment_staged_labware(staged))
+    instruct(comment_2(samples_sites))
+
+    give_instructions()
+    TE_buffer_dispensing()
+
+    instruct('''Grind samples on a tyssus-lyser machine''')
+    instruct(comment_spinDown)
+    instruct(f'''Place the samples plates back to {on_sites(samples_plates)}. Add Rnase to Extraction buffer and place in reservoir on site {reservoirs_sites}''')
+    instruct(f'''START post-grinding Extraction buffer dispensing to samples on sites {samples_sites}''')
+
+    give_instructions()
+    if incubate_on_deck:
+        heater_shaker.set_target_temperature(incubation_temperature)      # Heating while the extraction buffer is dispensed
+    if stagger_plates:                          # Each plate goes to the incubation as soon as it has its extraction buffer (see makespan())
+        for plate in plate_numbers:
+            plates = [samples_columns[plate]]
+            ExtractionBuffer_dispense(pick_up_tip = plate != plate_numbers[0])
+            instruct(f'''Seal samples plate {plate} with sealing tape and invert it 10 times. Spin it then remove sealing tape and incubate it ({incubation_temperature}C, {incubation_time} min)''')
+            if plate != plate_numbers[-1]:
+                give_instructions()
+        plates = [samples_columns[plate] for plate in plate_numbers]
+    else:
+        ExtractionBuffer_dispense()
 
-                    EB_distribute(all_final_plates, volume = elution_buffer_volume, bottom_dispense_heigth = 16, return_tip = False, source = reservoir_01)
-                    ctx.pause('''Centrifuge plates at 4000rpm 5s. Seal plates with tape and store plates at 4C. DNA extraction completed''')
-                    ctx.comment('\n~~~~~~~~~~~~~~Protocol Complete~~~~~~~~~~~~~~\n')
\ No newline at end of file
+    if incubate_on_deck:
+        instruct('''Seal the plate with sealing tape and invert it 10 times. Spin the plate, it is incubated on the Heater-Shaker''')
+        give_instructions()
+        incubate_on_heater_shaker(samples_plates[0])
+        instruct(new_reagent_tiprack(f'''Remove the sealing tape of the plate on {on_sites(samples_plates)} and place Chloroform reservoir on site {reservoirs_sites} and place water reservoir on site {water_reservoir_site}''',
+                                      needed = not mixing_with_tips))
+    elif stagger_plates and mixing_with_tips:
+        instruct(f'''Place Chloroform reservoir on site {reservoirs_sites} and place water reservoir on site {water_reservoir_site}''')
+    else:
+        if not stagger_plates:
+            instruct(f'''Seal plates with sealing tape and invert plates 10 times. Spin plates then remove sealing tape and incubate the plates ({incubation_temperature}C, {incubation_time} min)''')
+        instruct(new_reagent_tiprack(f'''After incubation, place the samples plates back to {on_sites(samples_plates)} and place Chloroform reservoir on site {reservoirs_sites} and place water reservoir on site {water_reservoir_site}''',
+                                      needed = not mixing_with_tips))
+
+    if stagger_plates and mixing_with_tips:     # Each plate is mixed with its own tips and goes to the centrifuge as soon as it is done
+        for plate in plate_numbers:
+            plates = [samples_columns[plate]]
+            mixing_tipracks = [sample_columns('tiprack', plate)]
+            instruct(f'''When its incubation is done, place samples plate {plate} back to {on_sites([f'samples_plate_{plate}'])}''')
+            instruct(comment_start_Chloro_dispensing(str(truncate(estimate_step_time(chloroform_steps[chloroform_buffer_mixing]) / 60, 1))))
+            give_instructions()
+            chloroform_steps[chloroform_buffer_mixing]()
+            instruct(f'''Centrifugate samples plate {plate} (6000rpm, 10 min).''')
+        if mixing_tipracks_sites:
+            instruct(comment_decontaminate_chloroform(mixing_tipracks_sites))
+        plates = [samples_columns[plate] for plate in plate_numbers]
+        mixing_tipracks = [sample_columns('tiprack', plate) for plate in plate_numbers]
+    else:
+        time_estimation = str(truncate(estimate_step_time(chloroform_steps[chloroform_buffer_mixing]) / 60, 1))
+        instruct(comment_start_Chloro_dispensing(time_estimation))
+
+    if chloroform_buffer_mixing == 'pipette_mixing' and not stagger_plates:
+        give_instructions()
+        dispensing_chloroform_and_pipetteMixing()
+        instruct('''Centrifugate the plate (6000rpm, 10 min).''')
+        if mixing_tipracks_sites:
+            instruct(comment_decontaminate_chloroform(mixing_tipracks_sites))
+    if chloroform_buffer_mixing == 'bubble_mixing' and not stagger_plates:
+        give_instructions()
+        dispensing_chloroform_and_bubbleMixing()
+        instruct('''Centrifugate the plate (6000rpm, 10 min).''')
+        if mixing_tipracks_sites:
+            instruct(comment_decontaminate_chloroform(mixing_tipracks_sites))
+    if chloroform_buffer_mixing == 'no_mixing':
+        give_instructions()
+        dispensing_chloroform()
+        instruct('''Mix (vortex carefully) then centrifugate the plate (6000rpm, 10 min).''')
+    if chloroform_buffer_mixing == 'heater_shaker':
+        give_instructions()
+        dispensing_chloroform()
+        instruct('''Seal the plates with sealing tape, they are shaken on the Heater-Shaker''')
+        give_instructions()
+        shake_emulsions()
+        instruct('''Centrifugate the plate (6000rpm, 10 min) then remove the sealing tape.''')
+
+    # Supernatant transfer, by batches of plates when the deck cannot hold all the samples plates, final plates and transfer tipracks at once
+    for stage, batch in enumerate(plan['batches'], start = 1):
+        removed, placed = change_labware(stage)
+        comment = f'''Place {samples_plates_text(batch)} back to {on_sites([f'samples_plate_{plate}' for plate in batch])}'''
+        if stage == 1:
+            comment = 'When the 10 minutes centrifugation is done p' + comment[1:]
+        instruct(comment)
+        changes = comment_labware_changes(removed, placed)
+        if changes:
+            instruct(changes)
+
+        # Redefining vectors to the plates of the batch
+        plates = [samples_columns[plate] for plate in batch]
+        final_plates = [final_columns[plate] for plate in batch]
+        transfer_tipracks = [transfer_tiprack_columns[plate] for plate in batch]
+
+        if supernatant_transfer_mode == 'optimised':
+            for plate in batch:
+                transfer = (samples_columns[plate], final_columns[plate], transfer_tiprack_columns[plate])
+                time_saved = estimate_step_time(Supernatant_transfer, *transfer) - estimate_step_time(Supernatant_transfer_optimised, *transfer)
+                ctx.comment(f'Optimised supernatant transfer - samples plate {plate}: {round(time_saved)} s saved')
+        time_estimation = str(truncate(estimate_step_time(supernatant_transfer_all) / 60, 1))
+        instruct(comment_start_Supernatant_transfer(time_estimation))
+
+        give_instructions()
+        supernatant_transfer_all()
+
+    # Redefining plate vectors
+    plates = [samples_columns[plate] for plate in plate_numbers]
+    final_plates = [final_columns[plate] for plate in plate_numbers]
+    transfer_tipracks = [transfer_tiprack_columns[plate] for plate in plate_numbers]
+
+    removed, placed = change_labware(len(plan['batches']) + 1)
+    instruct(new_reagent_tiprack(f'''Remove Chloroform reservoir on site {reservoirs_sites} and place cold Isopropanol reservoir on site {reservoirs_sites}'''))
+    changes = comment_labware_changes(removed, placed)
+    if changes:
+        instruct(changes)
+    instruct(f'''START Isopropanol dispensing to plates on {final_plates_sites}''')
+
+    give_instructions()
+    isopropanol_dispensing()
+
+    instruct(f'''At this point the plates ({final_plates_sites}) can be sealed and stored at -20C and the DNA extraction completed the next day (or later)''')
+    instruct(f'''Seal and invert 20x the plates on {final_plates_sites} then centrifugate (10min, 6000 rpm)''') # and prepare cold 70 percent ethanol
+
+    # Evaluating if the Isopropanol discarding is done by plate inversion or py pipetting off
+    if pipetteOff_isopropanol == True:
+        instruct(f'''When centrifugation is done, place the plates back to {final_plates_sites}''')
+        time_estimation = str(truncate(estimate_step_time(isopropanol_discarding_all) / 60, 1))
+        instruct(comment_start_Isopropanol_discarding(time_estimation))
+
+        give_instructions()
+        isopropanol_discarding_all()
+
+    if pipetteOff_isopropanol == False:
+        instruct('''Gently invert the plates to poor off the supernatant then centrifuge the plates 10s''')
+        instruct(f'''Place plates back to {final_plates_sites}''')
+        pour_off(p300)
+
+    instruct(new_reagent_tiprack(f'''Remove Isopropanol reservoir on site {reservoirs_sites}, add Ethanol 70 percent reservoir to site {reservoirs_sites}'''))
+    instruct(f'''START Ethanol dispensing to plates on {final_plates_sites}''')
+
+    give_instructions()
+    ethanol_dispensing()
+
+    instruct('''Centrifugate the plates for 10 minutes at 6000 rpm''')
+
+    # Ethanol discarding method (by inversion or py pipetting off)
+    if pipetteOff_ethanol == True:
+        instruct(f'''When centrifugation is done, place the plates back to {final_plates_sites}''')
+        time_estimation = str(truncate(estimate_step_time(ethanol_discarding_all) / 60, 1))
+        instruct(comment_start_Ethanol_discarding(time_estimation))
+        give_instructions()
+        ethanol_discarding_all()
+    if pipetteOff_ethanol == False:
+        instruct('''Gently invert the plates to poor off the supernatant then centrifuge the plates (6000rpm, 10sec)''')
+        pour_off(p300)
+
+    used_tipracks = [names[-1] for names in plan['occupants'].values() if names and names[-1].startswith('transfer_tiprack')]
+    if used_tipracks:
+        instruct(f'''Evaporate ethanol (20min, 45C). Remove and clean tipracks on {on_sites(used_tipracks)} (place tips in trash)''')
+    else:
+        instruct('''Evaporate ethanol (20min, 45C).''')
+    instruct(new_reagent_tiprack(f'''Prepare for Elution buffer dispensing: remove Ethanol reservoir on site {reservoirs_sites} and place Elution buffer (at least {math.ceil(poured_volumes["elution_buffer"] / 1000)}mL) on site {reservoirs_sites}'''))
+    instruct(f'''When evaporation is done, place plates back to {final_plates_sites}''')
+    instruct('''START Elution buffer dispensing''')
+
+    give_instructions()
+    elution_buffer_dispensing()
+
+    used_staging_slots = [slot for slot, name in staging.items() if name in taken_off]
+    instruct('''Centrifuge plates at 4000rpm 5s. Seal plates with tape and store plates at 4C. DNA extraction completed''' +
+              (f'. Remove the used labware on the staging slots {enumeration(used_staging_slots)}' if used_staging_slots else ''))
+    give_instructions()
+    if gripper_mode:
+        ctx.comment(f'Gripper: {swap_moves["gripper"]} of the {2 * len(waiting_labware)} labware moves of the {len(waiting_labware)} swaps done by the gripper, '
+                    f'{swap_moves["operator"]} by the operator, plus {swap_moves["staging"]} staging slot moves confirmed at the checklists')
+    ctx.comment(f'Operator stops: {sum(operator_stops.values())} ({operator_stops["checklists"]} checklists and {operator_stops["labware_moves"]} manual labware moves)')
+    ctx.comment('\n~~~~~~~~~~~~~~Protocol Complete~~~~~~~~~~~~~~\n')
@@ -0,0 +1,333 @@
+"""Simulation tests of the RoboCTAB protocols (requires the opentrons package).
+
+The protocols are run headlessly with the tools of ``tools/benchmark.py`` and a
+standard deep well plate instead of the custom plate definitions::
+
+    python -m pytest tests
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('opentrons')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from benchmark import PROTOCOLS, load_protocol, simulated_context
+
+STANDARD_PLATES = {'samples_plate_type': 'nest_96_wellplate_2ml_deep', 'final_plate_type': 'nest_96_wellplate_2ml_deep'}
+SINGLE_PLATE = {'first_column_plate_2': 0, 'first_column_plate_3': 0, 'first_column_plate_4': 0}
+
+
+def simulate(protocol, files = None, **values):
+    """Runs ``protocol`` in the simulator with the run-time parameters ``values`` and the CSV ``files`` ({parameter: path})
+    and returns the messages of its pauses."""
+    from opentrons.protocol_api import ParameterContext
+
+    module = load_protocol(PROTOCOLS[protocol])
+    ctx, robot_type = simulated_context(module)
+    parameters = ParameterContext(ctx.api_version)
+    module.add_parameters(parameters)
+    parameters.set_parameters(dict(STANDARD_PLATES, **values))
+    parameters.initialize_csv_files(files or {})
+    ctx._params = parameters.export_parameters_for_protocol()
+    pauses = []
+    pause = ctx.pause
+
+    def recorded_pause(msg = None):
+        pauses.append(msg)
+        return pause(msg)
+
+    ctx.pause = recorded_pause
+    module.run(ctx)
+    return pauses
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+def test_single_plate_incubated_on_heater_shaker_with_staggered_plates(protocol):
+    pauses = simulate(protocol, chloroform_buffer_mixing = 'heater_shaker', stagger_plates = True, **SINGLE_PLATE)
+    text = '\n'.join(pauses)
+    assert 'it is incubated on the Heater-Shaker' in text
+    assert 'incubate it (' not in text and 'incubate the plates (' not in text
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+def test_ethanol_aspirated_from_poured_off_plates(protocol, monkeypatch):
+    # The isopropanol is poured off by inverting the plates: the 295 uL of ethanol dispensed next stand under 6 mm in the wells,
+    # its removal aspirates at the lowest heights of its liquid class (5, 3 and 2 mm)
+    from opentrons.protocol_api import InstrumentContext, ProtocolContext
+
+    events = []
+    aspirate, pause = InstrumentContext.aspirate, ProtocolContext.pause
+
+    def recorded_aspirate(self, volume = None, location = None, rate = 1.0, **kwargs):
+        if hasattr(location, 'point') and location.labware.is_well:
+            well = location.labware.as_well()
+            events.append(round(location.point.z - well.bottom().point.z, 2))
+        return aspirate(self, volume, location, rate, **kwargs)
+
+    def recorded_pause(self, msg = None):
+        events.append(msg)
+        return pause(self, msg)
+
+    monkeypatch.setattr(InstrumentContext, 'aspirate', recorded_aspirate)
+    monkeypatch.setattr(ProtocolContext, 'pause', recorded_pause)
+    simulate(protocol, pipetteOff_isopropanol = False, pipetteOff_ethanol = True, **SINGLE_PLATE)
+    start = next(i for i, event in enumerate(events) if isinstance(event, str) and 'START Ethanol discarding' in event)
+    end = next(i for i, event in enumerate(events) if i > start and isinstance(event, str))
+    heights = events[start + 1:end]
+    assert heights and set(heights) == {5, 3, 2}
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+@pytest.mark.parametrize('columns, aspirations', [(6, [300]), (12, [300, 300]), (8, [300, 100])])
+def test_distribute_cycles(protocol, columns, aspirations, monkeypatch):
+    # The TE buffer (50 uL) fills a 300 uL tip for 6 columns: as many aspirations as groups of 6 columns, none of them empty,
+    # and every column gets its 50 uL once the air gap taken after the previous column is expelled (blown out after the last column)
+    from opentrons.protocol_api import InstrumentContext, ProtocolContext
+
+    events = []
+    aspirate, dispense, air_gap, blow_out = InstrumentContext.aspirate, InstrumentContext.dispense, InstrumentContext.air_gap, InstrumentContext.blow_out
+    pause = ProtocolContext.pause
+
+    def recorded_aspirate(self, volume = None, location = None, rate = 1.0, **kwargs):
+        if not getattr(self, '_in_air_gap', False):
+            events.append(('aspirate', volume, None))
+        return aspirate(self, volume, location, rate, **kwargs)
+
+    def recorded_air_gap(self, volume = None, *args, **kwargs):
+        events.append(('air', volume, None))
+        self._in_air_gap = True                 # Older API versions take the air gap with an aspirate
+        try:
+            return air_gap(self, volume, *args, **kwargs)
+        finally:
+            self._in_air_gap = False
+
+    def recorded_dispense(self, volume = None, location = None, rate = 1.0, **kwargs):
+        events.append(('dispense', volume, location.labware.as_well().well_name))
+        return dispense(self, volume, location, rate, **kwargs)
+
+    def recorded_blow_out(self, *args, **kwargs):
+        events.append(('blow_out', None, None))
+        return blow_out(self, *args, **kwargs)
+
+    def recorded_pause(self, msg = None):
+        events.append(('pause', msg, None))
+        return pause(self, msg)
+
+    monkeypatch.setattr(InstrumentContext, 'aspirate', recorded_aspirate)
+    monkeypatch.setattr(InstrumentContext, 'air_gap', recorded_air_gap)
+    monkeypatch.setattr(InstrumentContext, 'dispense', recorded_dispense)
+    monkeypatch.setattr(InstrumentContext, 'blow_out', recorded_blow_out)
+    monkeypatch.setattr(ProtocolContext, 'pause', recorded_pause)
+    simulate(protocol, last_column_plate_1 = columns, **SINGLE_PLATE)
+    start = next(i for i, event in enumerate(events) if event[0] == 'pause' and 'START TE buffer' in event[1])
+    end = next(i for i, event in enumerate(events) if i > start and event[0] == 'pause')
+
+    received, air = {}, 0
+    for kind, volume, well in events[start + 1:end]:
+        if kind == 'air':
+            air += volume
+        elif kind == 'blow_out':
+            air = 0
+        elif kind == 'dispense':
+            received[well] = received.get(well, 0) + volume - air
+            air = 0
+    assert [volume for kind, volume, well in events[start + 1:end] if kind == 'aspirate'] == aspirations
+    assert received == {f'A{column}': 50 for column in range(1, columns + 1)}
+
+
+def test_calibration_stores_measured_heights_only(tmp_path):
+    import calibrate_interstice
+
+    cache = tmp_path / 'heights.json'
+    plate = STANDARD_PLATES['samples_plate_type']
+    calibrate_interstice.main(['--plate', plate, '--cache', str(cache)])
+    assert not cache.exists()
+    calibrate_interstice.main(['--plate', plate, '--cache', str(cache), '--measured', f'{plate}=12.5'])
+    assert load_protocol(PROTOCOLS['OT2']).load_interstice_heights(str(cache)) == {plate: 12.5}
+
+
+def test_sample_manifest_wells():
+    module = load_protocol(PROTOCOLS['OT2'])
+    manifest = io.StringIO('plate,well,sample\n1,B7,s1\n1,h2,s2\n3,A12,s3\n')
+    assert module.read_sample_manifest(manifest) == [(1, [2, 7]), (3, [12])]
+    with pytest.raises(ValueError, match = 'line 3: J7 is not a well'):
+        module.read_sample_manifest(io.StringIO('plate,well\n1,B7\n1,J7\n'))
+    # Spreadsheet exports: byte order mark before the header, trailing commas
+    assert module.read_sample_manifest(io.StringIO('\ufeffplate,column\n1,3,\n2,5,,\n')) == [(1, [3]), (2, [5])]
+    with pytest.raises(ValueError, match = 'line 3: a plate and a column'):
+        module.read_sample_manifest(io.StringIO('plate,column\n1,3,\n2,,\n'))
+
+
+def test_reagent_calculator_runs(tmp_path):
+    import reagent_calculator
+
+    runs = tmp_path / 'runs.csv'
+    runs.write_bytes('run,samples\nmonday,96,\ntuesday,48\n'.encode('utf-8-sig'))
+    assert [(run['run'], run['samples']) for run in reagent_calculator.read_runs(str(runs))] == [('monday', 96), ('tuesday', 48)]
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+def test_sample_manifest_file(protocol, tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('plate,column\n2,5\n2,9\n')
+    pauses = simulate(protocol, files = {'sample_manifest': manifest}, use_sample_manifest = True)
+    assert 'Place samples plate 2 respectively on sites' in '\n'.join(pauses)
+    with pytest.raises(Exception, match = 'CSV parameter needs to be set'):
+        simulate(protocol, use_sample_manifest = True)
+
+
+def test_deck_plan_sparse_plates():
+    module = load_protocol(PROTOCOLS['OT2'])
+    sample_plates = [(1, [1, 2, 3]), (3, [5, 6])]
+    plan = module.plan_deck(sample_plates, True, False, module.deck_slots)
+    assert plan['batches'] == [[1, 3]] and plan['moves'] == 0
+    assert sorted(name for name in plan['lifetimes'] if name.endswith(('_2', '_4'))) == []
+    # The reagent tips come from the columns the samples leave free in their racks
+    for step, (rack, column) in plan['reagent_tips'].items():
+        assert column + 1 not in dict(sample_plates)[int(rack.split('_')[-1])], step
+
+
+@pytest.mark.parametrize('protocol', sorted(PROTOCOLS))
+def test_sparse_plates_run(protocol):
+    pauses = simulate(protocol, first_column_plate_2 = 0, first_column_plate_4 = 0, last_column_plate_1 = 3,
+                      first_column_plate_3 = 5, last_column_plate_3 = 6)
+    text = '\n'.join(pauses)
+    assert 'Place samples plate 1 & 3 respectively' in text and 'place samples plates 1 & 3 back to sites' in text
+
+
+def test_deck_plan_reuses_slots_across_stages():
+    module = load_protocol(PROTOCOLS['OT2'])
+    sample_plates = [(plate, list(range(1, 13))) for plate in range(1, 5)]
+    plan = module.plan_deck(sample_plates, True, True, module.deck_slots)
+    assert plan['batches'] == [[1, 2, 3], [4]]
+    shared = {slot: names for slot, names in plan['occupants'].items() if len(names) > 1}
+    assert shared and plan['moves'] == sum(2 * (len(names) - 1) for names in shared.values())
+    for names in shared.values():             # One labware after the other, never two at the same stage
+        lifetimes = [plan['lifetimes'][name] for name in names]
+        assert all(last < first for (_, last), (first, _) in zip(lifetimes, lifetimes[1:])), names
+    assert plan['slot']['samples_plate_4'] not in shared      # Needed from the first to the last supernatant transfer
+
+    lifetimes = {'samples_plate_1': (0, 1), 'tiprack_1': (0, 0), 'final_plate_1': (1, 2)}
+    slots = {'1': (0, 0), '2': (132.5, 0)}
+    assert module.assign_slots(lifetimes, list(lifetimes), slots) == {'1': ['samples_plate_1'], '2': ['tiprack_1', 'final_plate_1']}
+    assert module.assign_slots(lifetimes, list(lifetimes), slots, tipracks_on_adapters = True) is None
+    assert module.assign_slots(lifetimes, list(lifetimes), slots, tiprack_slots = ['2']) is None
+
+
+def test_deck_too_full_for_heater_shaker_and_pipette_off():
+    # The Heater-Shaker takes slots 10 and 11 of the OT-2 and slot 7 holds only tipracks: the transfer tipracks kept for pipetting off
+    # the ethanol leave no room for 4 plates
+    with pytest.raises(ValueError, match = '4 samples plates do not fit on the 9 deck slots'):
+        simulate('OT2', chloroform_buffer_mixing = 'heater_shaker', pipetteOff_ethanol = True)
+    module = load_protocol(PROTOCOLS['OT2'])
+    lifetimes = module.labware_lifetimes([[1, 2], [3, 4]], False, True)
+    assert lifetimes['transfer_tiprack_1'] == (1, 3) and lifetimes['final_plate_3'] == (2, 3) and lifetimes['samples_plate_3'] == (0, 2)
+    assert module.labware_lifetimes([[1, 2], [3, 4]], False, False)['transfer_tiprack_1'] == (1, 1)
+
+def test_tip_budget_partial_columns():
+    module = load_protocol(PROTOCOLS['OT2'])
+    sample_plates = [(1, list(range(3, 9))), (2, list(range(1, 13)))]
+    plan = module.plan_deck(sample_plates, True, True, module.deck_slots)
+    ledger = module.tip_budget(plan, sample_plates, True, ['Ethanol discarding'])
+    picks = {}
+    for step, rack, column, stage, reused in ledger:
+        picks.setdefault(step, []).append(reused)
+    # One tip column per sample column (6 + 12) for the chloroform, the transfer and the ethanol pipetting off (reused transfer tips)
+    assert [len(picks[step]) for step in ('Chloroform dispensing', 'Supernatant transfer', 'Ethanol discarding')] == [18, 18, 18]
+    assert all(picks['Ethanol discarding']) and 'Isopropanol discarding' not in picks
+    assert sorted(column for step, rack, column, stage, reused in ledger if rack == 'tiprack_1' and step == 'Chloroform dispensing') == list(range(2, 8))
+    assert sum(not reused for step, rack, column, stage, reused in ledger) == 40     # + TE buffer and 3 washes, the extraction buffer reuses the TE tip
+
+
+def test_tip_budget_over_budget():
+    module = load_protocol(PROTOCOLS['OT2'])
+    sample_plates = [(1, list(range(3, 9))), (2, list(range(1, 13)))]
+    plan = module.plan_deck(sample_plates, True, False, module.deck_slots)
+    with pytest.raises(ValueError, match = 'Ethanol discarding: transfer_tiprack_2 is not on the deck when its tips are needed'):
+        module.tip_budget(plan, sample_plates, True, ['Ethanol discarding'])
+    plan['reagent_tips']['Isopropanol dispensing'] = ('transfer_tiprack_1', 2)          # Column 3 carries the supernatant of plate 1
+    with pytest.raises(ValueError, match = 'Isopropanol dispensing: the tips of transfer_tiprack_1 column 3 are already used'):
+        module.tip_budget(plan, sample_plates, True, [])
+    plan['reagent_tips']['Isopropanol dispensing'] = ('transfer_tiprack_1', 12)
+    with pytest.raises(ValueError, match = 'transfer_tiprack_1 has no column 13'):
+        module.tip_budget(plan, sample_plates, True, [])
+
+def test_makespan_staggered_and_sequential():
+    module = load_protocol(PROTOCOLS['OT2'])
+    chain = [('TE buffer dispensing', False), ('Incubation', True), ('Chloroform dispensing', False), ('Centrifugation', True)]
+    robot_minutes = {'TE buffer dispensing': {1: 5, 2: 5}, 'Chloroform dispensing': {1: 10, 2: 10}}
+    # Sequential: TE buffer until 5 and 10, both plates incubated 10-70, chloroform 70-80 and 80-90, centrifugation 90-100
+    assert module.makespan(chain, robot_minutes, [1, 2]) == 100
+    # Staggered incubation: plate 1 incubated 5-65, plate 2 10-70, chloroform 65-75 and 75-85, centrifugation 85-95
+    assert module.makespan(chain, robot_minutes, [1, 2], staggered = [1]) == 95
+    # Staggered centrifugation as well: plate 1 centrifuged 75-85, plate 2 85-95
+    assert module.makespan(chain, robot_minutes, [1, 2], staggered = [1, 3]) == 95
+    # A single plate waits for no other plate
+    assert module.makespan(chain, robot_minutes, [1]) == module.makespan(chain, robot_minutes, [1], staggered = [1, 3]) == 85
+
+def test_reagent_quantities_numpy():
+    numpy = pytest.importorskip('numpy')
+    module = load_protocol(PROTOCOLS['OT2'])
+    assert module.reagent_quantities(numpy.int64(96)) == module.reagent_quantities(96)
+    quantities = module.reagent_quantities(numpy.arange(8, 97, 8))
+    assert isinstance(quantities, numpy.ndarray) and quantities.shape == (12,)
+    assert list(quantities) == module.reagent_quantities(list(range(8, 97, 8)))
+
+
+def test_reagent_dead_volume():
+    # 96 samples x 40 uL of elution buffer: the troughs of the reservoir hold 6.5 mL under the 1.75 mm aspiration
+    # height (a flat bottom of the same footprint would hold 13.6 mL)
+    module = load_protocol(PROTOCOLS['OT2'])
+    assert 96 * 40 + 6000 < module.reagent_quantities(96)['poured']['elution_buffer'] < 96 * 40 + 7000
+
+
+def test_step_log_fit_recovers_timing_constants(tmp_path, capsys):
+    # Step lines of a robot whose real constants and move speed differ from the timing model: the fit finds them back
+    import json
+    import random
+
+    import step_log_report
+
+    module = load_protocol(PROTOCOLS['OT2'])
+    calibration = module.timing_calibration
+    real = {'command_overhead': 0.5, 'pick_up_tip': 4.2, 'drop_tip': 1.5, 'blow_out': 0.8}
+    factor = 1.3
+    draw = random.Random(1)
+    with open(tmp_path / 'steps.jsonl', 'w') as f:
+        for run in range(20):
+            counts = {'command_overhead': draw.randint(100, 400), 'pick_up_tip': draw.randint(1, 12), 'drop_tip': draw.randint(1, 12),
+                      'blow_out': draw.randint(0, 96), 'home_plunger': draw.randint(0, 12), 'unknown_move': draw.randint(0, 3)}
+            moves, dwells = draw.uniform(100, 600), draw.choice([0, 30, 90])
+            fixed = dwells + sum(counts[name] * calibration[name] for name in ('home_plunger', 'unknown_move'))
+            estimate = moves + dwells + sum(count * calibration[name] for name, count in counts.items())
+            seconds = factor * moves + fixed + sum(counts[name] * value for name, value in real.items())
+            f.write(json.dumps({'run': str(run), 'run_id': str(run), 'robot': 'OT2-A', 'protocol': module.metadata['protocolName'], 'step': 'Supernatant transfer',
+                                'seconds': seconds, 'estimated_seconds': estimate, 'estimated_counts': counts, 'estimated_dwell_seconds': dwells}) + '\n')
+    assert step_log_report.main([str(tmp_path)]) == 0
+    fitted = capsys.readouterr().out.split('Fitted timing_calibration constants')[1]
+    for name, value in real.items():
+        assert f"'{name}': {value:.2f} (now {calibration[name]})" in fitted
+    assert f'take {factor:.2f} x their estimate' in fitted
+
+
+def test_command_stream_diff_with_inserted_pause():
+    import command_stream
+
+    def recording(stops, pauses_before):        # Six aspirations, with a pause before each of the commands "pauses_before"
+        records = []
+        for i in range(6):
+            record = dict(command = 'aspirate', stop = sum(i >= index for index in pauses_before), labware = 'plate', well = f'A{i + 1}', volume = 50, seconds = 1)
+            records.append(tuple(record.get(field) for field in command_stream.FIELDS))
+        return {'config': 'OT2-test', 'stops': stops, 'records': records}
+
+    out = io.StringIO()
+    assert command_stream.diff_recordings(recording(['Refill'], [4]), recording(['Check the tips', 'Refill'], [2, 4]), out = out)
+    text = out.getvalue()
+    assert '0 commands removed, 0 added' in text
+    assert 'pauses: 1 -> 2, 0 removed, 1 added' in text and '+ Check the tips' in text
+    assert not command_stream.diff_recordings(recording(['Refill'], [4]), recording(['Refill'], [4]), out = io.StringIO())
@@ -0,0 +1,399 @@
+"""Headless simulation benchmark of the RoboCTAB protocols.
+
+Runs ``run(ctx)`` of RoboCTAB_OT2.py and RoboCTAB_Flex.py in the Opentrons
+simulator for every combination of plate count, column range, chloroform
+mixing mode and ``pipetteOff_*`` flags, and records for each configuration:
+commands issued, tip pick-ups, aspirated/air gap/dispensed volumes, operator stops
+(pauses and manual labware moves),
+estimated robot time (from the protocol's own timing model) and simulation
+wall time. Dwells (``hold_pipette()`` delays) are added to the robot time.
+
+Typical use::
+
+    python tools/benchmark.py --save-baseline benchmarks/baseline.json
+    # ... edit the protocol ...
+    python tools/benchmark.py --baseline benchmarks/baseline.json
+
+The second call exits with status 1 when a configuration's estimated robot
+time grows by more than ``--tolerance`` minutes, when it picks up more tips,
+when it stops for the operator more often, or when a configuration that used to simulate now fails.
+
+The configuration is passed to the protocols as run-time parameters (see
+``add_parameters()`` in the protocols). The protocols use custom plate
+definitions; pass their JSON files with ``--labware`` or choose a standard
+plate with, for example, ``--set samples_plate_type="'nest_96_wellplate_2ml_deep'"``.
+A reagent setting of the protocols' ``liquid_classes`` table is tried with
+``--liquid``, for example ``--liquid isopropanol.aspirate_rate=2``.
+
+``--record DIR`` writes the command stream of every configuration to
+``DIR/<config>.commands.json.gz``; ``tools/command_stream.py`` diffs two of them.
+
+``--profile DIR`` profiles ``run(ctx)`` of every configuration (the analysis
+time paid on every upload), writes ``DIR/<config>.prof`` (cProfile, see
+``pstats``) and lists the protocol functions taking the most time.
+"""
+
+import argparse
+import ast
+import concurrent.futures
+import cProfile
+import csv
+import inspect
+import itertools
+import json
+import os
+import pstats
+import sys
+import time
+import types
+
+from command_stream import EXTENSION, describe_location, slot_name, write_recording
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROTOCOLS = {
+    'OT2': os.path.join(ROOT, 'RoboCTAB_OT2.py'),
+    'Flex': os.path.join(ROOT, 'RoboCTAB_Flex.py'),
+}
+
+# Column ranges applied to every plate of a configuration
+COLUMN_RANGES = {
+    'full': (1, 12),
+    'partial': (3, 8),
+    'single': (5, 5),
+}
+
+MIXING_MODES = ['pipette_mixing', 'bubble_mixing', 'no_mixing', 'heater_shaker']
+
+# Pipette commands counted, timed and (for liquids) measured by the benchmark
+PIPETTE_COMMANDS = ['pick_up_tip', 'drop_tip', 'return_tip', 'aspirate', 'dispense', 'air_gap', 'blow_out', 'touch_tip', 'move_to']
+
+RESULT_FIELDS = ['config', 'protocol', 'plates', 'columns', 'mixing', 'pipetteOff_isopropanol', 'pipetteOff_ethanol',
+                 'status', 'commands', 'tip_pickups', 'aspirated_ul', 'air_gap_ul', 'dispensed_ul', 'pauses', 'labware_moves', 'operator_stops',
+                 'robot_time_min', 'gantry_travel_m', 'wall_time_s', 'error']
+
+
+def configurations(protocols, plates, columns, mixing, pipette_off):
+    for protocol, n_plates, column_range, mixing_mode, (off_iso, off_eth) in itertools.product(
+            protocols, plates, columns, mixing, pipette_off):
+        yield {
+            'protocol': protocol,
+            'plates': n_plates,
+            'columns': column_range,
+            'mixing': mixing_mode,
+            'pipetteOff_isopropanol': off_iso,
+            'pipetteOff_ethanol': off_eth,
+        }
+
+
+def config_id(config):
+    return '{protocol}-{plates}p-{columns}-{mixing}-iso{iso:d}-eth{eth:d}'.format(
+        iso=config['pipetteOff_isopropanol'], eth=config['pipetteOff_ethanol'], **config)
+
+
+def protocol_values(config):
+    """Run-time parameter values of the protocol for one benchmark configuration."""
+    first, last = COLUMN_RANGES[config['columns']]
+    values = {}
+    for plate in range(1, 5):
+        used = plate <= config['plates']
+        values[f'first_column_plate_{plate}'] = first if used else 0
+        values[f'last_column_plate_{plate}'] = last
+    values['chloroform_buffer_mixing'] = config['mixing']
+    values['pipetteOff_isopropanol'] = config['pipetteOff_isopropanol']
+    values['pipetteOff_ethanol'] = config['pipetteOff_ethanol']
+    return values
+
+
+def load_protocol(path):
+    """Loads a protocol file as a module."""
+    with open(path) as f:
+        source = f.read()
+    module = types.ModuleType(os.path.splitext(os.path.basename(path))[0])
+    module.__file__ = path
+    exec(compile(source, path, 'exec'), module.__dict__)
+    return module
+
+
+def load_labware_definitions(labware_dir):
+    """Custom labware definitions (JSON files of ``labware_dir``) by load name."""
+    extra_labware = {}
+    if labware_dir:
+        for name in os.listdir(labware_dir):
+            if name.endswith('.json'):
+                with open(os.path.join(labware_dir, name)) as f:
+                    definition = json.load(f)
+                extra_labware[definition['parameters']['loadName']] = definition
+    return extra_labware
+
+
+def simulated_context(module, labware_dir = None):
+    """Simulated protocol context (and robot type) for the API level and robot of a loaded protocol."""
+    from opentrons import simulate
+    requirements = getattr(module, 'requirements', {})
+    api_level = requirements.get('apiLevel') or module.metadata['apiLevel']
+    robot_type = 'Flex' if requirements.get('robotType') == 'Flex' else 'OT-2'
+    extra_labware = load_labware_definitions(labware_dir)
+    return simulate.get_protocol_api(api_level, extra_labware=extra_labware or None, robot_type=robot_type), robot_type
+
+
+class _BenchmarkedPipette:
+    """Forwards every call to the simulated pipette and tees the commands into the protocol's timing model."""
+
+    def __init__(self, pipette, timing, stats, record = None):
+        object.__setattr__(self, '_pipette', pipette)
+        object.__setattr__(self, '_timing', timing)
+        object.__setattr__(self, '_stats', stats)
+        object.__setattr__(self, '_record', record)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pipette, name)
+        if name not in PIPETTE_COMMANDS:
+            return attribute
+
+        def command(*args, **kwargs):
+            volume_before = self._pipette.current_volume if self._pipette.has_tip else 0
+            result = attribute(*args, **kwargs)
+            seconds_before = self._timing().seconds
+            getattr(self._timing(), name)(*args, **kwargs)
+            volume_after = self._pipette.current_volume if self._pipette.has_tip else 0
+            if self._record:
+                arguments = inspect.signature(attribute).bind_partial(*args, **kwargs).arguments
+                location = arguments.get('location')
+                if location is None and name == 'pick_up_tip':      # Next tip of the tipracks
+                    location = getattr(self._pipette, '_last_tip_picked_up_from', None)
+                self._record(name, describe_location(location), volume = round(volume_after - volume_before, 2), rate = arguments.get('rate'),
+                             speed = arguments.get('speed') or self._pipette.default_speed, seconds = self._timing().seconds - seconds_before)
+            self._stats['commands'] += 1
+            if name == 'pick_up_tip':
+                self._stats['tip_pickups'] += 1
+            if name == 'aspirate':
+                self._stats['aspirated_ul'] += volume_after - volume_before
+            if name == 'air_gap':
+                self._stats['air_gap_ul'] += volume_after - volume_before
+            if name == 'dispense':                      # Air gaps leave the tip with the liquid
+                self._stats['dispensed_ul'] += volume_before - volume_after
+            return result
+        return command
+
+    def __setattr__(self, name, value):     # default_speed, starting_tip...
+        setattr(self._pipette, name, value)
+        if name == 'default_speed':
+            self._timing().default_speed = value
+
+
+def set_liquid_setting(liquid_classes, path, value):
+    """Sets ``liquid_classes[class][key]...`` from a dotted path, raises KeyError for an unknown setting."""
+    *sections, key = path.split('.')
+    for section in sections:
+        liquid_classes = liquid_classes[section]
+    if key not in liquid_classes:
+        raise KeyError(path)
+    liquid_classes[key] = value
+
+
+def run_configuration(config, labware_dir = None, overrides = None, liquid_overrides = None, profile_dir = None, record_dir = None):
+    """Simulates one configuration and returns its result row, profiling ``run(ctx)`` into ``profile_dir`` and
+    recording its command stream into ``record_dir`` when given."""
+    from opentrons.protocol_api import ParameterContext
+
+    row = dict(config, config=config_id(config), status='ok', error='',
+               commands=0, tip_pickups=0, aspirated_ul=0.0, air_gap_ul=0.0, dispensed_ul=0.0, pauses=0, labware_moves=0, operator_stops=0,
+               robot_time_min=0.0, gantry_travel_m=0.0, wall_time_s=0.0)
+    values = protocol_values(config)
+    values.update(overrides or {})
+    module = load_protocol(PROTOCOLS[config['protocol']])
+    for path, value in (liquid_overrides or {}).items():
+        set_liquid_setting(module.liquid_classes, path, value)
+
+    ctx, robot_type = simulated_context(module, labware_dir)
+
+    # Run-time parameters, set the way the robot does before calling run()
+    parameters = ParameterContext(ctx.api_version)
+    module.add_parameters(parameters)
+    parameters.set_parameters(values)
+    ctx._params = parameters.export_parameters_for_protocol()
+
+    timings = []
+    load_instrument = ctx.load_instrument
+    pause = ctx.pause
+    move_labware = ctx.move_labware
+    hold_pipette = module.hold_pipette
+    records = []
+    stops = []                                  # Last instruction of every pause
+
+    def record(command, where = (None,) * 6, **fields):
+        records.append(dict(zip(['labware', 'slot', 'well', 'x', 'y', 'z'], where), command = command, stop = len(stops), **fields))
+
+    def benchmarked_load_instrument(*args, **kwargs):
+        pipette = load_instrument(*args, **kwargs)
+        timing = []
+
+        def pipette_timing():               # Built at the first command, once the labware defining the safe heights is loaded
+            if not timing:
+                trash = ctx.fixed_trash if robot_type == 'OT-2' else None
+                timing.append(module.TimedPipette(pipette, ctx, trash))
+                timings.append(timing[0])
+            return timing[0]
+
+        def benchmarked_hold_pipette(ctx, pipette, seconds):   # Dwells are robot delays, teed into the timing model like the pipette commands
+            if not isinstance(pipette, module.TimedPipette):
+                row['commands'] += 1
+                seconds_before = pipette_timing().seconds
+                pipette_timing().wait(seconds)
+                if record_dir:
+                    record('delay', seconds = pipette_timing().seconds - seconds_before)
+            hold_pipette(ctx, pipette, seconds)
+
+        module.hold_pipette = benchmarked_hold_pipette
+        return _BenchmarkedPipette(pipette, pipette_timing, row, record if record_dir else None)
+
+    def counted_pause(*args, **kwargs):
+        row['pauses'] += 1
+        row['operator_stops'] += 1
+        stops.append(str(args[0] if args else kwargs.get('msg', '')).split('---- ')[-1].strip())
+        return pause(*args, **kwargs)
+
+    def counted_move_labware(*args, **kwargs):
+        row['labware_moves'] += 1
+        row['commands'] += 1
+        if not kwargs.get('use_gripper'):           # Manual moves wait for the operator
+            row['operator_stops'] += 1
+        if record_dir:
+            arguments = inspect.signature(move_labware).bind_partial(*args, **kwargs).arguments
+            record('move_labware_gripper' if arguments.get('use_gripper') else 'move_labware',
+                   (arguments['labware'].load_name, slot_name(arguments['new_location']), None, None, None, None))
+        return move_labware(*args, **kwargs)
+
+    ctx.load_instrument = benchmarked_load_instrument
+    ctx.pause = counted_pause
+    ctx.move_labware = counted_move_labware
+
+    profile = cProfile.Profile() if profile_dir else None
+    start = time.perf_counter()
+    try:
+        if profile:
+            profile.runcall(module.run, ctx)
+        else:
+            module.run(ctx)
+    except Exception as error:
+        row['status'] = 'error'
+        row['error'] = f'{type(error).__name__}: {error}'.splitlines()[0][:200]
+    row['wall_time_s'] = round(time.perf_counter() - start, 2)
+    if profile:
+        profile.dump_stats(os.path.join(profile_dir, row['config'] + '.prof'))
+    if record_dir:
+        write_recording(os.path.join(record_dir, row['config'] + EXTENSION), row['config'], config['protocol'], stops, records)
+    row['robot_time_min'] = round(sum(timing.seconds for timing in timings) / 60, 2)
+    row['gantry_travel_m'] = round(sum(timing.distance for timing in timings) / 1000, 2)
+    row['aspirated_ul'] = round(row['aspirated_ul'], 1)
+    row['air_gap_ul'] = round(row['air_gap_ul'], 1)
+    row['dispensed_ul'] = round(row['dispensed_ul'], 1)
+    return row
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of ``results`` against a baseline keyed by configuration id."""
+    regressions = []
+    for row in results:
+        reference = baseline.get(row['config'])
+        if reference is None:
+            continue
+        if row['status'] != 'ok' and reference['status'] == 'ok':
+            regressions.append(f"{row['config']}: simulation now fails ({row['error']})")
+            continue
+        increase = row['robot_time_min'] - reference['robot_time_min']
+        if increase > tolerance:
+            regressions.append(f"{row['config']}: estimated robot time {reference['robot_time_min']} -> {row['robot_time_min']} min (+{increase:.1f})")
+        if row['tip_pickups'] > reference['tip_pickups']:
+            regressions.append(f"{row['config']}: tip pick-ups {reference['tip_pickups']} -> {row['tip_pickups']}")
+        if row['operator_stops'] > reference.get('operator_stops', row['operator_stops']):
+            regressions.append(f"{row['config']}: operator stops {reference['operator_stops']} -> {row['operator_stops']}")
+    return regressions
+
+
+def print_profile(path, protocol, limit = 12):
+    """Lists the functions of ``protocol`` taking the most cumulative time in a profile of ``run(ctx)``."""
+    stats = pstats.Stats(path)
+    total = stats.total_tt
+    print(f'{os.path.basename(path)}: {total:.2f} s profiled', file = sys.stderr)
+    rows = [(cumulative, calls, f'{function} (line {line})') for (filename, line, function), (calls_primitive, calls, own, cumulative, callers) in stats.stats.items()
+            if filename == protocol]
+    for cumulative, calls, function in sorted(rows, reverse = True)[:limit]:
+        print(f'  {function:<56} {calls:>7} calls {cumulative:>7.2f} s {100 * cumulative / total:>5.1f}%', file = sys.stderr)
+
+
+def parse_bool_pairs(text):
+    pairs = []
+    for item in text.split(','):
+        iso, eth = item.split('/')
+        pairs.append((iso == '1', eth == '1'))
+    return pairs
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--protocols', default = 'OT2,Flex', help = 'comma separated: OT2,Flex')
+    parser.add_argument('--plates', default = '1,2,3,4', help = 'comma separated plate counts')
+    parser.add_argument('--columns', default = ','.join(COLUMN_RANGES), help = 'comma separated column ranges: ' + ', '.join(f'{k} {v[0]}-{v[1]}' for k, v in COLUMN_RANGES.items()))
+    parser.add_argument('--mixing', default = ','.join(MIXING_MODES), help = 'comma separated chloroform mixing modes')
+    parser.add_argument('--pipette-off', default = '0/0,0/1,1/0,1/1', help = 'comma separated pipetteOff_isopropanol/pipetteOff_ethanol pairs')
+    parser.add_argument('--set', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'override a run-time parameter of the protocols (Python literal)')
+    parser.add_argument('--liquid', action = 'append', default = [], metavar = 'CLASS.KEY=VALUE', help = 'override a liquid class setting of the protocols (Python literal)')
+    parser.add_argument('--labware', help = 'directory of custom labware definitions (JSON)')
+    parser.add_argument('--jobs', type = int, default = os.cpu_count(), help = 'simulations run in parallel')
+    parser.add_argument('--output', help = 'write the results as CSV (default: stdout)')
+    parser.add_argument('--save-baseline', help = 'write the results as a JSON regression baseline')
+    parser.add_argument('--baseline', help = 'JSON baseline to compare the results against')
+    parser.add_argument('--record', metavar = 'DIR', help = 'record the command stream of every configuration into DIR (see command_stream.py)')
+    parser.add_argument('--profile', metavar = 'DIR', help = 'profile run(ctx) of every configuration into DIR/<config>.prof')
+    parser.add_argument('--tolerance', type = float, default = 1.0, help = 'allowed increase of estimated robot time (min) before a configuration is flagged')
+    args = parser.parse_args(argv)
+    for directory in (args.profile, args.record):
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+    overrides = {name: ast.literal_eval(value) for name, value in (item.split('=', 1) for item in args.set)}
+    liquid_overrides = {path: ast.literal_eval(value) for path, value in (item.split('=', 1) for item in args.liquid)}
+    for path, value in liquid_overrides.items():
+        try:
+            set_liquid_setting(load_protocol(PROTOCOLS['OT2']).liquid_classes, path, value)
+        except (KeyError, TypeError):
+            parser.error(f'--liquid: unknown liquid class setting {path}')
+    configs = list(configurations(args.protocols.split(','), [int(p) for p in args.plates.split(',')],
+                                  args.columns.split(','), args.mixing.split(','), parse_bool_pairs(args.pipette_off)))
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, max_tasks_per_child = 1) as pool:
+        futures = [pool.submit(run_configuration, config, args.labware, overrides, liquid_overrides, args.profile, args.record) for config in configs]
+        for future in concurrent.futures.as_completed(futures):
+            row = future.result()
+            results.append(row)
+            print(f"{row['config']:<48} {row['status']:<6} {row['robot_time_min']:>7} min {row['wall_time_s']:>7} s", file = sys.stderr)
+    results.sort(key = lambda row: row['config'])
+    if args.profile:
+        for row in results:
+            print_profile(os.path.join(args.profile, row['config'] + '.prof'), PROTOCOLS[row['protocol']])
+
+    output = open(args.output, 'w', newline = '') if args.output else sys.stdout
+    writer = csv.DictWriter(output, fieldnames = RESULT_FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+    if args.output:
+        output.close()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({row['config']: row for row in results}, f, indent = 1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file = sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
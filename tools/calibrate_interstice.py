@@ -0,0 +1,65 @@
+"""Interstice calibration of the RoboCTAB protocols.
+
+Runs ``calibrate(ctx)`` of a protocol in the Opentrons simulator. The heights of
+the aqueous/organic interface of the samples (top of the 400 uL chloroform phase
+under the 50 uL TE buffer + 400 uL extraction buffer) measured with a ruler are
+given with ``--measured`` and stored in the calibration cache file. The protocols
+load it when their ``Interstice height`` run-time parameter is 0, and keep the
+14 mm measured on the original plates for a plate type not measured yet.
+
+Every samples plate type offered by the protocol, or the ``--plate`` types given,
+is listed with the height the protocols use and the height the phase would have
+in a straight tube of the well volume. That estimate is only a guide to check a
+measurement: round and conical well bottoms put the interface above it, so it is
+never stored.
+
+Typical use, on the robot (the cache is written in /data) or with ``--cache``::
+
+    python tools/calibrate_interstice.py --labware path/to/labware
+    python tools/calibrate_interstice.py --labware path/to/labware --measured 1.2ml_simport_vwr_t1102_96well=14
+"""
+
+import argparse
+import ast
+import sys
+
+from benchmark import PROTOCOLS, load_protocol, simulated_context
+
+
+class _ParameterChoices:
+    """Stands in for the parameter context of ``add_parameters()`` and records the choices of every parameter."""
+
+    def __init__(self):
+        self.choices = {}
+
+    def __getattr__(self, name):            # add_int, add_float, add_bool, add_str...
+        def add(variable_name, **kwargs):
+            self.choices[variable_name] = [choice['value'] for choice in kwargs.get('choices', [])]
+        return add
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--protocol', default = 'OT2', choices = sorted(PROTOCOLS), help = 'protocol whose calibrate() is run')
+    parser.add_argument('--plate', action = 'append', default = [], metavar = 'LOAD_NAME', help = 'samples plate type to list (default: every choice of the protocol)')
+    parser.add_argument('--measured', action = 'append', default = [], metavar = 'LOAD_NAME=MM', help = 'store a height measured with a ruler for a plate type')
+    parser.add_argument('--labware', help = 'directory of custom labware definitions (JSON)')
+    parser.add_argument('--cache', help = 'calibration cache file (default: the one the protocols load)')
+    args = parser.parse_args(argv)
+
+    module = load_protocol(PROTOCOLS[args.protocol])
+    measured = {name: float(ast.literal_eval(value)) for name, value in (item.split('=', 1) for item in args.measured)}
+    plates = args.plate
+    if not plates:
+        parameters = _ParameterChoices()
+        module.add_parameters(parameters)
+        plates = parameters.choices['samples_plate_type']
+    ctx, robot_type = simulated_context(module, args.labware)
+    calibration = module.calibrate(ctx, plates + [name for name in measured if name not in plates], measured, args.cache or module.interstice_cache_file)
+    for name, (height, source, estimate) in sorted(calibration.items()):
+        print(f'{name:<40} {height} mm ({source}), straight-tube estimate {estimate} mm (not stored)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
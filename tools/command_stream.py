@@ -0,0 +1,171 @@
+"""Command-stream recordings of the RoboCTAB protocols and their diff.
+
+``tools/benchmark.py --record DIR`` writes, for every configuration it
+simulates, the ordered stream of robot commands of ``run(ctx)``: pick_up_tip,
+drop_tip, aspirate, dispense, air_gap, blow_out, touch_tip, move_to, delays and
+labware moves, each with its labware, slot, well, deck coordinates, volume,
+rate, speed and the time the protocol's timing model gives it. A recording is a
+gzipped JSON file holding one list per field (columnar): 5 kB for a run of one
+full plate, 17 kB for four.
+
+This script diffs two recordings, or two directories of recordings matched by
+configuration, and shows which commands changed and what it does to the robot
+time and the volumes moved. The pauses are compared apart from the commands,
+so adding or removing one does not show every later command as changed::
+
+    python tools/benchmark.py --record before/ ...   # before a change
+    python tools/benchmark.py --record after/ ...    # after it
+    python tools/command_stream.py before/ after/
+
+It exits with status 1 when the streams differ.
+"""
+
+import argparse
+import difflib
+import gzip
+import json
+import os
+import sys
+
+FIELDS = ['command', 'stop', 'labware', 'slot', 'well', 'x', 'y', 'z', 'volume', 'rate', 'speed', 'seconds']
+# The time of a command follows from its other fields, and its stop number from the pauses before it (compared apart)
+COMPARED_FIELDS = [field for field in FIELDS if field not in ('stop', 'seconds')]
+EXTENSION = '.commands.json.gz'
+
+
+def slot_name(place):
+    """Name of where a labware sits: deck slot, or load name of the module or adapter it is on, None when unknown."""
+    if place is None or isinstance(place, str):
+        return place
+    return getattr(place, 'load_name', None) or getattr(place, 'model', None) or str(place)
+
+
+def describe_location(location):
+    """(labware load name, slot, well name, x, y, z) of a command location (Location, Well, labware, trash...), None for unknown fields."""
+    point = None
+    if hasattr(location, 'point'):                      # Location: a point in a well, a labware, a slot or nowhere
+        point = location.point
+        location = location.labware.object
+    if location is None or isinstance(location, str):
+        labware, slot, well = None, location, None
+    else:
+        well = location.well_name if hasattr(location, 'well_name') else None
+        labware = location.parent if well is not None else location
+        if point is None and well is not None:
+            try:
+                point = location.top().point
+            except Exception:                           # Labware waiting off deck
+                point = None
+        slot = slot_name(getattr(labware, 'parent', None))
+        labware = getattr(labware, 'load_name', None) or type(labware).__name__
+    return (labware, slot, well) + (tuple(round(coordinate, 1) for coordinate in point) if point is not None else (None, None, None))
+
+
+def write_recording(path, config, protocol, stops, records):
+    """Writes the records (dicts of FIELDS) of a run, ``stops`` being the instruction of every operator stop."""
+    columns = {field: [record.get(field) for record in records] for field in FIELDS}
+    with gzip.open(path, 'wt') as f:
+        json.dump({'config': config, 'protocol': protocol, 'stops': stops, 'columns': columns}, f, separators = (',', ':'))
+
+
+def read_recording(path):
+    """The recording of ``path`` with its records rebuilt as tuples of FIELDS."""
+    with gzip.open(path, 'rt') as f:
+        recording = json.load(f)
+    columns = recording['columns']
+    recording['records'] = list(zip(*(columns[field] for field in FIELDS)))
+    return recording
+
+
+def signed_volume(record):
+    """uL the command puts in the tip (positive) or out of it (negative)."""
+    return record[FIELDS.index('volume')] or 0
+
+
+def summary(records):
+    """(commands, seconds, uL aspirated, uL dispensed) of records."""
+    volumes = [signed_volume(record) for record in records if record[0] in ('aspirate', 'dispense')]
+    return (len(records), sum(record[-1] or 0 for record in records),
+            sum(volume for volume in volumes if volume > 0), -sum(volume for volume in volumes if volume < 0))
+
+
+def format_record(record):
+    values = dict(zip(FIELDS, record))
+    where = ' '.join(str(values[field]) for field in ('labware', 'slot', 'well') if values[field] is not None)
+    if values['x'] is not None:
+        where += f" ({values['x']}, {values['y']}, {values['z']})"
+    details = ' '.join(f'{field} {values[field]}' for field in ('volume', 'rate', 'speed') if values[field] is not None)
+    return f"{values['command']:<13} {where} {details}".rstrip()
+
+
+def diff_recordings(before, after, max_hunks = 20, out = sys.stdout):
+    """Prints the commands changed between two recordings and their effect, returns True when they differ."""
+    compared = [FIELDS.index(field) for field in COMPARED_FIELDS]
+    a = [tuple(record[i] for i in compared) for record in before['records']]
+    b = [tuple(record[i] for i in compared) for record in after['records']]
+    if a == b and before['stops'] == after['stops']:
+        return False
+
+    print(f"--- {before['config']}", file = out)
+    hunks = [opcode for opcode in difflib.SequenceMatcher(None, a, b, autojunk = False).get_opcodes() if opcode[0] != 'equal']
+    stop_hunks = [opcode for opcode in difflib.SequenceMatcher(None, before['stops'], after['stops'], autojunk = False).get_opcodes() if opcode[0] != 'equal']
+    removed = [before['records'][i] for tag, i1, i2, j1, j2 in hunks for i in range(i1, i2)]
+    added = [after['records'][j] for tag, i1, i2, j1, j2 in hunks for j in range(j1, j2)]
+    for label, records in (('before', before['records']), ('after', after['records'])):
+        commands, seconds, aspirated, dispensed = summary(records)
+        print(f'  {label:<7} {commands} commands, {seconds / 60:.2f} min, {aspirated:.0f} uL aspirated, {dispensed:.0f} uL dispensed', file = out)
+    removed_summary, added_summary = summary(removed), summary(added)
+    print(f'  changed {len(hunks)} place(s): {len(removed)} commands removed, {len(added)} added, '
+          f'{(added_summary[1] - removed_summary[1]) / 60:+.2f} min, {added_summary[2] - removed_summary[2]:+.0f} uL aspirated, '
+          f'{added_summary[3] - removed_summary[3]:+.0f} uL dispensed', file = out)
+    if stop_hunks:
+        print(f"  pauses: {len(before['stops'])} -> {len(after['stops'])}, "
+              f'{sum(i2 - i1 for tag, i1, i2, j1, j2 in stop_hunks)} removed, {sum(j2 - j1 for tag, i1, i2, j1, j2 in stop_hunks)} added', file = out)
+        for tag, i1, i2, j1, j2 in stop_hunks[:max_hunks]:
+            print(f'  @@ pauses {i1 + 1}-{i2} -> {j1 + 1}-{j2}', file = out)
+            for stop in before['stops'][i1:i2]:
+                print(f'  - {stop[:120]}', file = out)
+            for stop in after['stops'][j1:j2]:
+                print(f'  + {stop[:120]}', file = out)
+
+    for tag, i1, i2, j1, j2 in hunks[:max_hunks]:
+        stop = after['records'][j1][1] if j1 < len(after['records']) else after['records'][-1][1] if after['records'] else 0
+        step = after['stops'][stop - 1] if 0 < stop <= len(after['stops']) else 'start of the run'
+        print(f'  @@ commands {i1 + 1}-{i2} -> {j1 + 1}-{j2}, after: {step[:90]}', file = out)
+        for record in before['records'][i1:i2]:
+            print(f'  - {format_record(record)}', file = out)
+        for record in after['records'][j1:j2]:
+            print(f'  + {format_record(record)}', file = out)
+    if len(hunks) > max_hunks:
+        print(f'  ... {len(hunks) - max_hunks} more place(s) changed', file = out)
+    return True
+
+
+def recording_pairs(before, after):
+    """(before file, after file) pairs of two recordings or of the recordings two directories have in common."""
+    if not os.path.isdir(before):
+        return [(before, after)]
+    names = sorted(name for name in os.listdir(before) if name.endswith(EXTENSION))
+    missing = [name for name in names if not os.path.exists(os.path.join(after, name))]
+    for name in missing:
+        print(f'{name[:-len(EXTENSION)]}: no recording in {after}', file = sys.stderr)
+    return [(os.path.join(before, name), os.path.join(after, name)) for name in names if name not in missing]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('before', help = 'recording, or directory of recordings (benchmark.py --record)')
+    parser.add_argument('after', help = 'recording, or directory of recordings, compared with the first one')
+    parser.add_argument('--max-hunks', type = int, default = 20, help = 'changed places listed per recording (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    differ = False
+    for before, after in recording_pairs(args.before, args.after):
+        differ = diff_recordings(read_recording(before), read_recording(after), args.max_hunks) or differ
+    if not differ:
+        print('The command streams are identical', file = sys.stderr)
+    return 1 if differ else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Reagent prep sheet of a batch of RoboCTAB runs.
+
+Plans the reagents of many runs at once (e.g. a week of runs on several robots)
+with ``reagent_quantities()`` of a protocol, without simulating the runs: the
+extraction buffer components, chloroform:isoamyl alcohol (24:1) and 70% ethanol
+to prepare, and the TE buffer, isopropanol and elution buffer to pour, each with
+the dead volume its reservoir leaves under the aspiration height. One
+consolidated prep sheet (CSV) lists every run and the batch total.
+
+Typical use::
+
+    python tools/reagent_calculator.py --samples 96,192,384,384
+    python tools/reagent_calculator.py --runs week.csv --output prep_sheet.csv
+
+``--runs`` reads a CSV file with a ``run`` and a ``samples`` field on every row,
+and optionally ``reservoir`` (labware load name) and ``elution_volume`` (uL).
+"""
+
+import argparse
+import csv
+import sys
+
+from benchmark import PROTOCOLS, load_protocol
+
+# Prep sheet columns: (title, reagent_quantities() key, factor applied to the value)
+SHEET_COLUMNS = [
+    ('Metabisulfite (g)', 'Metabisulfite', 1),
+    ('PVP-K-29 (g)', 'PVPK29', 1),
+    ('Stock Lysis Solution A (mL)', 'StockLysisSolution_A', 1),
+    ('Stock Lysis Solution B (mL)', 'StockLysisSolution_B', 1),
+    ('Sarkosyl (mL)', 'Sarkosyl', 1),
+    ('Rnase (uL)', 'Rnase', 1),
+    ('Chloroform (mL)', 'Chloroform', 1),
+    ('Isoamyl alcohol (mL)', 'AlcoholIsoamyl', 1),
+    ('Ethanol 95% (mL)', 'Ethanol_95', 1),
+    ('Water for ethanol 70% (mL)', 'Water', 1),
+    ('TE buffer (mL)', 'te_water', 0.001),
+    ('Isopropanol (mL)', 'isopropanol', 0.001),
+    ('Elution buffer (mL)', 'elution_buffer', 0.001),
+]
+
+
+def read_runs(path):
+    """Runs of a CSV file as dicts with run, samples, reservoir and elution_volume (None when not given)."""
+    runs = []
+    with open(path, newline = '', encoding = 'utf-8-sig') as f:        # utf-8-sig: skips the byte order mark spreadsheets write
+        for line, row in enumerate(csv.DictReader(f), start = 2):
+            row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key is not None}     # No name: fields past the header
+            try:
+                samples = int(row['samples'])
+            except (KeyError, ValueError):
+                raise ValueError(f'{path} line {line}: a samples number is needed')
+            runs.append({'run': row.get('run') or str(len(runs) + 1), 'samples': samples,
+                         'reservoir': row.get('reservoir') or None, 'elution_volume': int(row['elution_volume']) if row.get('elution_volume') else None})
+    return runs
+
+
+def prep_sheet(module, runs, reservoir, elution_volume):
+    """Prep sheet rows of ``runs``, then their total. Runs sharing a reservoir and elution volume are planned in one call."""
+    rows = [None] * len(runs)
+    groups = {}
+    for index, run in enumerate(runs):
+        groups.setdefault((run['reservoir'] or reservoir, run['elution_volume'] or elution_volume), []).append(index)
+    for (run_reservoir, run_elution_volume), indexes in groups.items():
+        quantities = module.reagent_quantities([runs[index]['samples'] for index in indexes], run_reservoir, run_elution_volume)
+        for index, reagents in zip(indexes, quantities):
+            values = dict(reagents, **reagents['poured'])
+            rows[index] = dict({'run': runs[index]['run'], 'samples': runs[index]['samples'], 'reservoir': run_reservoir},
+                               **{title: round(values[key] * factor, 3) for title, key, factor in SHEET_COLUMNS})
+    total = {'run': 'TOTAL', 'samples': sum(run['samples'] for run in runs), 'reservoir': ''}
+    total.update({title: round(sum(row[title] for row in rows), 3) for title, key, factor in SHEET_COLUMNS})
+    return rows + [total]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--samples', help = 'comma separated sample numbers, one per run (e.g. 96,192,384)')
+    parser.add_argument('--runs', help = 'CSV file of the runs (run, samples, and optionally reservoir, elution_volume)')
+    parser.add_argument('--protocol', default = 'OT2', choices = sorted(PROTOCOLS), help = 'protocol whose reagent calculator and liquid classes are used')
+    parser.add_argument('--reservoir', default = 'agilent_1_reservoir_290ml', help = 'reservoir load name of the runs (default: %(default)s)')
+    parser.add_argument('--elution-volume', type = int, default = 40, help = 'elution buffer volume per sample, uL (default: %(default)s)')
+    parser.add_argument('--output', help = 'prep sheet CSV file (default: standard output)')
+    args = parser.parse_args(argv)
+
+    if not args.samples and not args.runs:
+        parser.error('give the runs with --samples or --runs')
+    runs = read_runs(args.runs) if args.runs else []
+    if args.samples:
+        runs += [{'run': str(len(runs) + number), 'samples': int(samples), 'reservoir': None, 'elution_volume': None}
+                 for number, samples in enumerate(args.samples.split(','), start = 1)]
+    module = load_protocol(PROTOCOLS[args.protocol])
+    unknown = sorted({run['reservoir'] or args.reservoir for run in runs} - set(module.reservoir_geometries))
+    if unknown:
+        parser.error(f'unknown reservoir(s) {", ".join(unknown)}: choose among {", ".join(module.reservoir_geometries)}')
+
+    rows = prep_sheet(module, runs, args.reservoir, args.elution_volume)
+    output = open(args.output, 'w', newline = '') if args.output else sys.stdout
+    writer = csv.DictWriter(output, fieldnames = ['run', 'samples', 'reservoir'] + [title for title, key, factor in SHEET_COLUMNS])
+    writer.writeheader()
+    writer.writerows(rows)
+    if args.output:
+        output.close()
+        print(f'Prep sheet of {len(runs)} runs ({rows[-1]["samples"]} samples) written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""Timing report of the step logs of real RoboCTAB runs.
+
+Reads the step logs the protocols write on the robots (``roboctab_step_log.jsonl``
+in /data, one JSON line per robot step, see ``StepLog`` in the protocols) of any
+number of OT-2 and Flex runs, and reports:
+
+- the duration percentiles of every robot step and its ratio to the estimate of
+  the timing model, by protocol;
+- the runs, steps and real/estimate ratio of every robot;
+- with ``--columns``, the duration percentiles of every plate column of every step;
+- the slow columns: columns of a run taking more than ``--slow`` times the median
+  of the same step, plate and column over all runs (e.g. a clogged tip while the
+  chloroform is mixed);
+- the ``timing_calibration`` constants of each protocol refitted on the real
+  durations (command overhead, tip pick-up, drop and blow-out times), with the
+  factor of the rest of the estimate (moves, plunger strokes and touch tips).
+  The fit needs the ``estimated_counts`` the protocols log with every step.
+
+A run is identified by its ``run_id`` and ``robot`` (hostname) fields. Older
+lines without them fall back on their run start and log file. The logs are read
+line by line, twice (percentiles, then slow columns), so months of runs from a
+fleet of robots are never held in memory::
+
+    python tools/step_log_report.py robot_logs/ --columns
+    python tools/step_log_report.py ot2_a.jsonl flex_1.jsonl.gz --slow 2
+
+Directories are searched for ``*.jsonl`` and ``*.jsonl.gz`` files.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+from benchmark import PROTOCOLS, load_protocol
+
+# timing_calibration constants refitted. The other constants the estimate counts (home_plunger, unknown_move) are kept as they are.
+FITTED_CONSTANTS = ('command_overhead', 'pick_up_tip', 'drop_tip', 'blow_out')
+
+
+def log_files(paths):
+    """Step log files of ``paths`` (files, or directories searched recursively)."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, names, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                if name.endswith(('.jsonl', '.jsonl.gz')):
+                    yield os.path.join(directory, name)
+
+
+def read_steps(paths, errors):
+    """Streams the steps logged in ``paths``, counting the unreadable lines in ``errors``."""
+    for path in log_files(paths):
+        with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as f:
+            for line_number, line in enumerate(f, start = 1):
+                if not line.strip():
+                    continue
+                try:
+                    step = json.loads(line)
+                    step['seconds'], step['step'], step['protocol'], step['run']
+                except (ValueError, KeyError, TypeError):
+                    errors.append(f'{path} line {line_number}')
+                    continue
+                step.setdefault('run_id', step['run'])
+                step.setdefault('robot', path)
+                yield step
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of sorted ``values``, interpolated between the closest ranks."""
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def solve(matrix, vector):
+    """Solution of the linear system ``matrix`` x = ``vector`` (Gauss-Jordan), None when it is singular."""
+    size = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key = lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-9:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(size):
+            if row != column:
+                factor = rows[row][column] / rows[column][column]
+                rows[row] = [a - factor * b for a, b in zip(rows[row], rows[column])]
+    return [rows[row][size] / rows[row][row] for row in range(size)]
+
+
+class Fit:
+    """Least squares fit, accumulated step by step, of the real step durations of a protocol whose timing model uses
+    ``calibration``: every FITTED_CONSTANTS constant times the number of times the estimate added it, plus a factor of
+    the rest of the estimate, the moves, plunger strokes and touch tips (speeds and flow rates). The dwells and the
+    constants not fitted take the time the estimate gives them."""
+
+    def __init__(self, calibration):
+        size = len(FITTED_CONSTANTS) + 1
+        self.calibration = calibration
+        self.steps = 0
+        self.xtx = [[0.0] * size for _ in range(size)]
+        self.xty = [0.0] * size
+
+    def add(self, step):
+        counts = step.get('estimated_counts')
+        if step.get('estimated_seconds') is None or counts is None:     # Steps logged without the counts of the estimate
+            return
+        constants = {name: count * self.calibration[name] for name, count in counts.items()}
+        fixed = step.get('estimated_dwell_seconds', 0) + sum(seconds for name, seconds in constants.items() if name not in FITTED_CONSTANTS)
+        x = [counts.get(name, 0) for name in FITTED_CONSTANTS]
+        x.append(step['estimated_seconds'] - sum(constants.values()) - step.get('estimated_dwell_seconds', 0))
+        y = step['seconds'] - fixed
+        for i, xi in enumerate(x):
+            self.xty[i] += xi * y
+            for j, xj in enumerate(x):
+                self.xtx[i][j] += xi * xj
+        self.steps += 1
+
+    def constants(self):
+        """(value of every fitted constant, factor of the moves and plunger strokes), None without enough independent steps."""
+        if self.steps <= len(self.xty):
+            return None
+        solution = solve(self.xtx, self.xty)
+        if solution is None:
+            return None
+        return dict(zip(FITTED_CONSTANTS, solution[:-1])), solution[-1]
+
+
+def protocol_calibrations():
+    """timing_calibration of every protocol by protocol name (metadata['protocolName'] logged with the steps)."""
+    calibrations = {}
+    for path in PROTOCOLS.values():
+        module = load_protocol(path)
+        calibrations[module.metadata['protocolName']] = module.timing_calibration
+    return calibrations
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('logs', nargs = '+', help = 'step log files (.jsonl or .jsonl.gz) or directories holding them')
+    parser.add_argument('--columns', action = 'store_true', help = 'also list the duration percentiles of every plate column')
+    parser.add_argument('--slow', type = float, default = 1.5, help = 'a column is slow above this factor of its median duration (default: %(default)s)')
+    parser.add_argument('--min-runs', type = int, default = 5, help = 'runs a column needs before it can be flagged slow (default: %(default)s)')
+    parser.add_argument('--max-flags', type = int, default = 30, help = 'slow columns listed (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    # First pass: durations of every step and column, fit of the timing constants
+    errors = []
+    step_durations = {}                         # (protocol, step) -> [seconds of every run]
+    step_ratios = {}                            # (protocol, step) -> [real / estimated seconds]
+    column_durations = {}                       # (protocol, step, plate, column) -> [seconds]
+    robot_steps = {}                            # robot -> steps logged
+    robot_ratios = {}                           # robot -> [real / estimated seconds]
+    calibrations = protocol_calibrations()
+    fits = {}
+    runs = set()                                # (robot, run id)
+    for step in read_steps(args.logs, errors):
+        key = (step['protocol'], step['step'])
+        runs.add((step['robot'], step['run_id']))
+        robot_steps[step['robot']] = robot_steps.get(step['robot'], 0) + 1
+        step_durations.setdefault(key, []).append(step['seconds'])
+        if step.get('estimated_seconds'):
+            step_ratios.setdefault(key, []).append(step['seconds'] / step['estimated_seconds'])
+            robot_ratios.setdefault(step['robot'], []).append(step['seconds'] / step['estimated_seconds'])
+        for column in step.get('columns', []):
+            if column['plate'] is not None:
+                column_durations.setdefault(key + (column['plate'], column['column']), []).append(column['seconds'])
+        if step['protocol'] in calibrations:
+            fits.setdefault(step['protocol'], Fit(calibrations[step['protocol']])).add(step)
+    for values in list(step_durations.values()) + list(step_ratios.values()) + list(column_durations.values()) + list(robot_ratios.values()):
+        values.sort()
+    if errors:
+        print(f'{len(errors)} unreadable line(s), first: {errors[0]}', file = sys.stderr)
+    if not step_durations:
+        print('No step logged', file = sys.stderr)
+        return 1
+
+    print(f'{len(runs)} runs, {sum(len(values) for values in step_durations.values())} steps')
+    print(f'\n{"Protocol":<28} {"Step":<30} {"n":>5} {"p50 min":>8} {"p90 min":>8} {"p95 min":>8} {"real/estimate":>14}')
+    for (protocol, name), values in sorted(step_durations.items()):
+        ratios = step_ratios.get((protocol, name))
+        ratio = f'{percentile(ratios, 50):.2f}' if ratios else '-'
+        print(f'{protocol:<28} {name:<30} {len(values):>5} {percentile(values, 50) / 60:>8.1f} {percentile(values, 90) / 60:>8.1f} {percentile(values, 95) / 60:>8.1f} {ratio:>14}')
+
+    print(f'\n{"Robot":<40} {"runs":>5} {"steps":>6} {"p50 real/estimate":>18} {"p90 real/estimate":>18}')
+    for robot, steps in sorted(robot_steps.items()):
+        ratios = robot_ratios.get(robot)
+        p50, p90 = (f'{percentile(ratios, 50):.2f}', f'{percentile(ratios, 90):.2f}') if ratios else ('-', '-')
+        print(f'{robot:<40} {sum(run[0] == robot for run in runs):>5} {steps:>6} {p50:>18} {p90:>18}')
+
+    if args.columns:
+        print(f'\n{"Protocol":<28} {"Step":<30} {"Plate":<16} {"Col":>3} {"n":>5} {"p50 s":>7} {"p90 s":>7} {"p95 s":>7}')
+        for (protocol, name, plate, column), values in sorted(column_durations.items()):
+            print(f'{protocol:<28} {name:<30} {plate:<16} {column:>3} {len(values):>5} {percentile(values, 50):>7.1f} {percentile(values, 90):>7.1f} {percentile(values, 95):>7.1f}')
+
+    # Second pass: columns of a run slower than their median
+    medians = {key: percentile(values, 50) for key, values in column_durations.items() if len(values) >= args.min_runs}
+    slow = []
+    for step in read_steps(args.logs, []):
+        for column in step.get('columns', []):
+            key = (step['protocol'], step['step'], column['plate'], column['column'])
+            if key in medians and medians[key] > 0 and column['seconds'] > args.slow * medians[key]:
+                slow.append((column['seconds'] / medians[key], step['robot'], step['run'], key, column['seconds'], medians[key]))
+    print(f'\nSlow columns (over {args.slow} x their median): {len(slow)}')
+    for ratio, robot, run, (protocol, name, plate, column), seconds, median in sorted(slow, reverse = True)[:args.max_flags]:
+        print(f'  {robot}  {run}  {protocol}  {name}  {plate} column {column}: {seconds:.1f} s, median {median:.1f} s (x{ratio:.1f})')
+    if len(slow) > args.max_flags:
+        print(f'  ... {len(slow) - args.max_flags} more')
+
+    # Timing constants refitted on the real durations
+    print('\nFitted timing_calibration constants')
+    for protocol in sorted({protocol for protocol, name in step_durations}):
+        fit = fits.get(protocol)
+        result = fit.constants() if fit else None
+        if result is None:
+            print(f'  {protocol}: not enough steps logged with the counts of their estimate ({fit.steps if fit else 0}) or unknown protocol')
+            continue
+        constants, factor = result
+        values = ', '.join(f"'{name}': {max(value, 0):.2f} (now {fit.calibration[name]})" for name, value in constants.items())
+        print(f'  {protocol} ({fit.steps} steps): {values}; moves, plunger strokes and touch tips take {factor:.2f} x their estimate')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())